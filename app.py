@@ -1,20 +1,120 @@
-from dash import Dash, dcc, html, Input, Output, State, callback
+import os
+import time
+import flask
+from dash import Dash, dcc, html, Input, Output, State, callback, ctx, Patch, ClientsideFunction
 import dash_dangerously_set_inner_html
-from src.create_map import collect_and_clean, create_map
-from src.util import metric_inner_html, subset_inner_html
+from src.build_data import load_dataset, manifest_entry
+from src.geometry import COUNTIES_URL
+from src.create_map import hoverinfo
+from src.figure_cache import TOOLTIP_STATES, make_figure_cache, make_values_cache, warm_figure_cache
+from src.client_data import client_figure, client_store
+from src.summary import prepare_summaries, subset_summary, summary_inner_html
+from src.instrumentation import ENABLED as INSTRUMENT, instrument_app, timed_callback
+from src.health import add_health_check
+from src.api import make_api_cache, add_data_api
+from src.static_assets import add_static_assets
+from src.reload import DataReloader, add_reloader
+from src.util import METRICS, prepare_metrics, prepare_subsets, combine_subsets, metric_inner_html, subset_inner_html
 
-# create app instance
-app = Dash()
+# create app instance (named here, since otherwise Dash looks through the call stack for the name, which slows down the start)
+# responses are compressed when the browser accepts it (with flask-compress), which makes the page with the map data
+# about a third of its size; files that are already compressed (see static_assets.py and api.py) are sent as they are
+app = Dash(__name__, compress=True)
+# the Flask server, for running the app with a WSGI server (i.e. gunicorn app:server)
+server = app.server
 # add an app title
 app.title = "Diplomas and Disadvantage Map"
 # add custom favicon
 app._favicon = "assets/favico.ico"
 
-# run the collect_and_clean function in create_map.py
-counties, ranks, schools = collect_and_clean("raw_data/Index of Deep Disadvantage - Updated.xlsx", "raw_data/CSV_10312024-789.csv")
+# by default the map is sent once with the page and redrawn in the browser (see assets/map_store.js) when a setting changes,
+# so changing a setting doesn't make a request to the server; with CLIENTSIDE_MAP=0 the server redraws it instead
+CLIENTSIDE_MAP = os.environ.get("CLIENTSIDE_MAP", "1") != "0"
+
+# options for the metric dropdown (every metric in util.py) and the subset radio buttons
+METRIC_OPTIONS = list(METRICS)
+SUBSET_OPTIONS = ["All", "HBCUs", "Tribal Colleges", "Community Colleges"]
+
+# function for loading the data and everything built from it (used by the reloader below)
+def load_snapshot() -> dict:
+
+    # load the prebuilt data with the load_dataset function in build_data.py
+    # (collect_and_clean in create_map.py is only rerun when a file in raw_data or the county geojson has changed)
+    # the county geojson can be pointed at a local file or a local HTTP copy with the COUNTIES_GEOJSON environment variable
+    # the county borders the map draws are written to the assets folder as a static file named after its contents, and
+    # every figure points to that file, so the county geojson itself isn't read (geometry=False)
+    counties, ranks, schools = load_dataset("raw_data/Index of Deep Disadvantage - Updated.xlsx", "raw_data/CSV_10312024-789.csv",
+                                            counties_location=os.environ.get("COUNTIES_GEOJSON", COUNTIES_URL),
+                                            assets_location=app.config.assets_folder, geometry=False)
+
+    # compute the values, color ranges, and tooltips for every metric once with the prepare_metrics function in util.py
+    metric_table = prepare_metrics(ranks, schools)
+
+    # compute a bitmap of the schools in every subset once with the prepare_subsets function in util.py
+    subset_bitmaps = prepare_subsets(schools)
+
+    # compute the statistics of every metric for every subset once with the prepare_summaries function in summary.py
+    summaries = prepare_summaries(schools, metric_table, subset_bitmaps)
+
+    # cache built figures so that repeated settings don't rebuild the map (see figure_cache.py)
+    # the cache size can be set with FIGURE_CACHE_SIZE; with FIGURE_CACHE_WARM=1 every combination is built when the data is loaded
+    # each snapshot gets new caches, so no figure made from older data is shown after a reload
+    # (when warming, the cache is made big enough to hold every warmed figure, so the warm-up doesn't push out its own first figures)
+    # the figures point to the static county file instead of holding the county borders (see static_assets.py)
+    warm = os.environ.get("FIGURE_CACHE_WARM") == "1"
+    maxsize = int(os.environ.get("FIGURE_CACHE_SIZE", 256))
+    if warm:
+        maxsize = max(maxsize, len(SUBSET_OPTIONS) * len(METRIC_OPTIONS) * len(TOOLTIP_STATES))
+    cached_map = make_figure_cache(counties, ranks, schools, metric_table, subset_bitmaps, maxsize=maxsize,
+                                   geojson_url=app.get_asset_url(manifest_entry(key="counties_asset")))
+    cached_values = make_values_cache(ranks, schools, metric_table, subset_bitmaps)
+    if warm:
+        warm_figure_cache(cached_map, SUBSET_OPTIONS, METRIC_OPTIONS)
+
+    # when the map is redrawn in the browser, the page comes with the data for every setting (the client_store function in client_data.py)
+    store = client_store(ranks, schools, metric_table, subset_bitmaps, summaries) if CLIENTSIDE_MAP else None
+
+    # the responses of the data endpoints, built once per request and kept compressed (see api.py)
+    version = manifest_entry()
+    api_cache = make_api_cache(ranks, schools, metric_table, subset_bitmaps, version)
+
+    return {"version": version,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "counties": counties,
+            "ranks": ranks,
+            "schools": schools,
+            "metric_table": metric_table,
+            "subset_bitmaps": subset_bitmaps,
+            "summaries": summaries,
+            # the extra subsets the radio button subsets can be combined with
+            "subset_extra_options": [subset for subset in subset_bitmaps if subset != "All"],
+            "cached_map": cached_map,
+            "cached_values": cached_values,
+            "client_store": store,
+            "api_cache": api_cache}
+
+# load the data, and reload it in the background when a file in raw_data changes (see reload.py)
+# the folder is checked every DATA_RELOAD_INTERVAL seconds (5 by default, 0 turns reloading off)
+# /data-version reports the version of the data the app is using
+reloader = DataReloader(load_snapshot, "raw_data", interval=float(os.environ.get("DATA_RELOAD_INTERVAL", 5)))
+add_reloader(app, reloader)
+
+# with INSTRUMENT=1, every callback request is timed stage by stage (see instrumentation.py): the timings are logged,
+# sent back in the Server-Timing header, and summed up with the cache statistics on /metrics
+if INSTRUMENT:
+    instrument_app(app, lambda: {"cached_map": reloader.current["cached_map"], "cached_values": reloader.current["cached_values"]})
+
+# /health reports the data version and the memory of every worker (see health.py)
+add_health_check(app, lambda: reloader.current["version"])
+
+# /api/v1 serves the county and school data as JSON or Arrow for scripts (see api.py)
+add_data_api(app, lambda: reloader.current["api_cache"])
+
+# the static county file is sent precompressed and cached by the browser for good (see static_assets.py)
+add_static_assets(app)
 
 # create the layout for the page
-def layout() -> list:
+def layout(snapshot: dict) -> list:
 
     # define a header for the top of the page
     header = html.H1("Diplomas and Disadvantage: Mapping U.S. Colleges on County Disadvantage Metrics")
@@ -24,21 +124,7 @@ def layout() -> list:
     
     # create the metric dropdown list, Rank is default
     met_dd = dcc.Dropdown(id="met_dd", 
-                          options=["Rank",
-                                   "Raw Disadvantage",
-                                   "Percent Below Poverty Line",
-                                   "Percent Below Deep Poverty Line",
-                                   "Life Expectancy",
-                                   "Low Birth Weight Rate",
-                                   "Percent White", 
-                                   "Percent Black",
-                                   "Percent Native",
-                                   "Percent Less Than High School Diploma",
-                                   "Percent College Graduates", 
-                                   "Unemployment Rate",
-                                   "Gini Coefficient",
-                                   "Socioeconomic Mobility",
-                                   "Climate Disasters"],
+                          options=METRIC_OPTIONS,
                           value="Rank"
                           )
 
@@ -47,10 +133,25 @@ def layout() -> list:
 
     # create the subset radio buttons, All is default
     subset_radio = dcc.RadioItems(id="subset_radio",
-                                  options=["All", "HBCUs", "Tribal Colleges", "Community Colleges"],
+                                  options=SUBSET_OPTIONS,
                                   value="All"
                                  )
 
+    # create the dropdown of extra subsets that can be combined with the radio button subset, none by default
+    subset_extra = dcc.Dropdown(id="subset_extra",
+                                options=snapshot["subset_extra_options"],
+                                value=[],
+                                multi=True,
+                                placeholder="Combine with other subsets (optional)")
+
+    # create the radio buttons for how the subsets are combined, union is default
+    subset_op = dcc.RadioItems(id="subset_op",
+                               options=["Union", "Intersection"],
+                               value="Union",
+                               inline=True,
+                               inputStyle={"margin-left": "20px",
+                                           "margin-right": "5px"})
+
     # create the label for the check buttons
     tooltip_label = html.Label("Select which tooltips you would like to see:")
 
@@ -74,11 +175,23 @@ def layout() -> list:
                                 "background-color": "#fcdcbb"}),     
                 subset_label,                                    # add the subset radio buttons label (defined above)
                 subset_radio,                                    # add the subset radio buttons (defined above)
+                subset_extra,                                    # add the extra subsets dropdown (defined above)
+                subset_op,                                       # add the union/intersection radio buttons (defined above)
                 html.Div(id="subset_description",                # add a description for the subset (controlled by callback below)
                          style={"margin": "2%",
                                 "background-color": "#fcdcbb"}),  
-                html.Center(dcc.Graph(id="graph"),               # add map (controlled by callback below)
-                            style = {"margin": "1%"}), 
+                html.Div([dcc.Graph(id="graph"),                 # add map (controlled by callback below)
+                          html.Div(id="summary",                 # add the summary statistics next to the map (controlled by callback below)
+                                   style={"margin-left": "2%",
+                                          "width": "320px",
+                                          "font-size": "small"})],
+                         style={"display": "flex",
+                                "justify-content": "center",
+                                "align-items": "flex-start",
+                                "margin": "1%"}),
+                dcc.Store(id="map_store"),                       # add the data for redrawing the map in the browser (filled in below)
+                dcc.Store(id="map_version",                      # add the version of the data the page was built from
+                          data=snapshot["version"]),
                 html.Center(tooltip_label),                      # add the tooltip check buttons label (defined above)
                 html.Center(tooltip_checklist),                  # add the tooltip check buttons (defined above)
                 # add link to the University of Michigan site at the bottom
@@ -91,19 +204,40 @@ def layout() -> list:
     # return the layout
     return children
 
-# add the layout to the application
-app.layout = html.Div(id="main-div", children=layout())
+# function for building the page from the active data snapshot
+def serve_layout():
+    snapshot = reloader.current
+    page = html.Div(id="main-div", children=layout(snapshot))
+
+    # when the map is redrawn in the browser, the page comes with the data for every setting and only the parts of the map
+    # that are the same for every setting (client_figure in client_data.py); the browser draws the default map from the
+    # data when the page loads, so the county values and the school points and names aren't sent twice
+    # (Dash also builds the layout once when it is set, outside of any request, only to check the ids of the components,
+    # so the map is only built for a page someone asked for, and not while the app starts)
+    if CLIENTSIDE_MAP and flask.has_request_context():
+        page["graph"].figure = client_figure(snapshot["cached_map"]("All", "Rank", True, True))
+        page["map_store"].data = snapshot["client_store"]
+    return page
+
+# add the layout to the application; it is rebuilt for every page load, so a new page always gets the current data
+app.layout = serve_layout
+
+# inputs for the map and the subset description
+MAP_INPUTS = [Input("subset_radio", "value"),
+              Input("subset_extra", "value"),
+              Input("subset_op", "value"),
+              Input("met_dd", "value"),
+              Input("tooltip_checklist", "value")]
+SUBSET_INPUTS = MAP_INPUTS[:3]
+
+# function for displaying/refreshing the map on the server (used when CLIENTSIDE_MAP=0)
+def display_map(subset_radio, subset_extra, subset_op, met_dd, tooltip_checklist, map_version):
 
-# callback for creating the map
-@app.callback(
-    Output("graph", "figure"),
-    Input("subset_radio", "value"),
-    Input("met_dd", "value"),
-    Input("tooltip_checklist", "value")
-)
+    # use one data snapshot for the whole callback, even if the data is reloaded while it runs
+    snapshot = reloader.current
 
-# function for displaying/refreshing the map
-def display_map(subset_radio, met_dd, tooltip_checklist):
+    # run combine_subsets function in util.py to get the label of the chosen subset (i.e. "HBCUs ∩ Community Colleges")
+    subset = combine_subsets(subset_radio, subset_extra, subset_op)
 
     # set county tooltip option based on tooltip check button
     if "County" in tooltip_checklist:
@@ -117,14 +251,45 @@ def display_map(subset_radio, met_dd, tooltip_checklist):
     else:
         school_tooltip = False
     
-    # run create_map function in create_map.py
-    return create_map(subset_radio, met_dd, county_tooltip, school_tooltip, counties, ranks, schools)
+    # on page load there is no map in the browser yet, so send the whole map, and do the same for a page built before
+    # the data was reloaded, since its counties may not line up with the new data
+    # (get the map from the figure cache; create_map in create_map.py is only run the first time a combination is chosen)
+    changed = ctx.triggered_prop_ids
+    if not changed or map_version != snapshot["version"]:
+        return snapshot["cached_map"](subset, met_dd, county_tooltip, school_tooltip)
 
-# callback for metric description
-@app.callback(
-    Output("met_description", "children"),
-    Input("met_dd", "value")
-)
+    # otherwise only send the parts of the map that changed; the county geojson, the county locations, and the county
+    # names in the tooltips are never sent again
+    values = snapshot["cached_values"](subset, met_dd)
+    patched_figure = Patch()
+
+    # a new metric changes the county colors, the values and templates of both tooltips, and the title, and so does a new
+    # subset for a proximity metric
+    subset_changed = changed.keys() & {"subset_radio.value", "subset_extra.value", "subset_op.value"}
+    if "met_dd.value" in changed or (subset_changed and METRICS[met_dd].get("by_subset")):
+        patched_figure["data"][0]["z"] = values["z"]
+        patched_figure["data"][0]["zmin"] = values["zmin"]
+        patched_figure["data"][0]["zmax"] = values["zmax"]
+        patched_figure["data"][0]["colorscale"] = values["colorscale"]
+        patched_figure["data"][0]["hovertemplate"] = values["county_hovertemplate"]
+        patched_figure["data"][1]["customdata"] = values["school_values"]
+        patched_figure["data"][1]["hovertemplate"] = values["school_hovertemplate"]
+        patched_figure["layout"]["title"]["text"] = values["title"]
+
+    # a new subset changes the school points, their tooltips, and the title
+    if subset_changed:
+        patched_figure["data"][1]["lon"] = values["lon"]
+        patched_figure["data"][1]["lat"] = values["lat"]
+        patched_figure["data"][1]["text"] = values["school_labels"]
+        patched_figure["data"][1]["customdata"] = values["school_values"]
+        patched_figure["layout"]["title"]["text"] = values["title"]
+
+    # the tooltip check buttons only toggle the tooltips on or off
+    if "tooltip_checklist.value" in changed:
+        patched_figure["data"][0]["hoverinfo"] = hoverinfo(county_tooltip)
+        patched_figure["data"][1]["hoverinfo"] = hoverinfo(school_tooltip)
+
+    return patched_figure
 
 # function for metric description
 def description_met(met_dd):
@@ -132,16 +297,48 @@ def description_met(met_dd):
     # run metric_inner_html function in util.py to get metric-specific description
     return dash_dangerously_set_inner_html.DangerouslySetInnerHTML(metric_inner_html(met_dd))
 
-# callback for subset description
-@app.callback(
-    Output("subset_description", "children"),
-    Input("subset_radio", "value")
-)
+# function for the summary statistics next to the map
+def summary_panel(subset_radio, subset_extra, subset_op, met_dd):
+    # use one data snapshot for the whole callback, even if the data is reloaded while it runs
+    snapshot = reloader.current
+    subset = combine_subsets(subset_radio, subset_extra, subset_op)
+
+    # look up the statistics in the summary cube with the subset_summary function in summary.py
+    # (only a combined subset has the statistics of its counties computed here)
+    summary = subset_summary(snapshot["summaries"], subset, met_dd, snapshot["schools"], snapshot["metric_table"], snapshot["subset_bitmaps"])
+    return dash_dangerously_set_inner_html.DangerouslySetInnerHTML(summary_inner_html(summary, met_dd))
 
 # function for subset description
-def description_subset(subset_radio):
+def description_subset(subset_radio, subset_extra, subset_op):
     # run subset_inner_html in util.py to get subset-specific description
-    return dash_dangerously_set_inner_html.DangerouslySetInnerHTML(subset_inner_html(subset_radio))
+    return dash_dangerously_set_inner_html.DangerouslySetInnerHTML(subset_inner_html(combine_subsets(subset_radio, subset_extra, subset_op)))
+
+# callbacks for the map, the summary, and the descriptions, run by the display_map, summary_panel, description_met, and
+# description_subset functions in assets/map_store.js, or by the functions above when CLIENTSIDE_MAP=0
+if CLIENTSIDE_MAP:
+    app.clientside_callback(ClientsideFunction(namespace="map", function_name="display_map"),
+                            Output("graph", "figure"),
+                            *MAP_INPUTS,
+                            State("map_store", "data"),
+                            State("graph", "figure"))
+    app.clientside_callback(ClientsideFunction(namespace="map", function_name="summary_panel"),
+                            Output("summary", "children"),
+                            *SUBSET_INPUTS,
+                            Input("met_dd", "value"),
+                            State("map_store", "data"))
+    app.clientside_callback(ClientsideFunction(namespace="map", function_name="description_met"),
+                            Output("met_description", "children"),
+                            Input("met_dd", "value"),
+                            State("map_store", "data"))
+    app.clientside_callback(ClientsideFunction(namespace="map", function_name="description_subset"),
+                            Output("subset_description", "children"),
+                            *SUBSET_INPUTS,
+                            State("map_store", "data"))
+else:
+    app.callback(Output("graph", "figure"), *MAP_INPUTS, State("map_version", "data"))(timed_callback(display_map))
+    app.callback(Output("summary", "children"), *SUBSET_INPUTS, Input("met_dd", "value"))(timed_callback(summary_panel))
+    app.callback(Output("met_description", "children"), Input("met_dd", "value"))(timed_callback(description_met))
+    app.callback(Output("subset_description", "children"), *SUBSET_INPUTS)(timed_callback(description_subset))
 
 # when this script is run, app starts
 if __name__ == "__main__":
@@ -0,0 +1,369 @@
+// clientside callbacks for app.py
+// the map_store dcc.Store holds the data from client_store in src/client_data.py, which is sent once with the page,
+// so changing the metric, subset, or tooltips redraws the map in the browser without a request to the server
+
+// subset bitmaps, unpacked the first time they are needed
+const subsetBits = {};
+
+// same as combine_subsets in src/util.py: returns the label of the subset made from the radio button and the extra subsets
+function combineSubsets(store, subsetRadio, subsetExtra, subsetOp) {
+    let names = [subsetRadio].concat((subsetExtra || []).filter(name => name !== subsetRadio));
+
+    // "All" joined with anything is still "All", and "All" intersected with anything is the other subsets
+    if (names.includes("All") && names.length > 1) {
+        if (subsetOp === "Union") {
+            return "All";
+        }
+        names = names.filter(name => name !== "All");
+    }
+    return names.join(subsetOp === "Union" ? store.union : store.intersection);
+}
+
+// same as create_title in src/util.py
+function createTitle(store, subset, metric) {
+    const subsetPhrase = subset === "All" ? "U.S. Colleges" : subset;
+    return subsetPhrase + " on " + store.metrics[metric].title;
+}
+
+// returns the names of the subsets in a subset label, and whether they are intersected
+function subsetNames(store, subset) {
+    if (subset.includes(store.intersection)) {
+        return [subset.split(store.intersection), true];
+    }
+    return [subset.split(store.union), false];
+}
+
+// returns the packed bitmap of a subset from prepare_subsets in src/util.py
+function bitmap(store, name) {
+    if (!(name in subsetBits)) {
+        subsetBits[name] = Uint8Array.from(atob(store.subsets[name]), c => c.charCodeAt(0));
+    }
+    return subsetBits[name];
+}
+
+// same as subset_rows in src/util.py: returns the row numbers of the schools in the subset
+function subsetRows(store, subset) {
+    const [names, intersect] = subsetNames(store, subset);
+    const combined = Uint8Array.from(bitmap(store, names[0]));
+    for (const name of names.slice(1)) {
+        const other = bitmap(store, name);
+        for (let i = 0; i < combined.length; i++) {
+            combined[i] = intersect ? combined[i] & other[i] : combined[i] | other[i];
+        }
+    }
+
+    // bits are packed the way np.packbits packs them, with the first row in the highest bit
+    const rows = [];
+    for (let row = 0; row < store.lon.length; row++) {
+        if (combined[row >> 3] & (0x80 >> (row & 7))) {
+            rows.push(row);
+        }
+    }
+    return rows;
+}
+
+// same as haversine_miles in src/proximity.py: the great-circle distance in miles between two points
+const EARTH_RADIUS_MILES = 3958.8;
+const RADIANS = Math.PI / 180;
+function haversineMiles(lon1, lat1, lon2, lat2) {
+    const sinLat = Math.sin((lat2 * RADIANS - lat1 * RADIANS) / 2);
+    const sinLon = Math.sin((lon2 * RADIANS - lon1 * RADIANS) / 2);
+    const a = sinLat * sinLat + Math.cos(lat1 * RADIANS) * Math.cos(lat2 * RADIANS) * (sinLon * sinLon);
+    return 2 * EARTH_RADIUS_MILES * Math.asin(Math.sqrt(Math.min(Math.max(a, 0), 1)));
+}
+
+// rounds to 1 decimal the way numpy does (a value exactly halfway goes to the even neighbor)
+function roundTenths(value) {
+    const scaled = value * 10;
+    let rounded = Math.round(scaled);
+    if (rounded - scaled === 0.5 && rounded % 2 !== 0) {
+        rounded -= 1;
+    }
+    return rounded / 10;
+}
+
+// the proximity metrics of a combined subset, measured from each county centroid to the subset's own schools
+// (the same values as subset_proximity in src/proximity.py): the miles to the nearest school, and the schools within each radius
+// the schools are sorted by latitude, so only the schools whose latitude is close enough are measured
+const subsetPoints = {};
+function subsetProximity(store, subset, miles) {
+    const key = subset + "|" + miles;
+    if (key in subsetPoints) {
+        return subsetPoints[key];
+    }
+    const rows = subsetRows(store, subset).sort((a, b) => store.lat[a] - store.lat[b]);
+    const lats = rows.map(row => store.lat[row]);
+    const lons = rows.map(row => store.lon[row]);
+
+    // the first school at or above a latitude
+    const firstAbove = lat => {
+        let low = 0, high = lats.length;
+        while (low < high) {
+            const middle = (low + high) >> 1;
+            if (lats[middle] < lat) { low = middle + 1; } else { high = middle; }
+        }
+        return low;
+    };
+
+    const values = store.centroid_lon.map((lon, county) => {
+        const lat = store.centroid_lat[county];
+        if (lon === null || lat === null) {
+            return miles === null ? null : 0;
+        }
+        // no school is closer than the difference in latitude alone
+        const degrees = (miles === null ? Infinity : miles) / EARTH_RADIUS_MILES / RADIANS * (1 + 1e-9);
+        if (miles !== null) {
+            let count = 0;
+            for (let k = firstAbove(lat - degrees); k < lats.length && lats[k] <= lat + degrees; k++) {
+                if (haversineMiles(lon, lat, lons[k], lats[k]) <= miles) {
+                    count++;
+                }
+            }
+            return count;
+        }
+        let best = Infinity;
+        let up = firstAbove(lat), down = up - 1;
+        while (up < lats.length || down >= 0) {
+            const upGap = up < lats.length ? (lats[up] - lat) * RADIANS * EARTH_RADIUS_MILES : Infinity;
+            const downGap = down >= 0 ? (lat - lats[down]) * RADIANS * EARTH_RADIUS_MILES : Infinity;
+            if (Math.min(upGap, downGap) > best * (1 + 1e-9)) {
+                break;
+            }
+            const k = upGap <= downGap ? up++ : down--;
+            best = Math.min(best, haversineMiles(lon, lat, lons[k], lats[k]));
+        }
+        return best === Infinity ? null : roundTenths(best);
+    });
+
+    const numbers = values.filter(value => value !== null);
+    subsetPoints[key] = {
+        zmin: numbers.length ? Math.min(...numbers) : null,
+        zmax: numbers.length ? Math.max(...numbers) : null,
+        county_values: values
+    };
+    return subsetPoints[key];
+}
+
+// same as metric_settings in src/util.py: returns the color range and county values of the metric, for the subset if they depend on it
+// (the proximity metrics of the prebuilt subsets are in the store; only a combined subset's are measured here)
+function metricSettings(store, metric, subset) {
+    const settings = store.metrics[metric];
+    if (settings.by_subset) {
+        if (subset in settings.subsets) {
+            return settings.subsets[subset];
+        }
+        return subsetProximity(store, subset, settings.miles);
+    }
+    return settings;
+}
+
+// same as the school tooltip names in prepare_metrics in src/util.py (the values are filled in by the hovertemplates)
+function schoolLabel(store, row) {
+    return store.school_names[row] + "<br>County: " + store.county_names[store.school_county[row]];
+}
+
+// same as quantile in src/summary.py
+function quantile(ordered, q) {
+    const position = (ordered.length - 1) * q;
+    const low = Math.floor(position);
+    const high = Math.min(low + 1, ordered.length - 1);
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low);
+}
+
+// same as summary_stats in src/summary.py: returns [counties, mean, median, q1, q3] and the histogram counts of the values
+function summaryStats(values, edges) {
+    values = values.filter(value => value !== null && !isNaN(value));
+    const histogram = new Array(edges.length - 1).fill(0);
+    if (values.length === 0) {
+        return [[0, null, null, null, null], histogram];
+    }
+    const ordered = Float64Array.from(values).sort();
+    let total = 0;
+    for (const value of values) {
+        total += value;
+    }
+    for (const value of values) {
+        // the last bin whose lower edge is at or below the value, with a value on the last edge in the last bin
+        let bin = value === edges[edges.length - 1] ? edges.length - 2 : -1;
+        if (bin < 0) {
+            while (bin + 1 < edges.length && edges[bin + 1] <= value) {
+                bin++;
+            }
+        }
+        if (bin >= 0 && bin < edges.length - 1) {
+            histogram[bin]++;
+        }
+    }
+    return [[values.length, total / values.length, quantile(ordered, 0.5), quantile(ordered, 0.25), quantile(ordered, 0.75)], histogram];
+}
+
+// same as histogram_edges in src/summary.py (numpy's linspace)
+function histogramEdges(settings, bins) {
+    // a subset without any values (i.e. an empty intersection) has no edges, like the NaN edges from numpy
+    if (settings.zmin === null || settings.zmax === null) {
+        return new Array(bins + 1).fill(null);
+    }
+    const step = (settings.zmax - settings.zmin) / bins;
+    const edges = [];
+    for (let k = 0; k < bins; k++) {
+        edges.push(k * step + settings.zmin);
+    }
+    edges.push(settings.zmax);
+    return edges;
+}
+
+// same as summary_decimals in src/summary.py
+function summaryDecimals(edges) {
+    const span = edges[edges.length - 1] - edges[0];
+    if (!(span > 0)) {
+        return 2;
+    }
+    return Math.min(4, Math.max(0, 2 - Math.floor(Math.log10(span))));
+}
+
+// same as subset_summary in src/summary.py: looks up the summary cube, and computes the host counties of a combined subset
+// (and for the proximity metrics, all counties too, since a combined subset has its own values)
+function subsetSummary(store, subset, metric) {
+    const cube = store.summaries;
+    const j = cube.metrics.indexOf(metric);
+    if (cube.subsets.includes(subset)) {
+        const i = cube.subsets.indexOf(subset);
+        return {host: cube.host[i][j], all: cube.all[i][j], hostHistogram: cube.host_histogram[i][j], allHistogram: cube.all_histogram[i][j],
+                edges: cube.edges[i][j], decimals: cube.decimals[i][j]};
+    }
+
+    const settings = metricSettings(store, metric, subset);
+    const values = settings.county_values;
+    let edges, decimals, all, allHistogram;
+    if (store.metrics[metric].by_subset) {
+        edges = histogramEdges(settings, cube.edges[0][j].length - 1);
+        decimals = summaryDecimals(edges);
+        [all, allHistogram] = summaryStats(values, edges);
+    } else {
+        [edges, decimals, all, allHistogram] = [cube.edges[0][j], cube.decimals[0][j], cube.all[0][j], cube.all_histogram[0][j]];
+    }
+
+    // the values of the counties with a school in the subset, in county order
+    const hosts = new Uint8Array(store.county_names.length);
+    for (const row of subsetRows(store, subset)) {
+        hosts[store.school_county[row]] = 1;
+    }
+    const [host, hostHistogram] = summaryStats(values.filter((value, county) => hosts[county]), edges);
+    return {host: host, all: all, hostHistogram: hostHistogram, allHistogram: allHistogram, edges: edges, decimals: decimals};
+}
+
+// same as format_stat in src/summary.py
+function formatStat(value, decimals) {
+    return value === null || isNaN(value) ? "–" : value.toFixed(decimals);
+}
+
+// same as summary_inner_html in src/summary.py (the statistics are in the order of STATS: counties, mean, median, q1, q3)
+function summaryHtml(store, summary, metric) {
+    const host = summary.host;
+    const all = summary.all;
+    const decimals = summary.decimals;
+    let html = "<b>" + metric + "</b><br>Counties with schools in the subset (" + host[0] + ") compared with all counties (" + all[0] + ")";
+    html += "<table><tr><th></th><th>Subset counties</th><th>All counties</th></tr>";
+    store.summaries.stat_labels.forEach((label, k) => {
+        html += "<tr><td>" + label + "</td><td>" + formatStat(host[k + 1], decimals) + "</td><td>" + formatStat(all[k + 1], decimals) + "</td></tr>";
+    });
+    html += "</table>";
+
+    // one row per bin, with a bar for the share of the subset counties and of all counties
+    html += "<table>";
+    const edges = summary.edges;
+    for (let k = 0; k < edges.length - 1; k++) {
+        const hostShare = host[0] ? 100 * summary.hostHistogram[k] / host[0] : 0;
+        const allShare = all[0] ? 100 * summary.allHistogram[k] / all[0] : 0;
+        html += "<tr><td>" + formatStat(edges[k], decimals) + " – " + formatStat(edges[k + 1], decimals) + "</td><td style=\"width: 60%\">" +
+                "<div style=\"background-color: darkorange; height: 6px; width: " + hostShare.toFixed(1) + "%\"></div>" +
+                "<div style=\"background-color: #000d5e; height: 6px; width: " + allShare.toFixed(1) + "%\"></div></td></tr>";
+    }
+    html += "</table>";
+    return html;
+}
+
+// same as hoverinfo in src/create_map.py
+function hoverinfo(tooltip) {
+    return tooltip ? "text" : "skip";
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map: {
+        // same as display_map in app.py: returns the map for the chosen settings, built from the current one
+        display_map: function(subsetRadio, subsetExtra, subsetOp, metDd, tooltipChecklist, store, figure) {
+            if (!store || !figure || !(metDd in store.metrics)) {
+                return window.dash_clientside.no_update;
+            }
+            const subset = combineSubsets(store, subsetRadio, subsetExtra, subsetOp);
+            const settings = metricSettings(store, metDd, subset);
+            const rows = subsetRows(store, subset);
+
+            // the page comes with only the parts of the map that never change (client_figure in src/client_data.py), and
+            // this fills in the rest, both when the page loads and when a setting changes; the county geojson, the county
+            // locations, and the layout are reused as they are
+            const z = settings.county_values;
+            const counties = Object.assign({}, figure.data[0], {
+                z: z,
+                zmin: settings.zmin,
+                zmax: settings.zmax,
+                colorscale: store.metrics[metDd].colorscale,
+                text: store.county_names,
+                hovertemplate: store.metrics[metDd].county_hovertemplate,
+                hoverinfo: hoverinfo(tooltipChecklist.includes("County"))
+            });
+            const points = Object.assign({}, figure.data[1], {
+                lon: rows.map(row => store.lon[row]),
+                lat: rows.map(row => store.lat[row]),
+                text: rows.map(row => schoolLabel(store, row)),
+                customdata: rows.map(row => z[store.school_county[row]]),
+                hovertemplate: store.metrics[metDd].school_hovertemplate,
+                hoverinfo: hoverinfo(tooltipChecklist.includes("School"))
+            });
+            const layout = Object.assign({}, figure.layout, {
+                title: Object.assign({}, figure.layout.title, {text: createTitle(store, subset, metDd)})
+            });
+            return Object.assign({}, figure, {data: [counties, points], layout: layout});
+        },
+
+        // same as summary_panel in app.py
+        summary_panel: function(subsetRadio, subsetExtra, subsetOp, metDd, store) {
+            if (!store || !(metDd in store.metrics)) {
+                return null;
+            }
+            const subset = combineSubsets(store, subsetRadio, subsetExtra, subsetOp);
+            return {namespace: "dash_dangerously_set_inner_html",
+                    type: "DangerouslySetInnerHTML",
+                    props: {children: summaryHtml(store, subsetSummary(store, subset, metDd), metDd)}};
+        },
+
+        // same as description_met in app.py
+        description_met: function(metDd, store) {
+            if (!store || !(metDd in store.metrics)) {
+                return null;
+            }
+            return {namespace: "dash_dangerously_set_inner_html",
+                    type: "DangerouslySetInnerHTML",
+                    props: {children: store.metrics[metDd].description}};
+        },
+
+        // same as description_subset in app.py (subset_inner_html in src/util.py)
+        description_subset: function(subsetRadio, subsetExtra, subsetOp, store) {
+            if (!store) {
+                return null;
+            }
+            const subset = combineSubsets(store, subsetRadio, subsetExtra, subsetOp);
+            const [names, intersect] = subsetNames(store, subset);
+            const descriptions = names.map(name => store.subset_descriptions[name] || "").filter(description => description);
+
+            // say how the subsets are combined when there is more than one
+            if (names.length > 1) {
+                descriptions.push("The map shows the schools that are in " + (intersect ? "all" : "any") +
+                                  " of these subsets: " + names.join(", ") + ".");
+            }
+            return {namespace: "dash_dangerously_set_inner_html",
+                    type: "DangerouslySetInnerHTML",
+                    props: {children: descriptions.join("<br><br>")}};
+        }
+    }
+});
@@ -0,0 +1,13 @@
+import os
+
+# settings for running the app with gunicorn: gunicorn -c gunicorn.conf.py wsgi:server
+
+# load the app once in the parent process and fork the workers from it (see wsgi.py)
+preload_app = True
+
+# number of worker processes, and the address and port to listen on
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+bind = os.environ.get("BIND", "127.0.0.1:" + os.environ.get("PORT", "8050"))
+
+# the first request for a new map can take about a second, so give workers time to answer
+timeout = 60
@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import json
+from functools import lru_cache
+import pandas as pd
+import pyarrow as pa
+
+try:
+    # works if run by app.py
+    from src.util import METRICS, combine_subsets, metric_settings, subset_rows
+except:
+    # works if run as standalone program
+    from util import METRICS, combine_subsets, metric_settings, subset_rows
+
+# path every data endpoint is under; a new version gets a new path, so scripts using this one keep working
+API_PREFIX = "/api/v1"
+
+# media types of the two formats the endpoints can return
+FORMATS = {"json": "application/json",
+           "arrow": "application/vnd.apache.arrow.stream"}
+
+# function used in the make_api_cache function
+def api_tables(ranks: pd.core.frame.DataFrame,
+               schools: pd.core.frame.DataFrame
+               ) -> dict:
+    """
+    Returns the tables the endpoints read from: the county table as it is ("counties"), the schools with their county's
+    fips code and name ("schools"), and the schools joined with every county column ("bulk", like the merged data from
+    collect_and_clean in create_map.py). The row of each school's county ("county") is only used inside the app, so it is left out.
+    """
+    county = schools["county"].to_numpy()
+    school_table = schools.drop(columns="county")
+    school_table.insert(3, "fips", ranks["fips"].to_numpy()[county])
+    school_table.insert(4, "county_name", ranks["name"].to_numpy()[county])
+    county_columns = ranks.drop(columns=["fips", "name"]).iloc[county].reset_index(drop=True)
+    return {"counties": ranks,
+            "schools": school_table,
+            "bulk": pd.concat([school_table, county_columns], axis=1)}
+
+# function used in the make_api_cache function
+def serialize(frame: pd.core.frame.DataFrame,
+              fmt: str,
+              meta: dict
+              ) -> bytes:
+    """
+    Returns the frame as a JSON object (meta with the rows under "data") or as an Arrow IPC stream (with meta in the schema metadata).
+    """
+    if fmt == "arrow":
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"api": json.dumps(meta).encode()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    # pandas writes the rows (with missing values as null) and the rest is added around them
+    return (json.dumps(meta)[:-1] + ',"data":' + frame.to_json(orient="records") + "}").encode()
+
+# function used at the beginning of the app.py file
+def make_api_cache(ranks: pd.core.frame.DataFrame,
+                   schools: pd.core.frame.DataFrame,
+                   metric_table: dict,
+                   subset_bitmaps: dict,
+                   version: str,
+                   maxsize: int = 128
+                   ):
+    """
+    Returns a cached function that builds the response body of a data endpoint, gzip compressed, for one version of the data.
+    Each distinct request (endpoint, filters, columns, page, and format) is built once; repeating it is a dictionary lookup.
+    The function takes the endpoint ("counties", "schools", or "bulk") and a tuple of the request's parameters (see query_parameters),
+    returns a dictionary with the compressed "body", the strong "etag" (made from the data version and the parameters),
+    the "mimetype", and the "total" number of rows before the page was cut, and raises ValueError for parameters that don't exist.
+    """
+    tables = api_tables(ranks, schools)
+
+    @lru_cache(maxsize=maxsize)
+    def cached_response(endpoint: str,
+                        parameters: tuple
+                        ) -> dict:
+        query = dict(parameters)
+        frame = tables[endpoint]
+
+        # filters: counties by fips code, schools by subset (combined with op, like the subset settings in the app)
+        if endpoint == "counties" and query["fips"]:
+            frame = frame[frame["fips"].isin(query["fips"])]
+        if endpoint in ["schools", "bulk"] and query["subset"]:
+            unknown = [name for name in query["subset"] if name not in subset_bitmaps]
+            if unknown:
+                raise ValueError(f"unknown subset: {', '.join(unknown)} (choose from {', '.join(subset_bitmaps)})")
+            subset = combine_subsets(query["subset"][0], list(query["subset"][1:]), query["op"].title())
+            if subset != "All":
+                frame = frame.iloc[subset_rows(subset, subset_bitmaps, len(schools))]
+        else:
+            subset = "All"
+
+        # the schools can get the value of one metric for their county (for the proximity metrics, the value for the subset)
+        if endpoint == "schools" and query["metric"]:
+            if query["metric"] not in METRICS:
+                raise ValueError(f"unknown metric: {query['metric']}")
+            values = metric_settings(metric_table, query["metric"], subset)["school_values"]
+            frame = frame.assign(**{query["metric"]: values[frame.index.to_numpy()]})
+
+        # column projection
+        if query["columns"]:
+            unknown = [column for column in query["columns"] if column not in frame.columns]
+            if unknown:
+                raise ValueError(f"unknown column: {', '.join(unknown)}")
+            frame = frame[list(query["columns"])]
+
+        # pagination
+        total = len(frame)
+        end = None if query["limit"] is None else query["offset"] + query["limit"]
+        frame = frame.iloc[query["offset"]:end]
+
+        meta = {"version": version, "total": total, "offset": query["offset"], "limit": query["limit"], "columns": list(frame.columns)}
+        body = serialize(frame.reset_index(drop=True), query["format"], meta)
+        key = json.dumps([endpoint, parameters]).encode()
+        return {"body": gzip.compress(body, compresslevel=6, mtime=0),
+                "etag": f"{version}-{hashlib.sha256(key).hexdigest()[:16]}",
+                "mimetype": FORMATS[query["format"]],
+                "total": total}
+
+    return cached_response
+
+# function used in the add_data_api function
+def query_parameters(request,
+                     fips: str = None
+                     ) -> tuple:
+    """
+    Returns the parameters of a data request as a sorted tuple, so the same request always gets the same cache entry and ETag.
+    Raises ValueError for a parameter that can't be read.
+    format: "json" or "arrow" (or an Accept header asking for Arrow); columns: comma-separated column names;
+    offset and limit: the rows to return; fips: comma-separated fips codes; subset (repeatable) and op ("union" or "intersection");
+    metric: a metric in the metric dropdown.
+    """
+    args = request.args
+    fmt = args.get("format")
+    if fmt is None:
+        fmt = "arrow" if request.accept_mimetypes.best_match(list(FORMATS.values())) == FORMATS["arrow"] else "json"
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt} (choose from {', '.join(FORMATS)})")
+    try:
+        offset = int(args.get("offset", 0))
+        limit = int(args["limit"]) if "limit" in args else None
+    except ValueError:
+        raise ValueError("offset and limit must be whole numbers")
+    if offset < 0 or (limit is not None and limit < 1):
+        raise ValueError("offset must be 0 or more and limit must be 1 or more")
+    op = args.get("op", "union").lower()
+    if op not in ["union", "intersection"]:
+        raise ValueError("op must be union or intersection")
+
+    split = lambda value: tuple(part.strip() for part in value.split(",") if part.strip()) if value else ()
+    return tuple(sorted({"format": fmt,
+                         "columns": split(args.get("columns")),
+                         "offset": offset,
+                         "limit": limit,
+                         "fips": split(fips or args.get("fips")),
+                         "subset": tuple(args.getlist("subset")),
+                         "op": op,
+                         "metric": args.get("metric")}.items()))
+
+# function used at the beginning of the app.py file
+def add_data_api(app,
+                 api_cache):
+    """
+    Adds the read-only data endpoints to the Dash app's Flask server, under API_PREFIX:
+    /counties (and /counties/<fips>) for the county metrics, /schools for the schools with their county, and /bulk for the
+    schools joined with every county column. Each returns JSON or Arrow (see query_parameters for the options).
+    Api_cache is a function that returns the function from make_api_cache for the data in use, so a reload switches to new
+    responses (and new ETags). Bodies are sent gzip compressed when the client accepts it, and a request with the ETag
+    of the current response in If-None-Match gets an empty 304 response.
+    """
+    import flask
+
+    api = flask.Blueprint("data_api", __name__, url_prefix=API_PREFIX)
+
+    def respond(endpoint, fips=None):
+        request = flask.request
+        try:
+            entry = api_cache()(endpoint, query_parameters(request, fips))
+        except ValueError as error:
+            return flask.jsonify({"error": str(error)}), 400
+        if endpoint == "counties" and fips and entry["total"] == 0:
+            return flask.jsonify({"error": f"no county with fips {fips}"}), 404
+
+        # the compressed and uncompressed bodies are different representations, so they get different ETags
+        compressed = "gzip" in request.accept_encodings
+        etag = entry["etag"] + ("-gzip" if compressed else "")
+        if request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            body = entry["body"] if compressed else gzip.decompress(entry["body"])
+            response = flask.Response(body, mimetype=entry["mimetype"])
+            if compressed:
+                response.headers["Content-Encoding"] = "gzip"
+            response.headers["X-Total-Count"] = str(entry["total"])
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+        # clients may keep the response, but must check the ETag before reusing it, since the data can be reloaded
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @api.route("/counties")
+    def counties():
+        return respond("counties")
+
+    @api.route("/counties/<fips>")
+    def county(fips):
+        return respond("counties", fips)
+
+    @api.route("/schools")
+    def schools():
+        return respond("schools")
+
+    @api.route("/bulk")
+    def bulk():
+        return respond("bulk")
+
+    app.server.register_blueprint(api)
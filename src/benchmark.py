@@ -0,0 +1,195 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    # works if run from the main folder (i.e. python -m src.benchmark)
+    from src.create_map import MAP_ZOOM, collect_and_clean, compact_frames, create_map
+    from src.geometry import COUNTIES_URL, counties_levels, counties_for_zoom, counties_asset
+    from src.util import METRICS, SUBSETS, prepare_metrics, prepare_subsets
+    from src.timing import stage_timer
+    from src.proximity import add_proximity
+except:
+    # works if run as standalone program
+    from create_map import MAP_ZOOM, collect_and_clean, compact_frames, create_map
+    from geometry import COUNTIES_URL, counties_levels, counties_for_zoom, counties_asset
+    from util import METRICS, SUBSETS, prepare_metrics, prepare_subsets
+    from timing import stage_timer
+    from proximity import add_proximity
+
+# the subsets in the subset radio buttons in app.py
+BENCHMARK_SUBSETS = ["All"] + list(SUBSETS)
+
+# columns with the school coordinates in the schools csv
+LON_COLUMN = "HD2023.Longitude location of institution"
+LAT_COLUMN = "HD2023.Latitude location of institution"
+
+# function used in the run_benchmark function
+def scale_schools(schools_location: str,
+                  scale: int,
+                  output_location: str,
+                  jitter: float = 0.005,
+                  seed: int = 0
+                  ) -> int:
+    """
+    Writes a synthetic schools csv with scale copies of every school and returns the number of rows written.
+    The first copy is the original data; the others get a new unitid and coordinates moved by up to jitter degrees,
+    so the spatial join has distinct points to match (a few may land in a neighboring county).
+    Schools_location is the file location of the schools data (i.e. "raw_data/CSV_10312024-789.csv")
+    """
+
+    # keep the header as it is (it has two "institution name" columns) and every value as text
+    with open(schools_location, newline="") as f:
+        header = next(csv.reader(f))
+    schools = pd.read_csv(schools_location, dtype=str, keep_default_na=False)
+
+    rng = np.random.default_rng(seed)
+    copies = [schools]
+    for copy in range(1, scale):
+        synthetic = schools.copy()
+        synthetic["unitid"] = (schools["unitid"].astype("int64") + copy * 10_000_000).astype(str)
+        for column in [LON_COLUMN, LAT_COLUMN]:
+            values = pd.to_numeric(schools[column], errors="coerce")
+            synthetic[column] = (values + rng.uniform(-jitter, jitter, len(values))).round(6).astype(str)
+        copies.append(synthetic)
+    pd.concat(copies, ignore_index=True).to_csv(output_location, header=header, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    return len(schools) * scale
+
+# function used in the run_benchmark function
+def benchmark_maps(counties,
+                   ranks: pd.core.frame.DataFrame,
+                   schools: pd.core.frame.DataFrame,
+                   geojson_url: str = None
+                   ) -> list:
+    """
+    Returns the time create_map takes and the size of the figure sent to the browser for every subset and metric.
+    The size is the figure as plotly serializes it, in bytes.
+    Geojson_url is the URL of the static county file the figures point to, as in figure_cache.py and export.py, so the size
+    is what the app sends; without it, every figure holds the county geojson.
+    """
+
+    # plotly's serializer is the one Dash uses for the figure
+    from plotly.io.json import to_json_plotly
+
+    metric_table = prepare_metrics(ranks, schools)
+    subset_bitmaps = prepare_subsets(schools)
+    maps = []
+    for subset in BENCHMARK_SUBSETS:
+        for metric in METRICS:
+            start = time.perf_counter()
+            fig = create_map(subset, metric, True, True, counties, ranks, schools, metric_table, subset_bitmaps, geojson_url)
+            seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            payload = to_json_plotly(fig.to_dict())
+            serialize_seconds = time.perf_counter() - start
+            maps.append({"subset": subset, "metric": metric, "seconds": round(seconds, 4),
+                         "serialize_seconds": round(serialize_seconds, 4), "bytes": len(payload.encode())})
+    return maps
+
+# function used in the __main__ block
+def run_benchmark(ranks_location: str,
+                  schools_location: str,
+                  counties_location: str = COUNTIES_URL,
+                  cache_location: str = "data_cache",
+                  scales: tuple = (1,),
+                  maps: bool = True
+                  ) -> dict:
+    """
+    Returns the benchmark results for each scale of the schools data, ready to be written as JSON.
+    For each scale, the ingest stages of collect_and_clean (see timing.py) and, if maps is True, every create_map call are timed.
+    Counties_location should be a local file, or a URL that is already cached in cache_location, so nothing is downloaded.
+    """
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                               "machine": platform.machine()},
+               "runs": []}
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in scales:
+            # scale 1 reads the original file, larger scales read a synthetic copy
+            if scale == 1:
+                location, rows = schools_location, None
+            else:
+                location = os.path.join(folder, f"schools_x{scale}.csv")
+                rows = scale_schools(schools_location, scale, location)
+
+            timings = {}
+            start = time.perf_counter()
+            counties, ranks, schools = collect_and_clean(ranks_location, location, counties_location, cache_location, timings)
+            with stage_timer(timings, "compact"):
+                ranks, schools = compact_frames(ranks, schools)
+            with stage_timer(timings, "proximity"):
+                ranks = add_proximity(ranks, schools, counties)
+            with stage_timer(timings, "levels"):
+                counties = counties_levels(counties)
+            run = {"scale": scale,
+                   "schools_rows": rows or len(pd.read_csv(location, usecols=["unitid"])),
+                   "schools_matched": len(schools),
+                   "ingest_seconds": round(time.perf_counter() - start, 4),
+                   "ingest": {stage: round(seconds, 4) for stage, seconds in timings.items()}}
+            if maps:
+                # the figures point to the static county file by URL, the way the app and the export send them, and the
+                # county file's size is reported on its own, since the browser downloads it once for every map
+                counties_name, counties_data = counties_asset(counties_for_zoom(counties, MAP_ZOOM))
+                run["counties_bytes"] = len(counties_data)
+                run["maps"] = benchmark_maps(counties, ranks, schools, "/assets/" + counties_name)
+                run["maps_seconds"] = round(sum(item["seconds"] for item in run["maps"]), 4)
+                run["maps_bytes"] = sum(item["bytes"] for item in run["maps"])
+            results["runs"].append(run)
+    return results
+
+# function used in the __main__ block
+def compare_results(old: dict,
+                    new: dict
+                    ) -> list:
+    """
+    Returns one line of text per scale and stage comparing two benchmark results (the ratio is new time / old time).
+    """
+    lines = []
+    old_runs = {run["scale"]: run for run in old["runs"]}
+    for run in new["runs"]:
+        if run["scale"] not in old_runs:
+            continue
+        before = old_runs[run["scale"]]
+        stages = {**run["ingest"], "ingest total": run["ingest_seconds"]}
+        previous = {**before["ingest"], "ingest total": before["ingest_seconds"]}
+        if "maps_seconds" in run and "maps_seconds" in before:
+            stages["create_map total"] = run["maps_seconds"]
+            previous["create_map total"] = before["maps_seconds"]
+        for stage, seconds in stages.items():
+            if previous.get(stage):
+                lines.append(f"x{run['scale']} {stage}: {previous[stage]:.3f} s -> {seconds:.3f} s ({seconds / previous[stage]:.2f}x)")
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times collect_and_clean and create_map, and writes the results as JSON.")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1],
+                        help="copies of the schools data to benchmark (i.e. --scale 1 10 100)")
+    parser.add_argument("--counties", default=os.environ.get("COUNTIES_GEOJSON", COUNTIES_URL),
+                        help="local county geojson, or a URL already cached in the cache folder")
+    parser.add_argument("--no-maps", action="store_true", help="only time the ingest stages")
+    parser.add_argument("--output", default="benchmark.json", help="file the results are written to")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmark("../raw_data/Index of Deep Disadvantage - Updated.xlsx", "../raw_data/CSV_10312024-789.csv",
+                            args.counties, "../data_cache", args.scale, not args.no_maps)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for run in results["runs"]:
+        print(f"x{run['scale']} ({run['schools_rows']} schools): ingest {run['ingest_seconds']:.3f} s")
+        for stage, seconds in run["ingest"].items():
+            print(f"  {stage}: {seconds:.3f} s")
+        if "maps" in run:
+            print(f"  create_map: {run['maps_seconds']:.3f} s for {len(run['maps'])} maps, "
+                  f"{run['maps_bytes'] / len(run['maps']) / 1e6:.2f} MB per map "
+                  f"(and the county file, downloaded once: {run['counties_bytes'] / 1e6:.2f} MB)")
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare_results(json.load(f), results)))
@@ -0,0 +1,352 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from contextlib import contextmanager
+import pandas as pd
+from pyarrow import feather
+
+try:
+    # file locks are only available on Unix; elsewhere builds are not protected from running at the same time
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    # brotli compresses the static county file better than gzip; without it only the gzip copy is written
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    # works if run by app.py
+    from src.geometry import COUNTIES_URL, LEVELS, counties_file, load_counties, counties_levels, counties_for_zoom, levels_report, counties_asset
+    from src.timing import stage_timer
+    from src.instrumentation import log_event
+    from src.util import PROXIMITY_RADII
+except:
+    # works if run as standalone program
+    from geometry import COUNTIES_URL, LEVELS, counties_file, load_counties, counties_levels, counties_for_zoom, levels_report, counties_asset
+    from timing import stage_timer
+    from instrumentation import log_event
+    from util import PROXIMITY_RADII
+
+# name of the manifest that records which inputs the prebuilt data was made from
+MANIFEST = "manifest.json"
+
+# version of the files build_dataset writes; raise it when their format changes so that older prebuilt data is rebuilt
+# (2: Arrow files instead of parquet, 3: compact ranks and schools tables, 4: proximity metrics in the ranks table,
+#  5: name of the static county file in the manifest, 6: county centroids in the ranks table,
+#  7: valid simplified county borders and no "medium" level of detail)
+LAYOUT = 7
+
+# names of the static county files written by write_counties_asset (the contents hash is part of the name)
+COUNTIES_ASSET = re.compile(r"counties\.[0-9a-f]{16}\.json")
+
+# function used in the input_hashes function
+def file_hash(location: str
+              ) -> str:
+    """
+    Returns the sha256 hex digest of the file's contents.
+    Location is the file location (i.e. "raw_data/CSV_10312024-789.csv")
+    """
+    digest = hashlib.sha256()
+    with open(location, "rb") as f:
+        # read in 1 MB blocks so large extracts don't have to fit in memory twice
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# function used in the build_dataset and load_dataset functions
+def input_hashes(raw_data_location: str,
+                 counties_location: str
+                 ) -> dict:
+    """
+    Returns a dictionary mapping each input file name to the hash of its contents.
+    Raw_data_location is the folder with the ranks and schools data (i.e. "raw_data")
+    Counties_location is the file location of the local copy of the county geojson
+    """
+    hashes = {}
+    for name in sorted(os.listdir(raw_data_location)):
+        path = os.path.join(raw_data_location, name)
+        if os.path.isfile(path) and not name.startswith("."):
+            hashes["raw_data/" + name] = file_hash(path)
+    hashes["counties"] = file_hash(counties_location)
+    return hashes
+
+# function used in the build_dataset function
+@contextmanager
+def replace_file(location: str):
+    """
+    Yields a temporary file location to write to, and moves the finished file over location at the end of the with block.
+    Readers never see a half-written file, and a process that has the old file memory-mapped (see read_arrow) keeps
+    reading the old contents instead of crashing.
+    """
+    temporary = location + ".tmp"
+    yield temporary
+    os.replace(temporary, location)
+
+# function used in the load_dataset function
+@contextmanager
+def build_lock(cache_location: str):
+    """
+    Holds a lock on the cache folder for the duration of the with block, so that when several worker processes notice
+    changed inputs at the same time, only the first one rebuilds the data and the others wait and then load it.
+    """
+    os.makedirs(cache_location, exist_ok=True)
+    with open(os.path.join(cache_location, ".lock"), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+# function used in the build_dataset function
+def map_counties_asset(counties_by_zoom: list
+                       ) -> list:
+    """
+    Returns the name and contents of the static county file (see counties_asset in geometry.py) for the level of detail the map opens at.
+    """
+    try:
+        from src.create_map import MAP_ZOOM
+    except:
+        from create_map import MAP_ZOOM
+    return counties_asset(counties_for_zoom(counties_by_zoom, MAP_ZOOM))
+
+# function used in the build_dataset function
+def write_counties_asset(name: str,
+                         data: bytes,
+                         assets_location: str,
+                         keep: int = 2):
+    """
+    Writes the static county file (see counties_asset in geometry.py) to the assets folder as it is, gzip compressed (".gz"),
+    and brotli compressed (".br", if brotli is installed), so the app can send it compressed without compressing it per request.
+    Only the newest keep county files are kept, so a page loaded just before the county geojson changed can still get its file.
+    """
+    location = os.path.join(assets_location, name)
+    files = {location: data, location + ".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        files[location + ".br"] = brotli.compress(data, quality=11)
+    for file, contents in files.items():
+        with replace_file(file) as temporary, open(temporary, "wb") as f:
+            f.write(contents)
+
+    # remove the older county files
+    older = [file for file in os.listdir(assets_location) if COUNTIES_ASSET.fullmatch(file) and file != name]
+    older.sort(key=lambda file: os.path.getmtime(os.path.join(assets_location, file)), reverse=True)
+    for file in older[keep - 1:]:
+        for suffix in ["", ".gz", ".br"]:
+            if os.path.exists(os.path.join(assets_location, file + suffix)):
+                os.remove(os.path.join(assets_location, file + suffix))
+
+# function used in the load_dataset function
+def read_arrow(location: str
+               ) -> pd.core.frame.DataFrame:
+    """
+    Returns the dataframe in an Arrow file written by build_dataset, with the file memory-mapped.
+    Number columns without missing values point straight at the mapped file instead of being copied, so they are
+    read-only, and every worker process of a WSGI server shares the same pages (see wsgi.py).
+    """
+    return feather.read_table(location, memory_map=True).to_pandas(split_blocks=True)
+
+# function used in the build_dataset and load_dataset functions
+def level_location(cache_location: str,
+                   name: str
+                   ) -> str:
+    """
+    Returns the file location of the simplified county geojson for the level of detail with the given name (i.e. "low")
+    """
+    return os.path.join(cache_location, f"counties_{name}.json")
+
+# function used in the load_dataset function
+def missing_files(cache_location: str,
+                  assets_location: str = None
+                  ) -> list:
+    """
+    Returns the locations of the files load_dataset reads that aren't in the cache folder (or the assets folder), so that
+    prebuilt data with a manifest but without all of its files (i.e. files deleted by hand, or written for a different
+    list of levels in LEVELS without a change to LAYOUT) is rebuilt instead of failing to load.
+    """
+    expected = [os.path.join(cache_location, "ranks.arrow"), os.path.join(cache_location, "schools.arrow")]
+    expected += [level_location(cache_location, level["name"]) for level in LEVELS
+                 if not (level["tolerance"] == 0 and level["decimals"] is None)]
+    # without a manifest there is no asset name, but the data is rebuilt anyway
+    asset_name = manifest_entry(cache_location, "counties_asset")
+    if assets_location is not None and asset_name is not None:
+        expected.append(os.path.join(assets_location, asset_name))
+    return [location for location in expected if not os.path.exists(location)]
+
+# function used in the build_dataset function
+def counties_unchanged(cache_location: str,
+                       counties_hash: str,
+                       assets_location: str = None
+                       ) -> bool:
+    """
+    Returns True if the simplified county borders and the static county file from the last build can be kept as they are:
+    the last build read the same county geojson (counties_hash, see input_hashes) into the same LAYOUT, and its files are still there.
+    This lets a rebuild for a changed file in raw_data skip simplifying the county borders again (see simplify_counties in geometry.py).
+    """
+    inputs = manifest_entry(cache_location, "inputs") or {}
+    if inputs.get("counties") != counties_hash or manifest_entry(cache_location, "layout") != LAYOUT or manifest_entry(cache_location, "levels") is None:
+        return False
+    expected = [level_location(cache_location, level["name"]) for level in LEVELS
+                if not (level["tolerance"] == 0 and level["decimals"] is None)]
+    if assets_location is not None:
+        asset_name = manifest_entry(cache_location, "counties_asset")
+        if asset_name is None:
+            return False
+        expected.append(os.path.join(assets_location, asset_name))
+    return all(os.path.exists(location) for location in expected)
+
+def build_dataset(ranks_location: str,
+                  schools_location: str,
+                  cache_location: str = "data_cache",
+                  counties_location: str = COUNTIES_URL,
+                  assets_location: str = None
+                  ) -> dict:
+    """
+    Runs collect_and_clean and writes compact ranks and schools tables (see compact_frames in create_map.py) to the cache folder;
+    returns the manifest.
+    The counties output is not written again, since it is the local copy of the county geojson from geometry.py,
+    but a simplified copy is written for each level of detail in LEVELS (i.e. "data_cache/counties_low.json").
+    Ranks_location is the file location of the ranks data (i.e. "raw_data/Index of Deep Disadvantage - Updated.xlsx")
+    Schools_location is the file location of the schools data (i.e. "raw_data/CSV_10312024-789.csv")
+    Cache_location is the folder that holds the prebuilt data (i.e. "data_cache")
+    Counties_location is the URL or file location of the county geojson (a URL is downloaded once into the cache folder)
+    Assets_location is the folder the static county file is written to (i.e. "assets", see write_counties_asset), or None to only
+    record its name in the manifest
+    """
+
+    # collect_and_clean needs geopandas, so it is only imported when the data has to be rebuilt
+    try:
+        from src.create_map import collect_and_clean, compact_frames, memory_report
+        from src.proximity import add_proximity
+    except:
+        from create_map import collect_and_clean, compact_frames, memory_report
+        from proximity import add_proximity
+
+    counties_location = counties_file(counties_location, cache_location)
+    hashes = input_hashes(os.path.dirname(ranks_location), counties_location)
+    # checked before anything is written, since the manifest is about the last build
+    reuse_counties = counties_unchanged(cache_location, hashes["counties"], assets_location)
+    timings = {}
+    counties, ranks, schools = collect_and_clean(ranks_location, schools_location, counties_location, cache_location, timings)
+
+    # the shapely points are only used for the county match, so schools is compared as a plain dataframe
+    schools = pd.DataFrame(schools).drop(columns="coordinates")
+
+    # keep only what the app uses, with each school pointing at its county's row instead of holding a copy of it
+    # (the memory report compares this with the merged data from collect_and_clean)
+    with stage_timer(timings, "compact"):
+        compact_ranks, compact_schools = compact_frames(ranks, schools)
+    memory = {"merged": memory_report({"ranks": ranks, "schools": schools}),
+              "compact": memory_report({"ranks": compact_ranks, "schools": compact_schools})}
+    ranks, schools = compact_ranks, compact_schools
+
+    # distances from each county to the nearest school and the schools within each radius, for every subset (see proximity.py)
+    with stage_timer(timings, "proximity"):
+        ranks = add_proximity(ranks, schools, counties, PROXIMITY_RADII)
+
+    # write the outputs as uncompressed Arrow files (columnar and typed, so nothing is inferred when loading,
+    # and laid out so that load_dataset can memory-map them instead of reading them into memory)
+    with replace_file(os.path.join(cache_location, "ranks.arrow")) as location:
+        feather.write_feather(ranks, location, compression="uncompressed")
+    with replace_file(os.path.join(cache_location, "schools.arrow")) as location:
+        feather.write_feather(schools, location, compression="uncompressed")
+
+    # the simplified county borders and the static county file only depend on the county geojson, so when only a file in
+    # raw_data has changed, the ones from the last build are kept (see counties_unchanged)
+    if reuse_counties:
+        asset_name = manifest_entry(cache_location, "counties_asset")
+        levels = manifest_entry(cache_location, "levels")
+    else:
+        # simplify the county borders for each level of detail (the full level is the county geojson itself)
+        with stage_timer(timings, "levels"):
+            counties_by_zoom = counties_levels(counties)
+        for level in counties_by_zoom:
+            if level["geojson"] is not counties:
+                with replace_file(level_location(cache_location, level["name"])) as location, open(location, "w") as f:
+                    json.dump(level["geojson"], f, separators=(",", ":"))
+        levels = levels_report(counties_by_zoom)
+
+        # the county geojson the map draws, as a static file named after its contents that the figures point to by URL
+        asset_name, asset_data = map_counties_asset(counties_by_zoom)
+        if assets_location is not None:
+            write_counties_asset(asset_name, asset_data, assets_location)
+
+    # the manifest is written last, so a build that fails part way is rebuilt on the next start
+    # the stage timings from collect_and_clean are kept in the manifest to show where ingest time goes
+    # the size of each level of detail is kept as well, to show what each one costs to send to the browser
+    # the version covers the layout as well as the inputs, so responses built from an older format are never taken for current ones
+    manifest = {"inputs": hashes,
+                "layout": LAYOUT,
+                "proximity_radii": PROXIMITY_RADII,
+                "counties_asset": asset_name,
+                "version": hashlib.sha256(json.dumps([hashes, PROXIMITY_RADII, LAYOUT], sort_keys=True).encode()).hexdigest()[:16],
+                "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+                "memory_mb": memory,
+                "levels": levels}
+    with replace_file(os.path.join(cache_location, MANIFEST)) as location, open(location, "w") as f:
+        json.dump(manifest, f, indent=2)
+    log_event("build_dataset", version=manifest["version"], seconds=manifest["timings"])
+    return manifest
+
+# function used at the beginning of the app.py file
+def load_dataset(ranks_location: str,
+                 schools_location: str,
+                 cache_location: str = "data_cache",
+                 counties_location: str = COUNTIES_URL,
+                 assets_location: str = None,
+                 geometry: bool = True
+                 ) -> list:
+    """
+    Returns list with counties data, clean ranks data, and clean schools data from the prebuilt files in the cache folder.
+    The counties data is the list of levels of detail from counties_levels in geometry.py, so create_map can pick one by zoom.
+    With geometry=False the county geojson isn't read at all and the counties data is None, for maps that point to the
+    static county file instead (reading the full and simplified geojson takes about half a second).
+    The files are rebuilt first if any of them are missing (see missing_files), were written in an older format (see LAYOUT),
+    or if any file in the raw data folder or the county geojson has changed.
+    With assets_location, the static county file named in the manifest is rebuilt as well if it isn't there (see build_dataset).
+    """
+
+    with build_lock(cache_location):
+        # compare the inputs on disk with the ones the prebuilt data was made from
+        # (and the proximity radii it was built with, see PROXIMITY_RADII in util.py)
+        hashes = input_hashes(os.path.dirname(ranks_location), counties_file(counties_location, cache_location))
+        if (manifest_entry(cache_location, "inputs") != hashes or manifest_entry(cache_location, "layout") != LAYOUT
+                or manifest_entry(cache_location, "proximity_radii") != PROXIMITY_RADII or missing_files(cache_location, assets_location)):
+            build_dataset(ranks_location, schools_location, cache_location, counties_location, assets_location)
+
+        # load the prebuilt data
+        counties = [] if geometry else None
+        for level in LEVELS if geometry else []:
+            if level["tolerance"] == 0 and level["decimals"] is None:
+                geojson = load_counties(counties_location, cache_location)
+            else:
+                geojson = load_counties(level_location(cache_location, level["name"]))
+            counties.append({**level, "geojson": geojson})
+        ranks = read_arrow(os.path.join(cache_location, "ranks.arrow"))
+        schools = read_arrow(os.path.join(cache_location, "schools.arrow"))
+    return [counties, ranks, schools]
+
+# function used in the load_dataset function, in app.py, and in health.py
+def manifest_entry(cache_location: str = "data_cache",
+                   key: str = "version"):
+    """
+    Returns one entry of the manifest of the prebuilt data in the cache folder (i.e. its "version"), or None if there is no manifest.
+    """
+    try:
+        with open(os.path.join(cache_location, MANIFEST)) as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+if __name__ == "__main__":
+    manifest = build_dataset("../raw_data/Index of Deep Disadvantage - Updated.xlsx", "../raw_data/CSV_10312024-789.csv", "../data_cache",
+                             assets_location="../assets")
+    print(f"built data version {manifest['version']}")
+    for stage, seconds in manifest["timings"].items():
+        print(f"  {stage}: {seconds:.3f} s")
+    for layout, report in manifest["memory_mb"].items():
+        print(f"  {layout} data: ranks {report['ranks']:.2f} MB, schools {report['schools']:.2f} MB")
+    for level in manifest["levels"]:
+        print(f"  {level['name']} counties: {level['points']} points, {level['bytes'] / 1e6:.2f} MB")
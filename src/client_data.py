@@ -0,0 +1,109 @@
+import base64
+import numpy as np
+import pandas as pd
+
+try:
+    # works if run by app.py
+    from src.util import METRICS, UNION, INTERSECTION, hovertemplates, metric_values, subset_description
+    from src.summary import STAT_LABELS
+except:
+    # works if run as standalone program
+    from util import METRICS, UNION, INTERSECTION, hovertemplates, metric_values, subset_description
+    from summary import STAT_LABELS
+
+# function used in the client_store function
+def _json_list(values: np.ndarray
+               ) -> list:
+    """
+    Returns the values as a plain list, with missing values as None so they are sent to the browser as null.
+    """
+    return [None if pd.isna(value) else value for value in values.tolist()]
+
+# function used in the client_store function
+def _json_cube(values: np.ndarray
+               ) -> list:
+    """
+    Returns an array with any number of dimensions (i.e. the statistics in the summary cube) as nested lists, with missing values as None.
+    """
+    if values.ndim == 1:
+        return _json_list(values)
+    return [_json_cube(part) for part in values]
+
+# the parts of each trace of the map that the display_map function in assets/map_store.js fills in from the store
+# (county trace first, then the school trace)
+CLIENT_FILLED = [["z", "zmin", "zmax", "colorscale", "text", "hovertemplate", "hoverinfo"],
+                 ["lon", "lat", "text", "customdata", "hovertemplate", "hoverinfo"]]
+
+# function used in the serve_layout function in app.py
+def client_figure(figure: dict
+                  ) -> dict:
+    """
+    Returns the map figure without the parts that are filled in from the store in the browser (see CLIENT_FILLED),
+    so the page doesn't send the county values and the school points and names twice.
+    What is left is the same for every setting (i.e. the layout, the county locations, and the URL of the county geojson).
+    """
+    data = [{key: value for key, value in trace.items() if key not in filled} for trace, filled in zip(figure["data"], CLIENT_FILLED)]
+    return {**figure, "data": data}
+
+# function used at the beginning of the app.py file
+def client_store(ranks: pd.core.frame.DataFrame,
+                 schools: pd.core.frame.DataFrame,
+                 metric_table: dict,
+                 subset_bitmaps: dict,
+                 summaries: dict
+                 ) -> dict:
+    """
+    Returns everything the browser needs to redraw the map for any metric, subset, or tooltip setting.
+    It is put in a dcc.Store once with the page, and the display_map function in assets/map_store.js builds each update from it,
+    so changing a setting doesn't need a request to the server.
+    Metric_table and subset_bitmaps are the outputs of prepare_metrics and prepare_subsets in util.py,
+    and summaries is the summary cube from prepare_summaries in summary.py.
+    """
+
+    # values for each metric as numbers (missing values as null), and the hovertemplates that show them in the tooltips
+    # the proximity metrics have the values precomputed for every prebuilt subset, under "subsets" (see metric_settings in
+    # util.py); only a combined subset's values are measured in the browser (see subsetProximity in assets/map_store.js)
+    def county_settings(metric, table, subset=None):
+        return {"zmin": _json_list(np.array([table["zmin"]]))[0],
+                "zmax": _json_list(np.array([table["zmax"]]))[0],
+                "county_values": _json_list(metric_values(metric, ranks, subset).to_numpy())}
+
+    metrics = {}
+    for metric, settings in METRICS.items():
+        table = metric_table[metric]
+        if settings.get("by_subset"):
+            values = {"by_subset": True,
+                      "miles": settings.get("miles"),
+                      "subsets": {subset: county_settings(metric, subset_table, subset) for subset, subset_table in table["subsets"].items()}}
+            colorscale = next(iter(table["subsets"].values()))["colorscale"]
+        else:
+            values = county_settings(metric, table)
+            colorscale = table["colorscale"]
+        metrics[metric] = {"title": settings["title"],
+                           "description": settings["description"],
+                           "colorscale": [list(step) for step in colorscale],
+                           **hovertemplates(metric),
+                           **values}
+
+    # subsets are sent as the packed bitmaps from prepare_subsets (base64 encoded), and combined in the browser
+    subsets = {name: base64.b64encode(bitmap.tobytes()).decode() for name, bitmap in subset_bitmaps.items()}
+
+    return {"metrics": metrics,
+            "subsets": subsets,
+            "subset_descriptions": {name: subset_description(name) for name in subset_bitmaps},
+            "union": UNION,
+            "intersection": INTERSECTION,
+            "county_names": ranks["name"].tolist(),
+            "school_names": schools["name"].tolist(),
+            # each school's row in ranks, so the school tooltips reuse the county names and values
+            "school_county": schools["county"].tolist(),
+            "lon": schools["lon"].tolist(),
+            "lat": schools["lat"].tolist(),
+            # the county centroids the proximity metrics are measured from (see add_proximity in proximity.py)
+            "centroid_lon": _json_list(ranks["centroid_lon"].to_numpy()),
+            "centroid_lat": _json_list(ranks["centroid_lat"].to_numpy()),
+            # the summary cube, looked up by the summary panel in the browser
+            "summaries": {"subsets": summaries["subsets"],
+                          "metrics": summaries["metrics"],
+                          "stat_labels": list(STAT_LABELS.values()),
+                          **{part: _json_cube(summaries[part]) for part in ["host", "all", "host_histogram", "all_histogram", "edges", "decimals"]}}}
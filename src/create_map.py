@@ -1,52 +1,136 @@
-import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
 import plotly.graph_objects as go
-from urllib.request import urlopen
-import json
 pd.options.mode.chained_assignment = None
 
 try:
     # works if run by app.py
-    from src.util import create_title, subset_schools, county_settings
+    from src.util import METRICS, create_title, subset_rows, prepare_metrics, prepare_subsets, metric_settings
+    from src.geometry import COUNTIES_URL, load_counties, counties_to_gdf, counties_for_zoom
+    from src.timing import stage_timer, hot_stage
 except:
     # works if run as standalone program
-    from util import create_title, subset_schools, county_settings
+    from util import METRICS, create_title, subset_rows, prepare_metrics, prepare_subsets, metric_settings
+    from geometry import COUNTIES_URL, load_counties, counties_to_gdf, counties_for_zoom
+    from timing import stage_timer, hot_stage
+
+# zoom the map opens at, centered on the continental US (also picks which level of detail of the county borders is drawn)
+MAP_ZOOM = 3
+
+# column types for the ranks data, so read_excel doesn't have to infer them
+RANKS_DTYPES = {"rank1": "int64", "fips": str, "placefips": "float64", "name": str, "index": "float64",
+                "mobility": "float64", "mobility.zscore": "float64", "pct_belowpov": "float64", "pct_belowpov.zscore": "float64",
+                "pct_deeppov": "float64", "pct_deeppov.zscore": "float64", "life_exp": "float64", "life_exp.zscore": "float64",
+                "lbw": "float64", "lbw.zscore": "float64", "urban": "float64", "rural": "float64", "reservation": "float64",
+                "city": "int64", "tot.pop": "int64", "pct.white.nonhisp": "float64", "pct.black.nonhisp": "float64",
+                "pct.asian.nonhisp": "float64", "pct.native": "float64", "pct.hisp": "float64", "pct.less.than.HS": "float64",
+                "pct.HS.grad": "float64", "pct.college.grad": "float64", "unemployment.rate": "float64",
+                "labor.force.participation.rate": "float64", "gini": "float64", "tot.hh": "int64", "pct.ling.isol.hh": "float64",
+                "pct.fem.led.child.hh": "float64", "pct.renter.hh": "float64", "pct.owner.hh": "float64",
+                "pct.hh.housing.burdened": "float64", "pct.hh.severe.hb": "float64", "pct.hh.housing.burdened.renters": "float64",
+                "pct.hh.housing.burdened.owners": "float64", "climate.disasters": "float64", "hazard.mitigation.spending": object,
+                "countyname": str, "cityname": str, "statename": str}
+
+# degree columns in the schools data that are at and below, or above, the associate's degree level
+BELOW_BACHELORS = ["DRVC2023.Number of students receiving an Associate's degree",
+                   "DRVC2023.Number of students receiving certificates of less than 12 weeks",
+                   "DRVC2023.Number of students receiving certificates of at least 12 weeks, but less than 1 year",
+                   "DRVC2023.Number of students receiving a certificate of 1 but less than 4 years"]
+BACHELORS_ABOVE = ["DRVC2023.Number of students receiving a Bachelor's degree",
+                   "DRVC2023.Number of students receiving a Master's degree",
+                   "DRVC2023.Number of students receiving a Doctor's degree"]
+
+# column types for the schools data, so read_csv doesn't have to infer them
+SCHOOLS_DTYPES = {"unitid": "int64", "institution name": str, "year": "int64", "HD2023.FIPS state code": str,
+                  "institution name.1": str, "HD2023.Longitude location of institution": "float64",
+                  "HD2023.Latitude location of institution": "float64", "HD2023.State abbreviation": str,
+                  "HD2023.Level of institution": str, "HD2023.Control of institution": str,
+                  "HD2023.Historically Black College or University": str, "HD2023.Tribal college": str,
+                  **{column: "float64" for column in BELOW_BACHELORS + BACHELORS_ABOVE}}
+
+# columns of the schools data with a few repeated values, stored as categories in compact_frames
+SCHOOL_CATEGORIES = ["HD2023.State abbreviation", "HD2023.Historically Black College or University", "HD2023.Tribal college",
+                     "HD2023.Control of institution", "HD2023.Level of institution"]
+
+# function used in the collect_and_clean function
+def assign_fips(points: "gpd.geoseries.GeoSeries",
+                counties_gpd: "gpd.geodataframe.GeoDataFrame",
+                batch_size: int = 50000
+                ) -> pd.Series:
+    """
+    Returns a series with the fips code of the county that contains each point, or "0" if no county contains it.
+    Points refers to the school points (i.e. the "coordinates" column of the schools geopandas dataframe).
+    Counties_gpd refers to the county geopandas dataframe, with the fips code in the "id" column.
+    Batch_size is the number of points sent to the spatial index at once, which keeps memory flat for large school files.
+    """
+
+    # build the spatial index over the county polygons once (geopandas caches it on the dataframe)
+    tree = counties_gpd.sindex
+    county_fips = counties_gpd["id"].to_numpy()
+
+    # start every point as unmatched
+    fips = np.full(len(points), "0", dtype=object)
+
+    # query the points in batches; each query returns the (point, county) pairs where the point is within the county
+    for start in range(0, len(points), batch_size):
+        point_idx, county_idx = tree.query(points.values[start:start + batch_size], predicate="within")
+        # keep the first county in file order for each point, the same county that the old per-point loop picked
+        order = np.lexsort((county_idx, point_idx))
+        point_idx, county_idx = point_idx[order], county_idx[order]
+        first = np.unique(point_idx, return_index=True)[1]
+        fips[start + point_idx[first]] = county_fips[county_idx[first]]
+
+    return pd.Series(fips, index=points.index)
 
 # function used at the beginning of the app.py file
 def collect_and_clean(ranks_location: str,
-                      schools_location: str
+                      schools_location: str,
+                      counties_location: str = COUNTIES_URL,
+                      cache_location: str = "data_cache",
+                      timings: dict = None
                       ) -> list:
     """
-    Returns list with counties data (from Internet), clean ranks data (from Excel file), and clean schools data (from csv file).
+    Returns list with counties data (from geojson), clean ranks data (from Excel file), and clean schools data (from csv file).
     Ranks_location is the file location of the ranks data (i.e. "raw_data/Index of Deep Disadvantage - Updated.xlsx")
     Schools_lcation is the file location of the schools data (i.e. "raw_data/CSV_10312024-789.csv")
+    Counties_location is the URL or file location of the county geojson (defaults to the plotly dataset)
+    Cache_location is the folder where a downloaded county geojson is kept (i.e. "data_cache")
+    Timings is an optional dictionary that gets the number of seconds spent in each stage (see timing.py)
     """
+
+    # geopandas is only needed for cleaning, so it is imported here;
+    # this lets app.py load the prebuilt data in build_data.py without importing it
+    import geopandas as gpd
+
+    # load county data for graphing (read once from the local copy, see geometry.py)
+    with stage_timer(timings, "load_counties"):
+        counties = load_counties(counties_location, cache_location)
     
-    # load county data for graphing
-    with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-        counties = json.load(response)
-    
-    # load county data as geopandas dataframe to match each school with its county
-    counties_gpd = gpd.read_file("https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json")
+        # build the geopandas dataframe used to match each school with its county from the same parsed data
+        counties_gpd = counties_to_gdf(counties)
+
 
+    # read in deep disadvantage data
+    with stage_timer(timings, "read_excel"):
+        ranks = pd.read_excel(ranks_location, dtype=RANKS_DTYPES)
 
-    # read in deep disadvantage data and configure fips
-    ranks = pd.read_excel(ranks_location, dtype={"fips": str})
-    ranks.dropna(subset="fips", inplace = True)                # remove cities
-    ranks["fips"] = ranks["fips"].apply(lambda x: x.zfill(5))  # format fips so they can be matched with county geojson info
+    # configure fips
+    with stage_timer(timings, "clean_ranks"):
+        ranks.dropna(subset="fips", inplace = True)                # remove cities
+        ranks["fips"] = ranks["fips"].str.zfill(5)                  # format fips so they can be matched with county geojson info
 
-    # redo ranks with only counties (rank1 variable includes top 500 cities, which I removed above)
-    ranks = ranks.sort_values(by = "rank1")                 # sort by original rankings
-    ranks = ranks.reset_index(drop=True).reset_index()      # reset index so that index is the new ranking, called level_0      
-    ranks["level_0"] = ranks["level_0"] + 1                 # index starts at 0, so add 1 so that ranking now starts at 1
+        # redo ranks with only counties (rank1 variable includes top 500 cities, which I removed above)
+        ranks = ranks.sort_values(by = "rank1")                 # sort by original rankings
+        ranks = ranks.reset_index(drop=True).reset_index()      # reset index so that index is the new ranking, called level_0      
+        ranks["level_0"] = ranks["level_0"] + 1                 # index starts at 0, so add 1 so that ranking now starts at 1
 
-    # fix counties with 'city' in the name so that 'city' is capitalized to be consistent with all other county names
-    ranks["name"] = ranks["name"].apply(lambda x: x.replace("city", "City"))
+        # fix counties with 'city' in the name so that 'city' is capitalized to be consistent with all other county names
+        ranks["name"] = ranks["name"].str.replace("city", "City", regex=False)
     
 
     # read in school data
-    schools = pd.read_csv(schools_location)
+    with stage_timer(timings, "read_csv"):
+        schools = pd.read_csv(schools_location, dtype=SCHOOLS_DTYPES)
 
     # rename columns that will be used in mapping
     schools.rename(columns={"institution name": "name",
@@ -55,76 +139,158 @@ def collect_and_clean(ranks_location: str,
                    inplace=True)
     
     # calculate degree ratios to be able to define community colleges
-    # calculate number of associate's degrees and certificates
-    schools["below_bachelors"] = schools["DRVC2023.Number of students receiving an Associate's degree"] + schools["DRVC2023.Number of students receiving certificates of less than 12 weeks"] + schools["DRVC2023.Number of students receiving certificates of at least 12 weeks, but less than 1 year"] + schools["DRVC2023.Number of students receiving a certificate of 1 but less than 4 years"]
-    # calculate number of bachelor's, master's, and doctoral degrees
-    schools["bachelors_above"] = schools["DRVC2023.Number of students receiving a Bachelor's degree"] + schools["DRVC2023.Number of students receiving a Master's degree"] + schools["DRVC2023.Number of students receiving a Doctor's degree"]
-    # fill in N/As in both columns with 0 so that ratio works
-    schools["below_bachelors"] = schools["below_bachelors"].fillna(0)
-    schools["bachelors_above"] = schools["bachelors_above"].fillna(0)
-    # calculate ratio of degrees that are associate's degrees and certificates
-    schools["ratio"] = schools["below_bachelors"] / (schools["below_bachelors"] + schools["bachelors_above"])
-    # community colleges defined as public institutions with over 90% of degrees being associate's degrees and certificates
-    schools["community_college"] = schools.apply(lambda x: 1 if x["ratio"] > 0.9 and x["HD2023.Control of institution"] == "Public" else 0, axis=1)
+    with stage_timer(timings, "degree_ratios"):
+        # calculate number of associate's degrees and certificates, and number of bachelor's, master's, and doctoral degrees
+        # (a school with a missing count gets N/A, and N/As are filled in with 0 so that ratio works)
+        schools["below_bachelors"] = schools[BELOW_BACHELORS].sum(axis=1, skipna=False).fillna(0)
+        schools["bachelors_above"] = schools[BACHELORS_ABOVE].sum(axis=1, skipna=False).fillna(0)
+        # calculate ratio of degrees that are associate's degrees and certificates
+        schools["ratio"] = schools["below_bachelors"] / (schools["below_bachelors"] + schools["bachelors_above"])
+        # community colleges defined as public institutions with over 90% of degrees being associate's degrees and certificates
+        schools["community_college"] = ((schools["ratio"] > 0.9) & (schools["HD2023.Control of institution"] == "Public")).astype("int64")
 
     # prep schools dataframe for mapping by defining the school's point in a geopandas dataframe
     # tutorial from https://datascience.quantecon.org/tools/maps.html
-    schools["coordinates"] = list(zip(schools.lon, schools.lat))
-    schools["coordinates"] = schools["coordinates"].apply(Point)
-    schools = gpd.GeoDataFrame(schools, geometry="coordinates")
-
-    # create empty list to hold all of the counties
-    county_list = []
-    # loop through each school's point
-    for point in schools["coordinates"]:
-        # match with the counties geopandas dataframe to determine which county the point is in
-        in_county = counties_gpd[counties_gpd.geometry.contains(point)]["id"]
-        # if a county is found, the fips code is added to the county list, otherwise a 0 is added to the list
-        try:
-            county_list.append(in_county.iloc[0])
-        except:
-            county_list.append("0")
-    schools["fips"] = county_list                               # add list of fips as a new column in schools
-    schools = schools.merge(ranks, how = "inner", on="fips")    # merge with ranks list so that county name and data is present for each school; there are only 7 schools with no fips information found
+    with stage_timer(timings, "points"):
+        schools = gpd.GeoDataFrame(schools, geometry=gpd.points_from_xy(schools["lon"], schools["lat"]))
+        schools = schools.rename_geometry("coordinates")
+
+    # match each school's point with the county that contains it, using a spatial index over the county polygons
+    with stage_timer(timings, "spatial_join"):
+        schools["fips"] = assign_fips(schools["coordinates"], counties_gpd)
+
+    with stage_timer(timings, "merge"):
+        schools = schools.merge(ranks, how = "inner", on="fips")    # merge with ranks list so that county name and data is present for each school; there are only 7 schools with no fips information found
     return [counties, ranks, schools] 
 
-# function used in the display_map function in app.py
-# rerun every time a setting is changed by the user
+# function used in build_data.py and benchmark.py
+def compact_frames(ranks: pd.core.frame.DataFrame,
+                   schools: pd.core.frame.DataFrame
+                   ) -> list:
+    """
+    Returns list with a compact county table and a compact schools table, made from the outputs of collect_and_clean.
+    The county table only keeps the fips code, the name, and the metric columns, and the schools table only keeps what the
+    map draws (name and point), the subset columns, and a "county" column with the row of the school's county in the county table,
+    instead of a copy of every county column. Repeated text is stored as categories and whole numbers in the smallest integer type;
+    decimal values are left as they are, so the map shows exactly the same numbers.
+    """
+
+    # county table: fips code, name, and every column a metric is drawn from
+    # (the proximity metrics are added afterwards with add_proximity in proximity.py)
+    columns = ["fips", "name"] + list(dict.fromkeys(settings["column"] for settings in METRICS.values() if not settings.get("by_subset")))
+    county_table = ranks[columns].reset_index(drop=True)
+    for column in county_table.select_dtypes("integer").columns:
+        county_table[column] = pd.to_numeric(county_table[column], downcast="integer")
+
+    # schools table: the row of each school's county instead of the county's columns
+    county = pd.Index(county_table["fips"]).get_indexer(schools["fips"])
+    school_table = pd.DataFrame({"name": schools["name_x"].to_numpy(),
+                                 "lon": schools["lon"].to_numpy(),
+                                 "lat": schools["lat"].to_numpy(),
+                                 "county": pd.to_numeric(county, downcast="integer")})
+    for column in SCHOOL_CATEGORIES:
+        school_table[column] = pd.Categorical(schools[column])
+    # the community college subset is a 0/1 flag (see SUBSETS in util.py)
+    school_table["community_college"] = schools["community_college"].astype("int8").to_numpy()
+    return [county_table, school_table]
+
+# function used in build_data.py
+def memory_report(frames: dict
+                  ) -> dict:
+    """
+    Returns the memory used by each dataframe in frames (a dictionary of name to dataframe) in MB, counting the text in
+    object columns, with the total of all of them.
+    """
+    report = {name: round(frame.memory_usage(deep=True).sum() / 1e6, 3) for name, frame in frames.items()}
+    report["total"] = round(sum(report.values()), 3)
+    return report
+
+# function used in the create_map function and in the figure_cache.py file
+def map_values(subset: str,
+               metric: str,
+               ranks: pd.core.frame.DataFrame,
+               schools: pd.core.frame.DataFrame,
+               metric_table: dict = None,
+               subset_bitmaps: dict = None
+               ) -> dict:
+    """
+    Returns a dictionary with every part of the map that depends on the subset and metric.
+    The display_map function in app.py uses these to send only the changed parts of the map to the browser.
+    Metric_table and subset_bitmaps are the outputs of prepare_metrics and prepare_subsets in util.py; they are built here if they aren't given.
+    """
+
+    # run prepare_metrics and prepare_subsets functions in util.py if they weren't run when the data was loaded
+    if metric_table is None:
+        metric_table = prepare_metrics(ranks, schools)
+    if subset_bitmaps is None:
+        subset_bitmaps = prepare_subsets(schools)
+    settings = metric_settings(metric_table, metric, subset)
+
+    # run subset_rows function in util.py to get the rows of the schools in the chosen subset
+    with hot_stage("subset_rows"):
+        if subset == "All":
+            rows = slice(None)
+        else:
+            rows = subset_rows(subset, subset_bitmaps, len(schools))
+
+    # pick out the points, tooltip names, and county values of the schools in the subset
+    with hot_stage("school_points"):
+        lon = schools["lon"].to_numpy()[rows]
+        lat = schools["lat"].to_numpy()[rows]
+        school_labels = settings["school_labels"][rows]
+        school_values = settings["school_values"][rows]
+
+    return {"locations": settings["locations"],
+            "z": settings["z"],                                 # color based on chosen metric
+            "zmin": settings["zmin"],
+            "zmax": settings["zmax"],
+            "colorscale": settings["colorscale"],               # colorscale based on chosen metric
+            "county_labels": settings["county_labels"],
+            "county_hovertemplate": settings["county_hovertemplate"],
+            "lon": lon,
+            "lat": lat,
+            "school_labels": school_labels,
+            "school_values": school_values,
+            "school_hovertemplate": settings["school_hovertemplate"],
+            # run create_title function in util.py to get title customized with metric and subset selected by user
+            "title": create_title(subset, metric)}
+
+# function used in the create_map function and in the display_map function in app.py
+def hoverinfo(tooltip: bool
+              ) -> str:
+    """
+    Returns the plotly hoverinfo setting that toggles a tooltip on ("text", drawn with the trace's hovertemplate) or off ("skip").
+    """
+    if tooltip:
+        return "text"
+    else:
+        return "skip"
+
+# function used in the figure_cache.py file
+# rerun every time a new combination of settings is chosen by the user
 def create_map(subset: str,
               metric: str, 
               county_tooltip: bool,
               school_tooltip: bool,
-              counties: dict,
+              counties,
               ranks: pd.core.frame.DataFrame,
-              schools: gpd.geodataframe.GeoDataFrame
+              schools: pd.core.frame.DataFrame,
+              metric_table: dict = None,
+              subset_bitmaps: dict = None,
+              geojson_url: str = None
               ) -> go.Figure:
     """
     Creates and saves basic plotly map based on county data, rank data, and school data.
-    This function will also include more inputs once more metrics are implemented.
+    Counties is the county geojson, or the list of levels of detail from load_dataset in build_data.py
+    (in which case the level for the map's zoom is drawn).
+    Geojson_url is the URL of the static county file (see write_counties_asset in build_data.py); when it is given, the figure
+    points to it instead of holding the county geojson, which also skips plotly's checks of every county border.
+    Metric_table and subset_bitmaps are the outputs of prepare_metrics and prepare_subsets in util.py,
+    so the metric values and subsets aren't recomputed for every map.
     """
 
-    # run subset_schools function in util.py to get filtered geopandas dataframe
-    schools = subset_schools(subset, schools)
-
-    # run county_settings function in util.py to get modified ranks and schools, as well as the appropriate colorscale
-    ranks, schools, color = county_settings(metric, ranks, schools)
-
-    # set the tooltip text to include the desired metric for counties and schools
-    ranks["textbox"] = ranks["name"] + "<br>" + metric + ": " + ranks["metric_of_interest"].astype(str)
-    schools["textbox"] = schools["name_x"] + "<br>County: " + schools["name_y"] + "<br>County " + metric + ": " + schools["metric_of_interest"].astype(str)
-    
-    # checks if county tooltip option is selected and toggles it on ("text") or off ("skip")
-    if county_tooltip:
-        hoverinfo_county = "text"
-    else:
-        hoverinfo_county = "skip"
-    
-    # checks if school tooltip option is selected and toggles it on ("text") or off ("skip")
-    if school_tooltip:
-        hoverinfo_school = "text"
-    else:
-        hoverinfo_school = "skip"
-
+    # run map_values function to get the parts of the map that depend on the subset and metric
+    values = map_values(subset, metric, ranks, schools, metric_table, subset_bitmaps)
 
     # create default formatting
     MAP_FORMAT = {"width": 800,
@@ -132,32 +298,34 @@ def create_map(subset: str,
                   "margin": {"r":0 ,"t": 30, "l": 0, "b": 0},
                   "dragmode": False,
                   "mapbox_style": "open-street-map",
-                  # run create_map function in util.py to get title customized with metric and subset selected by user
-                  "title": create_title(subset, metric)
+                  "title": values["title"]
                  }
 
     # create empty figure
     fig = go.Figure(layout=MAP_FORMAT)
 
     # create first trace - choropleth
-    trace = go.Choroplethmapbox(geojson=counties,
-                                locations=ranks.fips,
-                                z=ranks.metric_of_interest,        # color based on chosen metric
-                                colorscale=color,                  # colorscale based on chosen metric
-                                zmin=min(ranks.metric_of_interest),
-                                zmax=max(ranks.metric_of_interest),
+    trace = go.Choroplethmapbox(geojson=geojson_url or counties_for_zoom(counties, MAP_ZOOM),   # county borders detailed enough for the zoom
+                                locations=values["locations"],
+                                z=values["z"],                          # color based on chosen metric
+                                colorscale=values["colorscale"],        # colorscale based on chosen metric
+                                zmin=values["zmin"],
+                                zmax=values["zmax"],
                                 marker_line_width=0,
-                                hoverinfo=hoverinfo_county,             # set above based on user-selected option
-                                text = ranks.textbox)                   # tooltip info (ignored if hover_info_county = "skip")
+                                hoverinfo=hoverinfo(county_tooltip),    # tooltip toggled on or off based on user-selected option
+                                text=values["county_labels"],           # tooltip info (ignored if hoverinfo is "skip")
+                                hovertemplate=values["county_hovertemplate"])
 
     # add trace to figure
     fig.add_trace(trace)
 
     # create second trace - scatterplot
-    trace2 = go.Scattermapbox(lon = schools["lon"],
-                             lat = schools["lat"],
-                             hoverinfo=hoverinfo_school,        # set above based on user-selected option
-                             text = schools["textbox"],         # tooltip info (ignored if hover_info_school = "skip")
+    trace2 = go.Scattermapbox(lon = values["lon"],
+                             lat = values["lat"],
+                             hoverinfo=hoverinfo(school_tooltip),   # tooltip toggled on or off based on user-selected option
+                             text=values["school_labels"],          # tooltip info (ignored if hoverinfo is "skip")
+                             customdata=values["school_values"],    # the school's county value, filled in by the hovertemplate
+                             hovertemplate=values["school_hovertemplate"],
                              marker_size=5,
                              marker_color="darkorange")
 
@@ -166,12 +334,15 @@ def create_map(subset: str,
 
     # center the figure on the continental US
     fig.update_mapboxes(center={"lat": 39, "lon": -97},
-                        zoom=3
+                        zoom=MAP_ZOOM
                        )
     
     return(fig)
 
 if __name__ == "__main__":
-    counties, ranks, schools = collect_and_clean("../raw_data/Index of Deep Disadvantage - Updated.xlsx", "../raw_data/CSV_10312024-789.csv")
+    counties, ranks, schools = collect_and_clean("../raw_data/Index of Deep Disadvantage - Updated.xlsx", "../raw_data/CSV_10312024-789.csv", cache_location="../data_cache")
+    ranks, schools = compact_frames(ranks, schools)
+    from proximity import add_proximity
+    ranks = add_proximity(ranks, schools, counties)
     fig = create_map("All", "Rank", True, True, counties, ranks, schools)
     fig.write_html("../figures/basic_map.html")
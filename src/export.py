@@ -0,0 +1,267 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    # works if run from the main folder (i.e. python -m src.export)
+    from src.build_data import load_dataset, manifest_entry, replace_file
+    from src.create_map import MAP_ZOOM, create_map, map_values
+    from src.figure_cache import TOOLTIP_STATES
+    from src.geometry import COUNTIES_URL, counties_for_zoom, counties_asset
+    from src.util import METRICS, prepare_metrics, prepare_subsets
+except:
+    # works if run as standalone program
+    from build_data import load_dataset, manifest_entry, replace_file
+    from create_map import MAP_ZOOM, create_map, map_values
+    from figure_cache import TOOLTIP_STATES
+    from geometry import COUNTIES_URL, counties_for_zoom, counties_asset
+    from util import METRICS, prepare_metrics, prepare_subsets
+
+# main folder of the repository, so the default locations are the same wherever this is run from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name of the manifest written in the export folder
+EXPORT_MANIFEST = "export.json"
+
+# changed whenever the exported files change for the same data, so a re-run rebuilds every combination
+EXPORT_FORMAT = 1
+
+# seconds between the manifest writes while maps are being exported, so an interrupted export keeps the maps it finished
+MANIFEST_INTERVAL = 5
+
+# the data each export worker process loads once (see load_worker)
+worker_data = {}
+
+# function used in the export_maps function
+def slug(text: str
+         ) -> str:
+    """
+    Returns text as a lowercase file name part (i.e. "Control: Public" becomes "control-public").
+    """
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+# function used in the export_maps function
+def combination_name(subset: str,
+                     metric: str,
+                     county_tooltip: bool,
+                     school_tooltip: bool
+                     ) -> str:
+    """
+    Returns the file name (without extension) of one combination (i.e. "hbcus__rank__county-school").
+    """
+    tooltips = "-".join(name for name, shown in [("county", county_tooltip), ("school", school_tooltip)] if shown) or "none"
+    return f"{slug(subset)}__{slug(metric)}__{tooltips}"
+
+# function used in the export_maps and export_combination functions
+def write_gzip(location: str,
+               data: bytes,
+               plain: bool = False
+               ) -> int:
+    """
+    Writes data precompressed to location + ".gz" (and as it is to location if plain is True), and returns the compressed size.
+    The gzip header has no time stamp, so the same data always gives the same file.
+    """
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    with replace_file(location + ".gz") as temporary, open(temporary, "wb") as f:
+        f.write(compressed)
+    if plain:
+        with replace_file(location) as temporary, open(temporary, "wb") as f:
+            f.write(data)
+    return len(compressed)
+
+# function used in the export_maps function
+def combination_key(values: dict,
+                    county_tooltip: bool,
+                    school_tooltip: bool,
+                    counties_name: str
+                    ) -> str:
+    """
+    Returns a hash of everything one exported map is made from: the values from map_values in create_map.py,
+    the tooltip settings, and the county geojson file it points to.
+    A combination is only exported again when this changes.
+    """
+    from plotly.io.json import to_json_plotly
+
+    inputs = to_json_plotly({"values": values, "county_tooltip": county_tooltip, "school_tooltip": school_tooltip,
+                             "counties": counties_name, "format": EXPORT_FORMAT})
+    return hashlib.sha256(inputs.encode()).hexdigest()[:16]
+
+# function used as the initializer of the export worker processes
+def load_worker(ranks_location: str,
+                schools_location: str,
+                counties_location: str,
+                cache_location: str):
+    """
+    Loads the prebuilt data (see build_data.py) once in each worker process.
+    The county geojson isn't loaded, since every map points to the shared county file instead.
+    """
+    counties, ranks, schools = load_dataset(ranks_location, schools_location, cache_location, counties_location, geometry=False)
+    worker_data.update({"counties": counties, "ranks": ranks, "schools": schools,
+                        "metric_table": prepare_metrics(ranks, schools), "subset_bitmaps": prepare_subsets(schools)})
+
+# function run by the export worker processes
+def export_combination(task: dict
+                       ) -> dict:
+    """
+    Builds the map for one combination and writes it to the export folder as a figure (JSON) and a page (HTML),
+    both precompressed. Returns the sizes of the files written.
+    The county geojson is left out of both: the figure points to the shared county file instead (plotly draws a
+    geojson given as a URL), so the browser downloads it once for every map.
+    """
+    import plotly.io as pio
+    from plotly.io.json import to_json_plotly
+
+    fig = create_map(task["subset"], task["metric"], task["county_tooltip"], task["school_tooltip"], worker_data["counties"],
+                     worker_data["ranks"], worker_data["schools"], worker_data["metric_table"], worker_data["subset_bitmaps"],
+                     task["counties"])
+    figure = fig.to_dict()
+
+    location = os.path.join(task["output"], task["name"])
+    figure_json = to_json_plotly(figure).encode()
+    # plotly.js is also written once to the export folder (plotly.min.js) instead of into every page
+    page = pio.to_html(figure, include_plotlyjs="directory", full_html=True, validate=False).encode()
+    return {"json_bytes": write_gzip(location + ".json", figure_json, task["plain"]),
+            "html_bytes": write_gzip(location + ".html", page, task["plain"])}
+
+# function used in the export_maps function
+def write_manifest(output_location: str,
+                   cache_location: str,
+                   counties_name: str,
+                   maps: list,
+                   exported: int,
+                   start: float
+                   ) -> dict:
+    """
+    Writes the export manifest with the maps that are on disk (the ones with file sizes) and returns it.
+    A map left out of it (i.e. one that wasn't finished when the export stopped) is exported again by the next run.
+    """
+    done = [item for item in maps if "json_bytes" in item]
+    manifest = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "data_version": manifest_entry(cache_location),
+                "counties": counties_name,
+                "plotly": "plotly.min.js",
+                "exported": exported,
+                "skipped": len(done) - exported,
+                "seconds": round(time.perf_counter() - start, 3),
+                "maps": done}
+    with replace_file(os.path.join(output_location, EXPORT_MANIFEST)) as temporary, open(temporary, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+# function used in the __main__ block
+def export_maps(ranks_location: str,
+                schools_location: str,
+                output_location: str,
+                counties_location: str = COUNTIES_URL,
+                cache_location: str = "data_cache",
+                workers: int = None,
+                plain: bool = False,
+                force: bool = False
+                ) -> dict:
+    """
+    Exports the map for every subset, metric, and tooltip combination to output_location, and returns the export manifest.
+    Each combination is written as name.json.gz (the plotly figure) and name.html.gz (a page that shows it), with the
+    county geojson and plotly.js written once next to them; with plain=True, uncompressed copies of the maps are written as well.
+    The county geojson and plotly.js are always written uncompressed too, since every map loads them by their plain names.
+    The maps are built in parallel by workers processes (one per core by default). Combinations whose inputs haven't
+    changed since the last export (see combination_key) are skipped, unless force is True.
+    The manifest is written every few seconds while the maps are built (see MANIFEST_INTERVAL), and again if a map fails
+    or the export is interrupted, so the next run only builds the maps that weren't finished.
+    """
+    from plotly.offline import get_plotlyjs
+
+    start = time.perf_counter()
+    os.makedirs(output_location, exist_ok=True)
+    counties, ranks, schools = load_dataset(ranks_location, schools_location, cache_location, counties_location)
+    metric_table = prepare_metrics(ranks, schools)
+    subset_bitmaps = prepare_subsets(schools)
+
+    # the county geojson for the map's zoom, named after its contents so browsers can cache it for good
+    # (the same file the app serves from the assets folder, see counties_asset in geometry.py)
+    # both files are always written uncompressed as well, since the figures and pages ask for them by their plain names
+    counties_name, geojson = counties_asset(counties_for_zoom(counties, MAP_ZOOM))
+    write_gzip(os.path.join(output_location, counties_name), geojson, plain=True)
+    write_gzip(os.path.join(output_location, "plotly.min.js"), get_plotlyjs().encode(), plain=True)
+
+    # the combinations from the last export, by name
+    try:
+        with open(os.path.join(output_location, EXPORT_MANIFEST)) as f:
+            previous = {item["name"]: item for item in json.load(f)["maps"]}
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    maps, tasks = [], []
+    for subset in subset_bitmaps:
+        for metric in METRICS:
+            values = map_values(subset, metric, ranks, schools, metric_table, subset_bitmaps)
+            for county_tooltip, school_tooltip in TOOLTIP_STATES:
+                name = combination_name(subset, metric, county_tooltip, school_tooltip)
+                item = {"name": name, "subset": subset, "metric": metric, "county_tooltip": county_tooltip,
+                        "school_tooltip": school_tooltip, "key": combination_key(values, county_tooltip, school_tooltip, counties_name),
+                        "json": name + ".json", "html": name + ".html"}
+                old = previous.get(name, {})
+                files = [os.path.join(output_location, item[kind] + ".gz") for kind in ["json", "html"]]
+                if plain:
+                    files += [os.path.join(output_location, item[kind]) for kind in ["json", "html"]]
+                if not force and old.get("key") == item["key"] and all(os.path.exists(file) for file in files):
+                    item.update({"json_bytes": old["json_bytes"], "html_bytes": old["html_bytes"]})
+                else:
+                    tasks.append({**item, "counties": counties_name, "output": output_location, "plain": plain})
+                maps.append(item)
+
+    # build the changed combinations in parallel; each worker loads the memory-mapped prebuilt data once
+    # each map is recorded as soon as it is written, and a failed map doesn't stop the others
+    items = {item["name"]: item for item in maps}
+    exported, errors = 0, []
+    try:
+        if tasks:
+            with ProcessPoolExecutor(max_workers=workers, initializer=load_worker,
+                                     initargs=(ranks_location, schools_location, counties_location, cache_location)) as pool:
+                futures = {pool.submit(export_combination, task): task["name"] for task in tasks}
+                written = time.perf_counter()
+                try:
+                    for future in as_completed(futures):
+                        if future.exception() is not None:
+                            errors.append(future.exception())
+                            continue
+                        items[futures[future]].update(future.result())
+                        exported += 1
+                        if time.perf_counter() - written > MANIFEST_INTERVAL:
+                            write_manifest(output_location, cache_location, counties_name, maps, exported, start)
+                            written = time.perf_counter()
+                finally:
+                    # if the export is interrupted, don't start the maps still waiting
+                    for future in futures:
+                        future.cancel()
+    finally:
+        manifest = write_manifest(output_location, cache_location, counties_name, maps, exported, start)
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(tasks)} maps failed to export (the first error: {errors[0]!r})") from errors[0]
+
+    # remove county files left over from earlier exports
+    for file in os.listdir(output_location):
+        if file.startswith(("counties_", "counties.")) and not file.startswith(counties_name):
+            os.remove(os.path.join(output_location, file))
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the map for every subset, metric, and tooltip combination as precompressed files.")
+    parser.add_argument("--output", default=os.path.join(ROOT, "figures", "export"), help="folder the maps are written to")
+    parser.add_argument("--workers", type=int, help="number of processes building maps (one per core by default)")
+    parser.add_argument("--counties", default=os.environ.get("COUNTIES_GEOJSON", COUNTIES_URL),
+                        help="local county geojson, or a URL already cached in the cache folder")
+    parser.add_argument("--plain", action="store_true", help="also write uncompressed copies of every file")
+    parser.add_argument("--force", action="store_true", help="export every combination, even if it hasn't changed")
+    args = parser.parse_args()
+
+    manifest = export_maps(os.path.join(ROOT, "raw_data", "Index of Deep Disadvantage - Updated.xlsx"),
+                           os.path.join(ROOT, "raw_data", "CSV_10312024-789.csv"),
+                           args.output, args.counties, os.path.join(ROOT, "data_cache"), args.workers, args.plain, args.force)
+    total = sum(item["json_bytes"] + item["html_bytes"] for item in manifest["maps"])
+    print(f"{manifest['exported']} maps exported, {manifest['skipped']} unchanged, in {manifest['seconds']:.1f} s "
+          f"({len(manifest['maps'])} maps, {total / 1e6:.1f} MB compressed)")
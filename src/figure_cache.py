@@ -0,0 +1,91 @@
+from functools import lru_cache
+
+try:
+    # works if run by app.py
+    from src.create_map import MAP_ZOOM, create_map, map_values
+    from src.geometry import counties_for_zoom
+    from src.timing import hot_stage
+except:
+    # works if run as standalone program
+    from create_map import MAP_ZOOM, create_map, map_values
+    from geometry import counties_for_zoom
+    from timing import hot_stage
+
+# tooltip states as (county_tooltip, school_tooltip), matching the two tooltip check buttons in app.py
+TOOLTIP_STATES = [(True, True), (True, False), (False, True), (False, False)]
+
+# function used at the beginning of the app.py file
+def make_figure_cache(counties,
+                      ranks: "pd.core.frame.DataFrame",
+                      schools: "pd.core.frame.DataFrame",
+                      metric_table: dict,
+                      subset_bitmaps: dict,
+                      maxsize: int = 256,
+                      geojson_url: str = None
+                      ):
+    """
+    Returns a cached version of create_map that only takes the subset, metric, and tooltip settings.
+    Figures are kept as plain dictionaries in a least-recently-used cache that holds at most maxsize figures.
+    Hit and miss counters are available with cached_map.cache_info(), and the cache is emptied with cached_map.cache_clear().
+    Counties is the county geojson or the list of levels of detail from load_dataset in build_data.py (or None with geojson_url).
+    Geojson_url is the URL of the static county file (see write_counties_asset in build_data.py); with it, the figures point
+    plotly to the file instead of holding the county geojson, so the browser downloads it once and keeps it, and the county
+    geojson is never put into a figure at all.
+    """
+
+    # the county geojson every figure draws (the level of detail for the map's zoom), unless they point to the static file
+    geojson = counties_for_zoom(counties, MAP_ZOOM) if geojson_url is None else None
+
+    @lru_cache(maxsize=maxsize)
+    def cached_map(subset: str,
+                   metric: str,
+                   county_tooltip: bool,
+                   school_tooltip: bool
+                   ) -> dict:
+        # the create_map stage includes the subset_rows and school_points stages in map_values
+        with hot_stage("create_map"):
+            fig = create_map(subset, metric, county_tooltip, school_tooltip, counties, ranks, schools, metric_table, subset_bitmaps, geojson_url)
+        with hot_stage("to_dict"):
+            figure = fig.to_dict()
+        # every figure would otherwise hold its own copy of the county geojson, so point them all at the shared one
+        if geojson_url is None:
+            figure["data"][0]["geojson"] = geojson
+        return figure
+
+    return cached_map
+
+# function used at the beginning of the app.py file
+def make_values_cache(ranks: "pd.core.frame.DataFrame",
+                      schools: "pd.core.frame.DataFrame",
+                      metric_table: dict,
+                      subset_bitmaps: dict,
+                      maxsize: int = 64
+                      ):
+    """
+    Returns a cached version of map_values that only takes the subset and metric.
+    These are the parts of the map that display_map in app.py sends on their own when only one setting changes.
+    """
+
+    @lru_cache(maxsize=maxsize)
+    def cached_values(subset: str,
+                      metric: str
+                      ) -> dict:
+        return map_values(subset, metric, ranks, schools, metric_table, subset_bitmaps)
+
+    return cached_values
+
+# function used at the beginning of the app.py file
+def warm_figure_cache(cached_map,
+                      subsets: list,
+                      metrics: list,
+                      tooltip_states: list = TOOLTIP_STATES
+                      ) -> int:
+    """
+    Builds every subset, metric, and tooltip combination ahead of time and returns the number of figures built.
+    Cached_map is the function returned by make_figure_cache.
+    """
+    for subset in subsets:
+        for metric in metrics:
+            for county_tooltip, school_tooltip in tooltip_states:
+                cached_map(subset, metric, county_tooltip, school_tooltip)
+    return len(subsets) * len(metrics) * len(tooltip_states)
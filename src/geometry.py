@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+from urllib.request import urlopen
+
+# location of the plotly county geojson used for graphing and for matching schools with counties
+COUNTIES_URL = "https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json"
+
+# parsed county geojson for each local file, so the file is only read once per process
+_loaded = {}
+
+# function used in the load_counties function and in build_data.py
+def counties_file(location: str = COUNTIES_URL,
+                  cache_location: str = "data_cache"
+                  ) -> str:
+    """
+    Returns the file location of a local copy of the county geojson.
+    Location is a file location or a URL (i.e. the plotly dataset, or a local HTTP stand-in such as "http://127.0.0.1:8000/counties.json").
+    A URL is downloaded once into the cache folder (i.e. "data_cache") and the cached copy is used from then on.
+    """
+
+    # a file location is used as is
+    if not location.startswith(("http://", "https://")):
+        return location
+
+    # each URL gets its own cached copy, so a stand-in never replaces the real file
+    name = hashlib.sha256(location.encode()).hexdigest()[:10] + "-" + os.path.basename(location)
+    cached = os.path.join(cache_location, name)
+    if not os.path.exists(cached):
+        os.makedirs(cache_location, exist_ok=True)
+        with urlopen(location) as response:
+            content = response.read()
+        # write to a temporary file first so that an interrupted download is never mistaken for the real file
+        with open(cached + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(cached + ".tmp", cached)
+    return cached
+
+# function used in collect_and_clean in create_map.py
+def load_counties(location: str = COUNTIES_URL,
+                  cache_location: str = "data_cache"
+                  ) -> dict:
+    """
+    Returns the county geojson as a dictionary, ready to be passed to plotly.
+    The file is parsed once per process; later calls return the same dictionary unless the file has changed.
+    """
+    path = counties_file(location, cache_location)
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _loaded:
+        with open(path) as f:
+            _loaded[key] = json.load(f)
+    return _loaded[key]
+
+# function used in collect_and_clean in create_map.py
+def counties_to_gdf(counties: dict
+                    ) -> "gpd.geodataframe.GeoDataFrame":
+    """
+    Returns the county geojson as a geopandas dataframe with the fips code in the "id" column.
+    Counties is the dictionary from load_counties, so the geometry is built without reading the file again.
+    """
+
+    # geopandas is only needed for matching schools with counties
+    import geopandas as gpd
+
+    features = counties["features"]
+    counties_gpd = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    counties_gpd["id"] = [feature["id"] for feature in features]
+    return counties_gpd
+
+# levels of detail for the county map, from coarsest to finest
+# max_zoom: the highest map zoom the level is used for (the last level is used for every zoom above the others)
+# tolerance: how far (in degrees) a simplified border may move from the original one (0 keeps every point)
+# decimals: number of decimals the coordinates are rounded to (None keeps them as they are)
+# (the plotly county geojson is already simplified, so a level in between with a smaller tolerance keeps almost every point,
+#  i.e. 0.002 keeps 119,652 of 119,864 and 0.005 keeps 118,074, and isn't worth a file of its own)
+LEVELS = [{"name": "low", "max_zoom": 4, "tolerance": 0.01, "decimals": 3},
+          {"name": "full", "max_zoom": 24, "tolerance": 0, "decimals": None}]
+
+# function used in the simplify_counties function
+def _polygons(geometry: dict
+              ) -> list:
+    """
+    Returns the list of polygons (each a list of rings) in a Polygon or MultiPolygon geojson geometry.
+    """
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+# function used in the simplify_counties function
+def _ring_arcs(ring: list,
+               junctions: set
+               ) -> list:
+    """
+    Returns the ring split into arcs that start and end at junctions (points where three or more borders meet).
+    A ring without junctions (an island, or a county that only borders one other county) is one closed arc
+    that starts at its smallest point, so every ring that uses it splits it in the same place.
+    """
+    points = ring[:-1]
+    starts = [i for i, point in enumerate(points) if point in junctions]
+    if not starts:
+        start = points.index(min(points))
+        points = points[start:] + points[:start]
+        return [points + [points[0]]]
+    points = points[starts[0]:] + points[:starts[0]]
+    starts = [i - starts[0] for i in starts] + [len(points)]
+    points = points + [points[0]]
+    return [points[a:b + 1] for a, b in zip(starts[:-1], starts[1:])]
+
+# function used in the simplify_counties function
+def _canonical(arc: list
+               ) -> tuple:
+    """
+    Returns the arc in the direction used for every ring that shares it, and whether it was reversed.
+    """
+    if arc[0] > arc[-1] or (arc[0] == arc[-1] and len(arc) > 2 and arc[1] > arc[-2]):
+        return tuple(reversed(arc)), True
+    return tuple(arc), False
+
+# function used in the counties_levels function
+def simplify_counties(counties: dict,
+                      tolerance: float,
+                      decimals: int = None
+                      ) -> dict:
+    """
+    Returns a copy of the county geojson with simplified borders and rounded coordinates.
+    Borders are split into arcs between the points where counties meet, and each arc is simplified once and used by
+    every county on either side of it, so neighboring counties keep sharing the exact same border (no slivers or gaps
+    wherever the original borders share their points).
+    Every county is a valid polygon afterwards: a county whose simplified borders cross each other keeps its original ones.
+    Tolerance is the largest distance (in degrees) a border may move, and decimals is the number of decimals kept.
+    """
+
+    # shapely is only needed when the levels of detail are built
+    import shapely
+
+    # turn every ring into a list of point tuples, so points can be compared and used as dictionary keys
+    features = []
+    for feature in counties["features"]:
+        polygons = [[[tuple(point) for point in ring] for ring in polygon] for polygon in _polygons(feature["geometry"])]
+        features.append(polygons)
+
+    # junctions are points with more than two distinct neighbors, where one shared border ends and another begins
+    neighbors = {}
+    for polygons in features:
+        for polygon in polygons:
+            for ring in polygon:
+                points = ring[:-1]
+                for i, point in enumerate(points):
+                    neighbors.setdefault(point, set()).update((points[i - 1], points[(i + 1) % len(points)]))
+    junctions = {point for point, adjacent in neighbors.items() if len(adjacent) > 2}
+
+    # split every ring into arcs, and collect each distinct arc once in its canonical direction
+    arc_index = {}
+    ring_arcs = []
+    for polygons in features:
+        feature_arcs = []
+        for polygon in polygons:
+            polygon_arcs = []
+            for ring in polygon:
+                refs = []
+                for arc in _ring_arcs(ring, junctions):
+                    key, reverse = _canonical(arc)
+                    refs.append((arc_index.setdefault(key, len(arc_index)), reverse))
+                polygon_arcs.append(refs)
+            feature_arcs.append(polygon_arcs)
+        ring_arcs.append(feature_arcs)
+    arcs = list(arc_index)
+
+    # simplify every distinct arc at once (Douglas-Peucker keeps the end points, so arcs still meet at the junctions)
+    lines = shapely.linestrings([point for arc in arcs for point in arc],
+                                indices=[i for i, arc in enumerate(arcs) for _ in arc])
+    if tolerance > 0:
+        lines = shapely.simplify(lines, tolerance, preserve_topology=True)
+    simplified = [shapely.get_coordinates(line) for line in lines]
+    if decimals is not None:
+        simplified = [coordinates.round(decimals) for coordinates in simplified]
+    simplified = [coordinates.tolist() for coordinates in simplified]
+    original = [[list(point) for point in arc] for arc in arcs]
+
+    # function used below to rebuild a ring from its arcs
+    def assemble(refs, source):
+        ring = []
+        for index, reverse in refs:
+            arc = source[index][::-1] if reverse else source[index]
+            ring.extend(arc if not ring else arc[1:])
+        # rounding can put neighboring points on top of each other, so repeated points are dropped
+        ring = [point for i, point in enumerate(ring) if i == 0 or point != ring[i - 1]]
+        return ring
+
+    # function used below to rebuild the polygons of a county from its arcs
+    def polygons(feature_arcs):
+        rebuilt = []
+        for polygon_arcs in feature_arcs:
+            rings = [assemble(refs, simplified) for refs in polygon_arcs]
+            # rings that are still too small after rounding are left out, unless it is the outer ring
+            rebuilt.append([ring for i, ring in enumerate(rings) if i == 0 or len(ring) >= 4])
+        return rebuilt
+
+    # a ring that collapsed (fewer than 3 distinct points) keeps all the points of its arcs instead; since the arcs are
+    # shared, its neighbors use the same unsimplified arcs and still line up with it
+    keep = set()
+    for feature_arcs in ring_arcs:
+        for polygon_arcs in feature_arcs:
+            for refs in polygon_arcs:
+                if len(assemble(refs, simplified)) < 4:
+                    keep.update(index for index, _ in refs)
+    for index in keep:
+        simplified[index] = original[index] if decimals is None else [[round(x, decimals), round(y, decimals)] for x, y in original[index]]
+
+    # each arc is simplified on its own, and rounding can pinch narrow parts, so a county can still end up with borders
+    # that cross each other or parts that collapse (an invalid polygon that draws with holes or spikes); such a county
+    # keeps the original points of all its arcs, without rounding, and since that changes the borders of its neighbors
+    # too, they are checked again until every county is valid (the original geojson is)
+    exact = set()
+    while True:
+        restore = set()
+        for feature_arcs in ring_arcs:
+            indices = {index for polygon_arcs in feature_arcs for refs in polygon_arcs for index, _ in refs}
+            if indices <= exact:
+                continue
+            try:
+                valid = shapely.is_valid(shapely.from_geojson(json.dumps({"type": "MultiPolygon", "coordinates": polygons(feature_arcs)})))
+            except shapely.errors.GEOSException:
+                # a ring that collapsed to a line can't even be read as a polygon
+                valid = False
+            if not valid:
+                restore.update(indices - exact)
+        if not restore:
+            break
+        exact.update(restore)
+        for index in restore:
+            simplified[index] = original[index]
+
+    # rebuild the geojson with the same properties and ids
+    simplified_features = []
+    for feature, feature_arcs in zip(counties["features"], ring_arcs):
+        rebuilt = polygons(feature_arcs)
+        if feature["geometry"]["type"] == "Polygon":
+            geometry = {"type": "Polygon", "coordinates": rebuilt[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "coordinates": rebuilt}
+        simplified_features.append({"type": "Feature", "properties": feature["properties"], "geometry": geometry, "id": feature["id"]})
+    return {"type": "FeatureCollection", "features": simplified_features}
+
+# function used in the build_dataset function in build_data.py
+def counties_levels(counties: dict,
+                    levels: list = LEVELS
+                    ) -> list:
+    """
+    Returns a list with a simplified copy of the county geojson for each level of detail in levels.
+    Each item is a dictionary with the level's settings and its "geojson".
+    """
+    counties_by_zoom = []
+    for level in levels:
+        if level["tolerance"] == 0 and level["decimals"] is None:
+            geojson = counties
+        else:
+            geojson = simplify_counties(counties, level["tolerance"], level["decimals"])
+        counties_by_zoom.append({**level, "geojson": geojson})
+    return counties_by_zoom
+
+# function used in create_map in create_map.py and in figure_cache.py
+def counties_for_zoom(counties,
+                      zoom: float
+                      ) -> dict:
+    """
+    Returns the county geojson to draw at the given map zoom.
+    Counties is either a county geojson (returned as is) or the list of levels of detail from counties_levels.
+    """
+    if isinstance(counties, dict):
+        return counties
+    for level in counties:
+        if zoom <= level["max_zoom"]:
+            return level["geojson"]
+    return counties[-1]["geojson"]
+
+# function used in build_data.py and export.py
+def counties_asset(geojson: dict
+                   ) -> list:
+    """
+    Returns the file name and contents of the county geojson as a static file for the browser: compact JSON, named after
+    a hash of its contents (i.e. "counties.1a2b3c4d5e6f7a8b.json"), so a browser can keep it for as long as it likes.
+    """
+    data = json.dumps(geojson, separators=(",", ":")).encode()
+    return [f"counties.{hashlib.sha256(data).hexdigest()[:16]}.json", data]
+
+# function used in the build_dataset function in build_data.py
+def levels_report(counties_by_zoom: list
+                  ) -> list:
+    """
+    Returns a list with the number of points, number of invalid counties, payload size in bytes, and serialization time
+    in seconds of each level of detail.
+    The payload is the geojson as plotly serializes it when it is sent to the browser.
+    Invalid counties (i.e. borders that cross themselves) should always be 0, see simplify_counties.
+    """
+
+    # plotly and shapely are imported here so the rest of this file doesn't need them
+    import time
+    import shapely
+    from plotly.io.json import to_json_plotly
+
+    report = []
+    for level in counties_by_zoom:
+        points = sum(len(ring) for feature in level["geojson"]["features"]
+                     for polygon in _polygons(feature["geometry"]) for ring in polygon)
+        invalid = sum(not shapely.is_valid(shapely.from_geojson(json.dumps(feature["geometry"])))
+                      for feature in level["geojson"]["features"])
+        start = time.perf_counter()
+        payload = to_json_plotly(level["geojson"])
+        seconds = time.perf_counter() - start
+        report.append({"name": level["name"], "max_zoom": level["max_zoom"], "points": points,
+                       "invalid": invalid, "bytes": len(payload.encode()), "serialize_seconds": round(seconds, 4)})
+    return report
+
+if __name__ == "__main__":
+    counties_by_zoom = counties_levels(load_counties(cache_location="../data_cache"))
+    for level in levels_report(counties_by_zoom):
+        print(f"{level['name']} (zoom <= {level['max_zoom']}): {level['points']} points, "
+              f"{level['invalid']} invalid counties, "
+              f"{level['bytes'] / 1e6:.2f} MB, serialized in {level['serialize_seconds']:.3f} s")
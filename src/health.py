@@ -0,0 +1,89 @@
+import os
+
+try:
+    # works if run by app.py
+    from src.build_data import manifest_entry
+except:
+    # works if run as standalone program
+    from build_data import manifest_entry
+
+# process that loaded the app; when a WSGI server preloads it (see wsgi.py) this is the parent of every worker
+LOADED_BY = os.getpid()
+
+# function used in the worker_memory function and in load_test.py
+def process_tree(pid: int
+                 ) -> list:
+    """
+    Returns the process id and the ids of all the child processes (i.e. gunicorn workers) of a process, read from /proc.
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(name))
+    tree = [pid]
+    for process in tree:
+        tree.extend(children.get(process, []))
+    return tree
+
+# function used in the worker_memory function
+def process_memory(pid: int
+                   ) -> dict:
+    """
+    Returns the memory of a process in MB, read from /proc/<pid>/smaps_rollup.
+    rss counts every page the process uses, shared counts the pages it shares with other processes (i.e. the data loaded
+    before the workers were forked), private counts its own pages, and pss splits each shared page between the processes sharing it.
+    """
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                memory[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"pid": pid,
+            "rss_mb": round(memory.get("Rss", 0), 1),
+            "pss_mb": round(memory.get("Pss", 0), 1),
+            "shared_mb": round(memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0), 1),
+            "private_mb": round(memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0), 1)}
+
+# function used in the add_health_check function
+def worker_memory() -> list:
+    """
+    Returns the memory of every worker started from the process that loaded the data (or of this process alone,
+    when the app runs without a WSGI server).
+    """
+    pids = process_tree(LOADED_BY) if LOADED_BY != os.getpid() else [os.getpid()]
+    memory = []
+    for pid in pids:
+        try:
+            memory.append({**process_memory(pid), "parent": pid == LOADED_BY, "this_worker": pid == os.getpid()})
+        except OSError:
+            # a worker that has just stopped is left out
+            continue
+    return memory
+
+# function used at the beginning of the app.py file
+def add_health_check(app,
+                     data_version = None,
+                     cache_location: str = "data_cache"):
+    """
+    Adds a /health page to the Dash app that reports the data version and the memory of every worker, as JSON.
+    Data_version is a function that returns the version of the data the app is using (see reload.py); without it,
+    the version in the manifest written by build_data.py is reported.
+    """
+    import flask
+
+    @app.server.route("/health")
+    def health():
+        if data_version is not None:
+            version = data_version()
+        else:
+            version = manifest_entry(cache_location)
+        return flask.jsonify({"status": "ok",
+                              "data_version": version,
+                              "pid": os.getpid(),
+                              "workers": worker_memory()})
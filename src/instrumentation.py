@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+try:
+    # works if run by app.py
+    from src.timing import request_timings, hot_stage
+except:
+    # works if run as standalone program
+    from timing import request_timings, hot_stage
+
+# instrumentation is switched on with INSTRUMENT=1; when it is off, none of the hooks below are added
+ENABLED = os.environ.get("INSTRUMENT") == "1"
+
+# logger for the structured (one JSON object per line) timing logs
+logger = logging.getLogger("diplomas_and_disadvantage")
+
+# upper bounds (in seconds) of the callback latency histogram buckets on /metrics
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# path of the Dash endpoint that runs the callbacks
+CALLBACK_PATH = "/_dash-update-component"
+
+# function used in the build_dataset function in build_data.py and in the instrument_app function
+def log_event(event: str,
+              **fields):
+    """
+    Writes one structured log line (a JSON object with the event name and the fields) when instrumentation is on.
+    """
+    if ENABLED:
+        logger.info(json.dumps({"event": event, **fields}, default=str))
+
+# function used in the instrument_app function
+def server_timing(stages: dict
+                  ) -> str:
+    """
+    Returns the Server-Timing header value for the stage timings of one request (i.e. "create_map;dur=31.2, total;dur=40.5").
+    Durations are in milliseconds, as the header expects.
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items())
+
+# function used on the callback functions in app.py
+def timed_callback(func):
+    """
+    Returns the callback function with its run time recorded as the "callback" stage of the request.
+    The rest of the request (Dash checking the inputs and serializing the output to JSON) is the "serialize" stage.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with hot_stage("callback"):
+            return func(*args, **kwargs)
+    return wrapper
+
+class CallbackMetrics:
+    """
+    Keeps a latency histogram and stage totals for each callback, shared by every request thread.
+    """
+
+    def __init__(self,
+                 buckets: list = BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.callbacks = {}
+
+    def observe(self,
+                callback: str,
+                seconds: float,
+                stages: dict):
+        with self.lock:
+            metrics = self.callbacks.setdefault(callback, {"counts": [0] * len(self.buckets), "count": 0, "sum": 0.0, "stages": {}})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    metrics["counts"][i] += 1
+            metrics["count"] += 1
+            metrics["sum"] += seconds
+            for stage, stage_seconds in stages.items():
+                metrics["stages"][stage] = metrics["stages"].get(stage, 0) + stage_seconds
+
+    def render(self,
+               caches
+               ) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+        Caches maps a name to a function made with lru_cache (i.e. cached_map in app.py), whose cache_info is reported;
+        it can also be a function that returns this dictionary, for caches that are replaced when the data is reloaded.
+        """
+        if callable(caches):
+            caches = caches()
+        lines = ["# TYPE dash_callback_seconds histogram"]
+        with self.lock:
+            for callback, metrics in sorted(self.callbacks.items()):
+                for bound, count in zip(self.buckets, metrics["counts"]):
+                    lines.append(f'dash_callback_seconds_bucket{{callback="{callback}",le="{bound}"}} {count}')
+                lines.append(f'dash_callback_seconds_bucket{{callback="{callback}",le="+Inf"}} {metrics["count"]}')
+                lines.append(f'dash_callback_seconds_sum{{callback="{callback}"}} {metrics["sum"]:.6f}')
+                lines.append(f'dash_callback_seconds_count{{callback="{callback}"}} {metrics["count"]}')
+            lines.append("# TYPE dash_callback_stage_seconds_total counter")
+            for callback, metrics in sorted(self.callbacks.items()):
+                for stage, seconds in metrics["stages"].items():
+                    lines.append(f'dash_callback_stage_seconds_total{{callback="{callback}",stage="{stage}"}} {seconds:.6f}')
+        for field in ["hits", "misses", "currsize", "maxsize"]:
+            lines.append(f"# TYPE cache_{field} gauge")
+            for name, cached in caches.items():
+                lines.append(f'cache_{field}{{cache="{name}"}} {getattr(cached.cache_info(), field) or 0}')
+        return "\n".join(lines) + "\n"
+
+# function used at the beginning of the app.py file
+def instrument_app(app,
+                   caches
+                   ) -> CallbackMetrics:
+    """
+    Adds stage timings to every callback request of the Dash app, and returns the metrics they are collected in.
+    Each callback response gets a Server-Timing header and a structured log line, and /metrics serves the latency
+    histograms and the statistics of the caches (a dictionary of name to lru_cache function, or a function that returns one).
+    """
+    import flask
+
+    metrics = CallbackMetrics()
+    server = app.server
+
+    # print the structured logs on their own if the app hasn't set up logging
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    @server.before_request
+    def start_timings():
+        if flask.request.path.endswith(CALLBACK_PATH):
+            flask.g.timings_token = request_timings.set({})
+            flask.g.timings_start = time.perf_counter()
+
+    @server.after_request
+    def finish_timings(response):
+        if "timings_token" not in flask.g:
+            return response
+        seconds = time.perf_counter() - flask.g.timings_start
+        stages = request_timings.get()
+        request_timings.reset(flask.g.timings_token)
+
+        # the callback is named after the function Dash registered for the output (i.e. "display_map")
+        body = flask.request.get_json(silent=True) or {}
+        output = body.get("output", "")
+        callback = getattr(app.callback_map.get(output, {}).get("callback"), "__name__", output)
+
+        if "callback" in stages:
+            stages["serialize"] = max(seconds - stages["callback"], 0)
+        stages["total"] = seconds
+        response.headers["Server-Timing"] = server_timing(stages)
+        metrics.observe(callback, seconds, stages)
+        log_event("callback", callback=callback, status=response.status_code, bytes=response.content_length,
+                  changed=body.get("changedPropIds"), ms={stage: round(value * 1000, 3) for stage, value in stages.items()})
+        return response
+
+    @server.route("/metrics")
+    def metrics_endpoint():
+        return flask.Response(metrics.render(caches), mimetype="text/plain; version=0.0.4")
+
+    return metrics
@@ -0,0 +1,337 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+try:
+    # works if run from the main folder (i.e. python -m src.load_test)
+    from src.util import METRICS
+    from src.health import process_tree
+except:
+    # works if run as standalone program
+    from util import METRICS
+    from health import process_tree
+
+# main folder of the repository, where app.py is started from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# server configurations that can be compared; {port} and {workers} are filled in when the server is started
+# threaded: the Flask development server started by app.py (one process, one thread per request)
+# processes: the Flask development server with one process per request, up to workers at a time
+# gunicorn: gunicorn with workers processes forked from a preloaded app (see wsgi.py; gunicorn has to be installed)
+SERVERS = {"threaded": [sys.executable, "app.py"],
+           "processes": [sys.executable, "-c", "import app; app.app.run(debug=False, threaded=False, processes={workers})"],
+           "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "wsgi:server"]}
+
+# settings a simulated user picks from
+SUBSET_OPTIONS = ["All", "HBCUs", "Tribal Colleges", "Community Colleges"]
+TOOLTIP_OPTIONS = [["County", "School"], ["County"], ["School"], []]
+
+# how often a simulated user changes each setting (the rest of the time they change the metric)
+SUBSET_CHANCE = 0.3
+TOOLTIP_CHANCE = 0.2
+
+# function used in the interactions function
+def callback_body(callback: str,
+                  settings: dict,
+                  changed: list
+                  ) -> dict:
+    """
+    Returns the request body the browser sends to /_dash-update-component for one callback in app.py.
+    Callback is "display_map", "summary_panel", "description_met", or "description_subset", settings holds the value of every input
+    (and the data version the page was built from, see map_version in app.py), and changed lists the inputs that
+    triggered the callback (empty when the page first loads).
+    """
+    subset_inputs = [{"id": "subset_radio", "property": "value", "value": settings["subset_radio"]},
+                     {"id": "subset_extra", "property": "value", "value": []},
+                     {"id": "subset_op", "property": "value", "value": "Union"}]
+    if callback == "display_map":
+        output = {"id": "graph", "property": "figure"}
+        inputs = subset_inputs + [{"id": "met_dd", "property": "value", "value": settings["met_dd"]},
+                                  {"id": "tooltip_checklist", "property": "value", "value": settings["tooltip_checklist"]}]
+        state = [{"id": "map_version", "property": "data", "value": settings["map_version"]}]
+    elif callback == "summary_panel":
+        output = {"id": "summary", "property": "children"}
+        inputs = subset_inputs + [{"id": "met_dd", "property": "value", "value": settings["met_dd"]}]
+        state = []
+    elif callback == "description_met":
+        output = {"id": "met_description", "property": "children"}
+        inputs = [{"id": "met_dd", "property": "value", "value": settings["met_dd"]}]
+        state = []
+    else:
+        output = {"id": "subset_description", "property": "children"}
+        inputs = subset_inputs
+        state = []
+    return {"output": output["id"] + "." + output["property"],
+            "outputs": output,
+            "inputs": inputs,
+            "changedPropIds": [name + ".value" for name in changed],
+            "state": state}
+
+# function used in the client function
+def interactions(rng: random.Random,
+                 count: int,
+                 version: str = None
+                 ) -> list:
+    """
+    Returns a realistic sequence of callback requests for one user: the page load, then count setting changes.
+    Each item is a (callback name, request body) pair, in the order the browser would send them.
+    Version is the data version of the running app (from /data-version), which a page loaded from it would send back.
+    """
+    settings = {"subset_radio": "All", "met_dd": "Rank", "tooltip_checklist": ["County", "School"], "map_version": version}
+
+    # the page load runs every callback once
+    requests = [(callback, callback_body(callback, settings, [])) for callback in ["display_map", "summary_panel", "description_met", "description_subset"]]
+
+    for _ in range(count):
+        roll = rng.random()
+        if roll < SUBSET_CHANCE:
+            settings["subset_radio"] = rng.choice([subset for subset in SUBSET_OPTIONS if subset != settings["subset_radio"]])
+            triggered = ["display_map", "summary_panel", "description_subset"]
+            changed = ["subset_radio"]
+        elif roll < SUBSET_CHANCE + TOOLTIP_CHANCE:
+            settings["tooltip_checklist"] = rng.choice([tooltips for tooltips in TOOLTIP_OPTIONS if tooltips != settings["tooltip_checklist"]])
+            triggered = ["display_map"]
+            changed = ["tooltip_checklist"]
+        else:
+            settings["met_dd"] = rng.choice([metric for metric in METRICS if metric != settings["met_dd"]])
+            triggered = ["display_map", "summary_panel", "description_met"]
+            changed = ["met_dd"]
+        requests.extend((callback, callback_body(callback, settings, changed)) for callback in triggered)
+    return requests
+
+# function used in the run_load_test function
+def client(port: int,
+           requests: list,
+           latencies: dict,
+           errors: list,
+           think_time: float,
+           rng: random.Random
+           ):
+    """
+    Sends the requests one after another over one keep-alive connection, like a single browser tab,
+    and adds the latency of each one (in seconds) to latencies under its callback name.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    for callback, body in requests:
+        payload = json.dumps(body)
+        start = time.perf_counter()
+        try:
+            connection.request("POST", "/_dash-update-component", payload, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            if response.status not in (200, 204):
+                errors.append(f"{callback}: HTTP {response.status}")
+        except (OSError, http.client.HTTPException) as error:
+            errors.append(f"{callback}: {error!r}")
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            continue
+        latencies[callback].append(time.perf_counter() - start)
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+    connection.close()
+
+# function used in the ServerMonitor class
+def process_usage(pid: int
+                  ) -> tuple:
+    """
+    Returns the CPU seconds used so far and the resident memory in bytes of a process, read from /proc.
+    The CPU time includes child processes that have already ended (i.e. the per-request processes of the processes server).
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime, stime, cutime, and cstime are the 14th to 17th fields of /proc/<pid>/stat (counted after the process name)
+    cpu_seconds = sum(int(field) for field in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss
+
+class ServerMonitor(threading.Thread):
+    """
+    Samples the CPU time and resident memory of the server and its child processes while the load test runs.
+    """
+
+    def __init__(self,
+                 pid: int,
+                 interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu = {}
+        self.rss = []
+        self.running = threading.Event()
+        self.running.set()
+
+    def sample(self):
+        total_rss = 0
+        for pid in process_tree(self.pid):
+            try:
+                cpu_seconds, rss = process_usage(pid)
+            except OSError:
+                # a process that ended keeps the last CPU time it was sampled with
+                continue
+            self.cpu[pid] = cpu_seconds
+            total_rss += rss
+        self.rss.append(total_rss)
+
+    def run(self):
+        while self.running.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running.clear()
+        self.join()
+        self.sample()
+
+# function used in the run_load_test function
+def percentiles(latencies: list,
+                seconds: float
+                ) -> dict:
+    """
+    Returns the number of requests, throughput (requests per second), and p50/p95/p99 latency in milliseconds.
+    """
+    if not latencies:
+        return {"requests": 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"requests": len(latencies),
+            "throughput": round(len(latencies) / seconds, 2),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+            "max_ms": round(max(latencies) * 1000, 2)}
+
+# function used in the run_load_test function
+def data_version(port: int
+                 ) -> str:
+    """
+    Returns the version of the data the app is using, from its /data-version page.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/data-version")
+    version = json.loads(connection.getresponse().read())["version"]
+    connection.close()
+    return version
+
+# function used in the run_load_test function
+def wait_for_server(port: int,
+                    server: subprocess.Popen,
+                    timeout: float = 300
+                    ):
+    """
+    Waits until the app answers on the port, and raises RuntimeError if the server stops or doesn't start in time.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"the server stopped with exit code {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/_dash-layout")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"the server did not start within {timeout} seconds")
+
+def run_load_test(server: str = "threaded",
+                  clients: int = 10,
+                  interactions_per_client: int = 20,
+                  think_time: float = 0,
+                  workers: int = 4,
+                  port: int = 8050,
+                  seed: int = 0,
+                  command: list = None
+                  ) -> dict:
+    """
+    Starts app.py with one of the SERVERS configurations, replays a sequence of interactions from each of clients
+    simulated users at the same time, and returns the results, ready to be written as JSON.
+    The map is drawn by the server (CLIENTSIDE_MAP=0), since that is the part of the app the server configuration affects,
+    and the data is not reloaded during the test (DATA_RELOAD_INTERVAL=0).
+    Command replaces the SERVERS configuration with another command line (with the same {port} and {workers} fields).
+    """
+    if command is not None:
+        server = "custom"
+    command = [part.format(port=port, workers=workers) for part in (command or SERVERS[server])]
+    env = {**os.environ, "PORT": str(port), "CLIENTSIDE_MAP": "0", "DATA_RELOAD_INTERVAL": "0"}
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port, process)
+        monitor = ServerMonitor(process.pid)
+        monitor.sample()
+        idle_cpu = sum(monitor.cpu.values())
+        idle_rss = monitor.rss[-1]
+
+        # every simulated user gets its own sequence, so runs with the same seed send the same requests
+        version = data_version(port)
+        sequences = [interactions(random.Random(seed + i), interactions_per_client, version) for i in range(clients)]
+        latencies = {"display_map": [], "summary_panel": [], "description_met": [], "description_subset": []}
+        errors = []
+        threads = [threading.Thread(target=client, args=(port, sequence, latencies, errors, think_time, random.Random(seed + i)))
+                   for i, sequence in enumerate(sequences)]
+
+        monitor.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        monitor.stop()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    cpu_seconds = sum(monitor.cpu.values()) - idle_cpu
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "server": server,
+            "command": command,
+            "clients": clients,
+            "interactions_per_client": interactions_per_client,
+            "think_time": think_time,
+            "seconds": round(seconds, 3),
+            "errors": len(errors),
+            "error_samples": errors[:10],
+            "total": percentiles([latency for values in latencies.values() for latency in values], seconds),
+            "callbacks": {callback: percentiles(values, seconds) for callback, values in latencies.items()},
+            "server_cpu_seconds": round(cpu_seconds, 3),
+            "server_cpu_cores": round(cpu_seconds / seconds, 2),
+            "server_rss_start_mb": round(idle_rss / 1e6, 1),
+            "server_rss_peak_mb": round(max(monitor.rss) / 1e6, 1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays map interactions against app.py from many clients at once.")
+    parser.add_argument("--server", choices=list(SERVERS), nargs="+", default=["threaded"],
+                        help="server configurations to compare (i.e. --server threaded gunicorn)")
+    parser.add_argument("--clients", type=int, default=10, help="number of simulated users at the same time")
+    parser.add_argument("--interactions", type=int, default=20, help="setting changes per simulated user")
+    parser.add_argument("--think-time", type=float, default=0, help="average seconds a user waits between requests")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes for the processes and gunicorn servers")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_test.json", help="file the results are written to")
+    args = parser.parse_args()
+
+    results = []
+    for server in args.server:
+        result = run_load_test(server, args.clients, args.interactions, args.think_time, args.workers, args.port, args.seed)
+        results.append(result)
+        print(f"{server}: {result['total'].get('throughput', 0)} requests/s over {result['seconds']} s, {result['errors']} errors, "
+              f"server CPU {result['server_cpu_cores']} cores, RSS {result['server_rss_start_mb']} -> {result['server_rss_peak_mb']} MB")
+        for callback, stats in result["callbacks"].items():
+            if stats["requests"]:
+                print(f"  {callback}: {stats['requests']} requests, p50 {stats['p50_ms']} ms, "
+                      f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
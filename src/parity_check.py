@@ -0,0 +1,130 @@
+import os
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point
+
+try:
+    # works if run from the repository root (i.e. python -m src.parity_check)
+    from src.create_map import assign_fips, collect_and_clean
+    from src.geometry import COUNTIES_URL, counties_file, load_counties
+except:
+    # works if run as standalone program
+    from create_map import assign_fips, collect_and_clean
+    from geometry import COUNTIES_URL, counties_file, load_counties
+
+# main folder of the repository, so the raw data and the cached county geojson are found wherever this is run from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_LOCATION = os.path.join(ROOT, "data_cache")
+
+# original per-point loop from collect_and_clean, kept here as the reference output
+def legacy_assign_fips(points: gpd.geoseries.GeoSeries,
+                       counties_gpd: gpd.geodataframe.GeoDataFrame
+                       ) -> list:
+    """
+    Returns a list with the fips code of the county that contains each point, or "0" if no county contains it.
+    This is the full polygon scan per school that assign_fips replaced; it is only used to check parity.
+    """
+    county_list = []
+    for point in points:
+        in_county = counties_gpd[counties_gpd.geometry.contains(point)]["id"]
+        try:
+            county_list.append(in_county.iloc[0])
+        except:
+            county_list.append("0")
+    return county_list
+
+def check_fips_parity(schools_location: str,
+                      counties_location: str = COUNTIES_URL,
+                      cache_location: str = CACHE_LOCATION
+                      ) -> int:
+    """
+    Compares the fips codes from assign_fips with the ones from the original loop and returns the number of mismatches.
+    Schools_location is the file location of the schools data (i.e. "raw_data/CSV_10312024-789.csv")
+    Counties_location is the location of the county geojson (defaults to the plotly dataset used by collect_and_clean)
+    Cache_location is the folder with the downloaded copy of the county geojson (the repository's "data_cache" by default)
+    """
+
+    # build the same school points that collect_and_clean builds
+    schools = pd.read_csv(schools_location)
+    points = gpd.GeoSeries([Point(xy) for xy in zip(schools["HD2023.Longitude location of institution"],
+                                                    schools["HD2023.Latitude location of institution"])])
+    counties_gpd = gpd.read_file(counties_file(counties_location, cache_location))
+
+    # run both implementations and compare them point by point
+    new = assign_fips(points, counties_gpd)
+    old = pd.Series(legacy_assign_fips(points, counties_gpd), index=points.index)
+    mismatches = (new != old).sum()
+    print(f"fips parity: {len(points) - mismatches}/{len(points)} schools match, {(old == '0').sum()} unmatched by the original loop")
+    return int(mismatches)
+
+# original row-by-row cleaning from collect_and_clean, kept here as the reference output
+def legacy_collect_and_clean(ranks_location: str,
+                             schools_location: str,
+                             counties_location: str = COUNTIES_URL,
+                             cache_location: str = CACHE_LOCATION
+                             ) -> list:
+    """
+    Returns the same list as collect_and_clean, made with the original apply calls, inferred dtypes, and per-school county loop.
+    This is only used to check that the columnar version in create_map.py gives identical output.
+    """
+    counties = load_counties(counties_location, cache_location)
+    counties_gpd = gpd.read_file(counties_file(counties_location, cache_location))
+
+    ranks = pd.read_excel(ranks_location, dtype={"fips": str})
+    ranks.dropna(subset="fips", inplace = True)
+    ranks["fips"] = ranks["fips"].apply(lambda x: x.zfill(5))
+    ranks = ranks.sort_values(by = "rank1")
+    ranks = ranks.reset_index(drop=True).reset_index()
+    ranks["level_0"] = ranks["level_0"] + 1
+    ranks["name"] = ranks["name"].apply(lambda x: x.replace("city", "City"))
+
+    schools = pd.read_csv(schools_location)
+    schools.rename(columns={"institution name": "name",
+                            "HD2023.Longitude location of institution": "lon",
+                            "HD2023.Latitude location of institution": "lat"},
+                   inplace=True)
+    schools["below_bachelors"] = schools["DRVC2023.Number of students receiving an Associate's degree"] + schools["DRVC2023.Number of students receiving certificates of less than 12 weeks"] + schools["DRVC2023.Number of students receiving certificates of at least 12 weeks, but less than 1 year"] + schools["DRVC2023.Number of students receiving a certificate of 1 but less than 4 years"]
+    schools["bachelors_above"] = schools["DRVC2023.Number of students receiving a Bachelor's degree"] + schools["DRVC2023.Number of students receiving a Master's degree"] + schools["DRVC2023.Number of students receiving a Doctor's degree"]
+    schools["below_bachelors"] = schools["below_bachelors"].fillna(0)
+    schools["bachelors_above"] = schools["bachelors_above"].fillna(0)
+    schools["ratio"] = schools["below_bachelors"] / (schools["below_bachelors"] + schools["bachelors_above"])
+    schools["community_college"] = schools.apply(lambda x: 1 if x["ratio"] > 0.9 and x["HD2023.Control of institution"] == "Public" else 0, axis=1)
+
+    schools["coordinates"] = list(zip(schools.lon, schools.lat))
+    schools["coordinates"] = schools["coordinates"].apply(Point)
+    schools = gpd.GeoDataFrame(schools, geometry="coordinates")
+    schools["fips"] = legacy_assign_fips(schools["coordinates"], counties_gpd)
+    schools = schools.merge(ranks, how = "inner", on="fips")
+    return [counties, ranks, schools]
+
+def check_clean_parity(ranks_location: str,
+                       schools_location: str,
+                       counties_location: str = COUNTIES_URL,
+                       cache_location: str = CACHE_LOCATION
+                       ) -> bool:
+    """
+    Compares the ranks and schools outputs of collect_and_clean with the original row-by-row version and returns True if they are identical.
+    Also prints how long each stage of collect_and_clean took.
+    """
+    timings = {}
+    _, ranks, schools = collect_and_clean(ranks_location, schools_location, counties_location, cache_location, timings=timings)
+    _, legacy_ranks, legacy_schools = legacy_collect_and_clean(ranks_location, schools_location, counties_location, cache_location)
+    print("collect_and_clean stages (seconds):", {stage: round(seconds, 3) for stage, seconds in timings.items()})
+
+    # values, dtypes, column order, and index all have to match
+    try:
+        pd.testing.assert_frame_equal(ranks, legacy_ranks)
+        pd.testing.assert_frame_equal(schools, legacy_schools)
+    except AssertionError as error:
+        print("cleaning parity failed:", error)
+        return False
+    print(f"cleaning parity: ranks ({len(ranks)} rows) and schools ({len(schools)} rows) are identical")
+    return True
+
+if __name__ == "__main__":
+    ranks_location = os.path.join(ROOT, "raw_data", "Index of Deep Disadvantage - Updated.xlsx")
+    schools_location = os.path.join(ROOT, "raw_data", "CSV_10312024-789.csv")
+    mismatches = check_fips_parity(schools_location)
+    identical = check_clean_parity(ranks_location, schools_location)
+    if mismatches or not identical:
+        raise SystemExit(1)
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+
+try:
+    # works if run by build_data.py
+    from src.geometry import counties_to_gdf
+    from src.util import PROXIMITY_RADII, subset_column, prepare_subsets
+except:
+    # works if run as standalone program
+    from geometry import counties_to_gdf
+    from util import PROXIMITY_RADII, subset_column, prepare_subsets
+
+# mean radius of the Earth, for great-circle distances
+EARTH_RADIUS_MILES = 3958.8
+
+# decimals the county centroids are rounded to (about a meter), so the browser gets them short and measures from the same points
+CENTROID_DECIMALS = 5
+
+# function used in the nearest_miles and count_within functions
+def haversine_miles(lon1: np.ndarray,
+                    lat1: np.ndarray,
+                    lon2: np.ndarray,
+                    lat2: np.ndarray
+                    ) -> np.ndarray:
+    """
+    Returns the great-circle distance in miles between each pair of points (in degrees of longitude and latitude).
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# function used in the add_proximity function
+def county_centroids(counties: dict,
+                     fips: pd.Series
+                     ) -> list:
+    """
+    Returns the longitude and latitude of the centroid of each county in fips (the county's shape in the county geojson),
+    or NaN for a county that isn't in the geojson.
+    """
+    import shapely
+
+    counties_gpd = counties_to_gdf(counties)
+    # the centroid of the shape in degrees, which is close enough for county sized shapes
+    centroids = shapely.centroid(np.asarray(counties_gpd.geometry.values))
+    row = pd.Index(counties_gpd["id"]).get_indexer(fips)
+    lon = np.where(row >= 0, shapely.get_x(centroids)[row], np.nan)
+    lat = np.where(row >= 0, shapely.get_y(centroids)[row], np.nan)
+    return [lon, lat]
+
+# function used in the nearest_miles and count_within functions
+def bounding_boxes(lon: np.ndarray,
+                   lat: np.ndarray,
+                   miles: np.ndarray
+                   ) -> list:
+    """
+    Returns the boxes (in degrees) that contain every point within miles of each point, as the row each box belongs to
+    and the shapely boxes. A box that crosses the 180th meridian is split in two, so each point can have two boxes.
+    """
+    import shapely
+
+    # the latitude range is exact; the longitude range is the widest the circle reaches at that latitude
+    angle = np.asarray(miles, dtype="float64") / EARTH_RADIUS_MILES
+    dlat = np.degrees(angle)
+    ratio = np.sin(angle) / np.cos(np.radians(lat))
+    with np.errstate(invalid="ignore"):
+        dlon = np.where((ratio >= 1) | (np.abs(lat) + dlat >= 90), 180, np.degrees(np.arcsin(np.clip(ratio, 0, 1))))
+    west, east = lon - dlon, lon + dlon
+    south, north = np.maximum(lat - dlat, -90), np.minimum(lat + dlat, 90)
+
+    rows = np.arange(len(lon))
+    wraps_west = west < -180
+    wraps_east = east > 180
+    owners = np.concatenate([rows, rows[wraps_west], rows[wraps_east]])
+    boxes = shapely.box(np.concatenate([np.maximum(west, -180), west[wraps_west] + 360, np.full(wraps_east.sum(), -180.0)]),
+                        np.concatenate([south, south[wraps_west], south[wraps_east]]),
+                        np.concatenate([np.minimum(east, 180), np.full(wraps_west.sum(), 180.0), east[wraps_east] - 360]),
+                        np.concatenate([north, north[wraps_west], north[wraps_east]]))
+    return [owners, boxes]
+
+# function used in the add_proximity function
+def nearest_miles(tree: "shapely.STRtree",
+                  school_lon: np.ndarray,
+                  school_lat: np.ndarray,
+                  lon: np.ndarray,
+                  lat: np.ndarray
+                  ) -> np.ndarray:
+    """
+    Returns the great-circle distance in miles from each point to the nearest school in the tree.
+    The nearest school in degrees gives an upper bound on the distance; every school whose box could be closer than it
+    is then checked (see bounding_boxes), so the result is exact without comparing every point with every school.
+    """
+    import shapely
+
+    nearest = np.full(len(lon), np.nan)
+    found = ~np.isnan(lon)
+    if len(school_lon) == 0 or not found.any():
+        return nearest
+    points = shapely.points(lon[found], lat[found])
+    point_index, school_index = tree.query_nearest(points, all_matches=False)
+    bound = np.full(len(points), np.inf)
+    bound[point_index] = haversine_miles(lon[found][point_index], lat[found][point_index], school_lon[school_index], school_lat[school_index])
+
+    # check every school within the bound of each point
+    owners, boxes = bounding_boxes(lon[found], lat[found], bound * (1 + 1e-9))
+    box_index, school_index = tree.query(boxes)
+    point_index = owners[box_index]
+    distances = haversine_miles(lon[found][point_index], lat[found][point_index], school_lon[school_index], school_lat[school_index])
+    np.minimum.at(bound, point_index, distances)
+    nearest[found] = bound
+    return nearest
+
+# function used in the add_proximity function
+def count_within(tree: "shapely.STRtree",
+                 school_lon: np.ndarray,
+                 school_lat: np.ndarray,
+                 lon: np.ndarray,
+                 lat: np.ndarray,
+                 miles: float
+                 ) -> np.ndarray:
+    """
+    Returns the number of schools in the tree within miles (great-circle distance) of each point.
+    Only the schools in each point's bounding box (see bounding_boxes) are measured.
+    """
+    found = np.flatnonzero(~np.isnan(lon))
+    if len(school_lon) == 0 or len(found) == 0:
+        return np.zeros(len(lon), dtype="int64")
+    owners, boxes = bounding_boxes(lon[found], lat[found], np.full(len(found), float(miles)))
+    box_index, school_index = tree.query(boxes)
+    point_index = found[owners[box_index]]
+    within = haversine_miles(lon[point_index], lat[point_index], school_lon[school_index], school_lat[school_index]) <= miles
+    return np.bincount(point_index[within], minlength=len(lon))
+
+# function used in the add_proximity and subset_proximity functions
+def proximity_columns(lon: np.ndarray,
+                      lat: np.ndarray,
+                      school_lon: np.ndarray,
+                      school_lat: np.ndarray,
+                      subset: str,
+                      radii: list = PROXIMITY_RADII
+                      ) -> dict:
+    """
+    Returns the proximity metrics of one subset of schools (at school_lon and school_lat) for the points at lon and lat
+    (the county centroids): the miles to the nearest school and the number of schools within each radius in radii,
+    named with subset_column in util.py (i.e. "nearest_miles | HBCUs", "within_50_miles | HBCUs").
+    """
+    import shapely
+
+    # one spatial index over the points of the schools in the subset
+    tree = shapely.STRtree(shapely.points(school_lon, school_lat))
+    columns = {subset_column("nearest_miles", subset): nearest_miles(tree, school_lon, school_lat, lon, lat).round(1)}
+    for radius in radii:
+        counts = count_within(tree, school_lon, school_lat, lon, lat, radius)
+        columns[subset_column(f"within_{radius}_miles", subset)] = pd.to_numeric(counts, downcast="integer")
+    return columns
+
+# function used in build_data.py, benchmark.py, and create_map.py
+def add_proximity(ranks: pd.core.frame.DataFrame,
+                  schools: pd.core.frame.DataFrame,
+                  counties: dict,
+                  radii: list = PROXIMITY_RADII
+                  ) -> pd.core.frame.DataFrame:
+    """
+    Returns the county table with the centroid of each county ("centroid_lon" and "centroid_lat", rounded to about a meter)
+    and the proximity metrics added for every subset from prepare_subsets in util.py: the miles from the county's centroid
+    to the nearest school in the subset, and the number of schools in the subset within each radius in radii.
+    Each column is named with subset_column in util.py (i.e. "nearest_miles | HBCUs", "within_50_miles | All").
+    Ranks and schools are the tables from compact_frames in create_map.py, and counties is the county geojson.
+    A county that isn't in the geojson has no distance and a count of 0 (it isn't drawn on the map).
+    The centroids are kept so the metrics of a combined subset can be computed the same way when it is chosen (see subset_proximity).
+    """
+    lon, lat = [values.round(CENTROID_DECIMALS) for values in county_centroids(counties, ranks["fips"])]
+    all_lon = schools["lon"].to_numpy()
+    all_lat = schools["lat"].to_numpy()
+
+    # the columns of the proximity metrics in METRICS in util.py, one of each for every subset
+    columns = {"centroid_lon": lon, "centroid_lat": lat}
+    for subset, bitmap in prepare_subsets(schools).items():
+        rows = np.flatnonzero(np.unpackbits(bitmap, count=len(schools)))
+        columns.update(proximity_columns(lon, lat, all_lon[rows], all_lat[rows], subset, radii))
+    return pd.concat([ranks, pd.DataFrame(columns, index=ranks.index)], axis=1)
+
+# function used in prepare_metrics in util.py
+def subset_proximity(ranks: pd.core.frame.DataFrame,
+                     schools: pd.core.frame.DataFrame,
+                     rows: np.ndarray,
+                     subset: str,
+                     radii: list = PROXIMITY_RADII
+                     ) -> pd.core.frame.DataFrame:
+    """
+    Returns the proximity metrics of the schools in rows (i.e. the rows of a combined subset from subset_rows in util.py)
+    for every county, as a table with the same columns add_proximity adds for a subset, named after subset.
+    Ranks is the county table from add_proximity, so the distances are measured from the same centroids.
+    """
+    lon, lat = ranks["centroid_lon"].to_numpy(), ranks["centroid_lat"].to_numpy()
+    columns = proximity_columns(lon, lat, schools["lon"].to_numpy()[rows], schools["lat"].to_numpy()[rows], subset, radii)
+    return pd.DataFrame(columns, index=ranks.index)
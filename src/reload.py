@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+try:
+    # works if run by app.py
+    from src.instrumentation import log_event
+except:
+    # works if run as standalone program
+    from instrumentation import log_event
+
+# function used in the DataReloader class
+def folder_signature(location: str
+                     ) -> tuple:
+    """
+    Returns the name, size, and modification time of every file in the folder (i.e. "raw_data"), which changes whenever
+    a file is added, removed, or rewritten. Reading this only touches the folder listing, so it is cheap to check often.
+    """
+    signature = []
+    with os.scandir(location) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(signature))
+
+class DataReloader:
+    """
+    Holds the active data snapshot and replaces it when a file in the raw data folder changes.
+    A snapshot is a dictionary with everything the callbacks use (the data, the tables built from it, and the figure
+    caches); it is built in full by load_snapshot before it replaces the old one, so callbacks that read
+    reloader.current once always see one complete snapshot and never wait for a rebuild.
+    """
+
+    def __init__(self,
+                 load_snapshot,
+                 raw_data_location: str,
+                 interval: float = 5,
+                 settle: float = 1):
+        self.load_snapshot = load_snapshot
+        self.raw_data_location = raw_data_location
+        self.interval = interval
+        self.settle = settle
+        self.signature = folder_signature(raw_data_location)
+        self.current = load_snapshot()
+        self.reloads = 0
+        self.last_error = None
+        self.thread_pid = None
+        self.lock = threading.Lock()
+
+    def check(self) -> bool:
+        """
+        Rebuilds and swaps in a new snapshot if the raw data folder has changed since the last check; returns whether it did.
+        If the rebuild fails, the current snapshot is kept and the error is recorded.
+        """
+        signature = folder_signature(self.raw_data_location)
+        if signature == self.signature:
+            return False
+
+        # a file that is still being copied in changes again; wait for the next check instead of reading it half written
+        time.sleep(self.settle)
+        if folder_signature(self.raw_data_location) != signature:
+            return False
+
+        start = time.perf_counter()
+        try:
+            snapshot = self.load_snapshot()
+        except Exception as error:
+            self.signature = signature
+            self.last_error = repr(error)
+            log_event("reload_failed", error=self.last_error)
+            return False
+
+        # replacing the reference is a single step, so a callback gets either the old snapshot or the new one
+        self.current = snapshot
+        self.signature = signature
+        self.reloads += 1
+        self.last_error = None
+        log_event("reload", version=snapshot["version"], seconds=round(time.perf_counter() - start, 3))
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except OSError as error:
+                # the folder can be briefly missing while it is replaced
+                self.last_error = repr(error)
+
+    def start(self):
+        """
+        Starts checking the raw data folder in a background thread, once per process.
+        Threads don't survive a fork, so each worker of a WSGI server starts its own when it handles its first request.
+        """
+        if self.interval <= 0 or self.thread_pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread_pid != os.getpid():
+                threading.Thread(target=self.run, daemon=True, name="data-reloader").start()
+                self.thread_pid = os.getpid()
+
+# function used at the beginning of the app.py file
+def add_reloader(app,
+                 reloader: DataReloader):
+    """
+    Starts the reloader with the first request each process handles, and adds a /data-version page that reports the
+    version of the active snapshot (the version in the manifest written by build_data.py) and when it was loaded.
+    """
+    import flask
+
+    @app.server.before_request
+    def start_reloader():
+        reloader.start()
+
+    @app.server.route("/data-version")
+    def data_version():
+        snapshot = reloader.current
+        return flask.jsonify({"version": snapshot["version"],
+                              "loaded_at": snapshot["loaded_at"],
+                              "reloads": reloader.reloads,
+                              "last_error": reloader.last_error})
@@ -0,0 +1,43 @@
+import mimetypes
+import os
+import re
+
+# files in the assets folder named after a hash of their contents (i.e. "counties.1a2b3c4d5e6f7a8b.json", see counties_asset
+# in geometry.py); their contents never change, so browsers can keep them for a year without checking them again
+HASHED_ASSET = re.compile(r"[\w-]+\.[0-9a-f]{16}\.\w+")
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# precompressed copies written next to a hashed file (see write_counties_asset in build_data.py), in order of preference
+PRECOMPRESSED = [("br", ".br"), ("gzip", ".gz")]
+
+# function used at the beginning of the app.py file
+def add_static_assets(app):
+    """
+    Changes how the Dash app's Flask server sends hashed files from the assets folder (see HASHED_ASSET): a precompressed copy
+    is sent if there is one the browser accepts (brotli first, then gzip), with a Cache-Control header that lets the browser
+    keep the file for ASSET_MAX_AGE seconds without asking again. Every other file in the assets folder is sent as before.
+    """
+    import flask
+
+    # Dash sends the assets folder with the static view of a blueprint named after the app's path prefix
+    server = app.server
+    endpoint = app.config.routes_pathname_prefix.replace("/", "_").replace(".", "_") + "dash_assets.static"
+    static = server.view_functions[endpoint]
+
+    def serve_asset(filename):
+        # only a plain file name is matched, so nothing outside the assets folder can be sent
+        location = os.path.join(app.config.assets_folder, filename)
+        if not HASHED_ASSET.fullmatch(filename) or not os.path.isfile(location):
+            return static(filename)
+
+        accepted = flask.request.accept_encodings
+        encoding, suffix = next(((encoding, suffix) for encoding, suffix in PRECOMPRESSED
+                                 if encoding in accepted and os.path.isfile(location + suffix)), (None, ""))
+        response = flask.send_file(location + suffix, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    server.view_functions[endpoint] = serve_asset
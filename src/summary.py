@@ -0,0 +1,203 @@
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+
+try:
+    # works if run by app.py
+    from src.util import METRICS, metric_settings, subset_rows
+except:
+    # works if run as standalone program
+    from util import METRICS, metric_settings, subset_rows
+
+# statistics kept in the summary cube for each subset and metric, in this order
+STATS = ["counties", "mean", "median", "q1", "q3"]
+
+# labels of the statistics in the summary panel
+STAT_LABELS = {"mean": "Mean", "median": "Median", "q1": "25th percentile", "q3": "75th percentile"}
+
+# number of bars in the summary panel histogram
+HISTOGRAM_BINS = 10
+
+# function used in the summary_stats function
+def quantile(ordered: np.ndarray,
+             q: float
+             ) -> float:
+    """
+    Returns the q quantile of the sorted values, interpolating linearly between the two closest values
+    (the same as numpy's default, written out so that summaryStats in assets/map_store.js gives exactly the same number).
+    """
+    position = (len(ordered) - 1) * q
+    low = int(np.floor(position))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+# function used in the prepare_summaries and subset_summary functions
+def summary_stats(values: np.ndarray,
+                  edges: np.ndarray
+                  ) -> list:
+    """
+    Returns the statistics in STATS and the histogram counts (one per bin between edges) of the values, leaving out missing values.
+    Values outside the edges aren't counted in the histogram; a value on the last edge is counted in the last bin.
+    """
+    values = values[~np.isnan(values)]
+    histogram = np.zeros(len(edges) - 1, dtype="int32")
+    if len(values) == 0:
+        return [np.array([0] + [np.nan] * (len(STATS) - 1)), histogram]
+    ordered = np.sort(values)
+    # summed one value at a time, in the same order as the browser sums them
+    mean = sum(values.tolist()) / len(values)
+    stats = np.array([len(values), mean, quantile(ordered, 0.5), quantile(ordered, 0.25), quantile(ordered, 0.75)])
+
+    bins = np.searchsorted(edges, values, side="right") - 1
+    bins[values == edges[-1]] = len(edges) - 2
+    inside = (bins >= 0) & (bins < len(edges) - 1)
+    histogram += np.bincount(bins[inside], minlength=len(edges) - 1).astype("int32")
+    return [stats, histogram]
+
+# function used in the prepare_summaries function
+def summary_decimals(edges: np.ndarray
+                     ) -> int:
+    """
+    Returns the number of decimals the summary panel shows for a metric, so that its range has about three significant digits
+    (i.e. 0 for the rank, 3 for a rate between 0 and 0.2).
+    """
+    span = edges[-1] - edges[0]
+    if not span > 0:
+        return 2
+    return int(min(4, max(0, 2 - np.floor(np.log10(span)))))
+
+# function used in the prepare_summaries function
+def histogram_edges(settings: dict,
+                    bins: int = HISTOGRAM_BINS
+                    ) -> np.ndarray:
+    """
+    Returns the edges of the histogram bins for an entry of prepare_metrics: equal steps from zmin to zmax.
+    """
+    return np.linspace(float(settings["zmin"]), float(settings["zmax"]), bins + 1)
+
+# function used in the prepare_summaries and subset_summary functions
+def host_counties(schools: pd.core.frame.DataFrame,
+                  rows
+                  ) -> np.ndarray:
+    """
+    Returns the rows in ranks of the counties with at least one of the schools in rows (the subset's host counties).
+    """
+    return np.unique(schools["county"].to_numpy()[rows])
+
+# function used at the beginning of the app.py file
+def prepare_summaries(schools: pd.core.frame.DataFrame,
+                      metric_table: dict,
+                      subset_bitmaps: dict,
+                      bins: int = HISTOGRAM_BINS
+                      ) -> dict:
+    """
+    Returns the summary cube: the statistics in STATS and a histogram of each metric across the host counties of each subset
+    in subset_bitmaps ("host"), and across all counties ("all"), computed once when the data is loaded.
+    Each of "host" and "all" is a numpy array indexed by [subset, metric, statistic], with the histogram counts in
+    "host_histogram" and "all_histogram" ([subset, metric, bin]), the bin edges in "edges" ([subset, metric, edge]), and the
+    number of decimals the panel shows in "decimals" ([subset, metric]).
+    The values are the county values in metric_table (from prepare_metrics in util.py), so for the proximity metrics
+    the counties are compared on the subset's own values.
+    """
+    subsets = list(subset_bitmaps)
+    metrics = list(METRICS)
+    cube = {"subsets": subsets,
+            "metrics": metrics,
+            "host": np.zeros((len(subsets), len(metrics), len(STATS))),
+            "all": np.zeros((len(subsets), len(metrics), len(STATS))),
+            "host_histogram": np.zeros((len(subsets), len(metrics), bins), dtype="int32"),
+            "all_histogram": np.zeros((len(subsets), len(metrics), bins), dtype="int32"),
+            "edges": np.zeros((len(subsets), len(metrics), bins + 1)),
+            "decimals": np.zeros((len(subsets), len(metrics)), dtype="int8")}
+    for i, subset in enumerate(subsets):
+        hosts = host_counties(schools, subset_rows(subset, subset_bitmaps, len(schools)))
+        for j, metric in enumerate(metrics):
+            settings = metric_settings(metric_table, metric, subset)
+            values = settings["z"].astype("float64")
+            edges = histogram_edges(settings, bins)
+            cube["edges"][i, j] = edges
+            cube["decimals"][i, j] = summary_decimals(edges)
+            cube["host"][i, j], cube["host_histogram"][i, j] = summary_stats(values[hosts], edges)
+            cube["all"][i, j], cube["all_histogram"][i, j] = summary_stats(values, edges)
+    return cube
+
+# function used in the summary_panel function in app.py
+def subset_summary(cube: dict,
+                   subset: str,
+                   metric: str,
+                   schools: pd.core.frame.DataFrame,
+                   metric_table: dict,
+                   subset_bitmaps: dict
+                   ) -> dict:
+    """
+    Returns the summary of the metric for the subset: the statistics and histogram of its host counties and of all counties.
+    Subsets in the cube are looked up. A combined subset label (i.e. "HBCUs ∩ Community Colleges") has the statistics of its
+    host counties computed from its schools. For most metrics, the rest (all counties and the bin edges) is the same for
+    every subset and is looked up; the proximity metrics have their own values for a combined subset, so for those
+    all counties, the bin edges, and the decimals are computed from its values the same way prepare_summaries does.
+    """
+    j = cube["metrics"].index(metric)
+    if subset in cube["subsets"]:
+        i = cube["subsets"].index(subset)
+        return {"host": dict(zip(STATS, cube["host"][i, j].tolist())),
+                "all": dict(zip(STATS, cube["all"][i, j].tolist())),
+                "host_histogram": cube["host_histogram"][i, j].tolist(),
+                "all_histogram": cube["all_histogram"][i, j].tolist(),
+                "edges": cube["edges"][i, j].tolist(),
+                "decimals": int(cube["decimals"][i, j])}
+
+    settings = metric_settings(metric_table, metric, subset)
+    values = settings["z"].astype("float64")
+    if METRICS[metric].get("by_subset"):
+        edges = histogram_edges(settings, cube["edges"].shape[2] - 1)
+        decimals = summary_decimals(edges)
+        everything, all_histogram = summary_stats(values, edges)
+    else:
+        edges, decimals = cube["edges"][0, j], cube["decimals"][0, j]
+        everything, all_histogram = cube["all"][0, j], cube["all_histogram"][0, j]
+    host, host_histogram = summary_stats(values[host_counties(schools, subset_rows(subset, subset_bitmaps, len(schools)))], edges)
+    return {"host": dict(zip(STATS, host.tolist())),
+            "all": dict(zip(STATS, everything.tolist())),
+            "host_histogram": host_histogram.tolist(),
+            "all_histogram": all_histogram.tolist(),
+            "edges": edges.tolist(),
+            "decimals": int(decimals)}
+
+# function used in the summary_inner_html function
+def format_stat(value: float,
+                decimals: int
+                ) -> str:
+    """
+    Returns a statistic as text with the number of decimals, or "–" if it is missing.
+    A value exactly halfway is rounded away from zero, the way toFixed rounds it in the browser (see formatStat in assets/map_store.js).
+    """
+    if value is None or np.isnan(value):
+        return "–"
+    return format(Decimal(float(value)).quantize(Decimal(1).scaleb(-decimals), rounding=ROUND_HALF_UP), "f")
+
+# function used in the summary_panel function in app.py
+def summary_inner_html(summary: dict,
+                       metric: str
+                       ) -> str:
+    """
+    Returns the summary panel text: a table of the statistics for the subset's host counties and for all counties,
+    and a histogram with the share of each in every bin. Assets/map_store.js builds the same text in summaryHtml.
+    """
+    host, everything, decimals = summary["host"], summary["all"], summary["decimals"]
+    html = f"<b>{metric}</b><br>Counties with schools in the subset ({int(host['counties'])}) compared with all counties ({int(everything['counties'])})"
+    html += "<table><tr><th></th><th>Subset counties</th><th>All counties</th></tr>"
+    for stat, label in STAT_LABELS.items():
+        html += f"<tr><td>{label}</td><td>{format_stat(host[stat], decimals)}</td><td>{format_stat(everything[stat], decimals)}</td></tr>"
+    html += "</table>"
+
+    # one row per bin, with a bar for the share of the subset counties (orange, like the school points) and of all counties
+    html += "<table>"
+    edges = summary["edges"]
+    for k in range(len(edges) - 1):
+        host_share = 100 * summary["host_histogram"][k] / host["counties"] if host["counties"] else 0
+        all_share = 100 * summary["all_histogram"][k] / everything["counties"] if everything["counties"] else 0
+        html += (f"<tr><td>{format_stat(edges[k], decimals)} – {format_stat(edges[k + 1], decimals)}</td><td style=\"width: 60%\">"
+                 f"<div style=\"background-color: darkorange; height: 6px; width: {format_stat(host_share, 1)}%\"></div>"
+                 f"<div style=\"background-color: #000d5e; height: 6px; width: {format_stat(all_share, 1)}%\"></div></td></tr>")
+    html += "</table>"
+    return html
@@ -0,0 +1,32 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# function used in collect_and_clean in create_map.py
+@contextmanager
+def stage_timer(timings: dict,
+                stage: str):
+    """
+    Adds the seconds spent inside the with block to timings[stage].
+    Timings can be None, in which case nothing is recorded.
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+# timings of the request being handled, set by instrumentation.py for each callback request when INSTRUMENT=1
+# (None outside of a request or when instrumentation is off, so hot_stage does nothing)
+request_timings = ContextVar("request_timings", default=None)
+
+# function used in map_values and create_map in create_map.py, in figure_cache.py, and in instrumentation.py
+def hot_stage(stage: str):
+    """
+    Adds the seconds spent inside the with block to the timings of the callback request being handled.
+    Used around the steps that run on every map update; outside of an instrumented request it only costs a lookup.
+    """
+    return stage_timer(request_timings.get(), stage)
@@ -1,5 +1,160 @@
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+from plotly.validators.choroplethmapbox import ColorscaleValidator
+
+# settings for each metric in the metric dropdown in app.py, in the order they are listed
+# column: the column in the ranks data (the same column is in the schools data after the merge in collect_and_clean)
+# decimals: number of decimals the values are rounded to (None to keep them as they are)
+# dtype: type the values are converted to (None to keep them as they are)
+# colorscale: deep_r means that a lower value indicates more disadvantage, deep means that a higher value indicates more disadvantage,
+#             and ice_r means values don't correspond to disadvantage (a higher number indicates higher racial concentration)
+# title: more formal name for the metric, used in the title of the map
+# description: text shown under the metric dropdown in app.py
+# by_subset (only on the proximity metrics below): the values depend on the subset, with one column per subset (see subset_column)
+# miles (only on the "Colleges Within" metrics below): the radius the schools are counted within
+METRICS = {
+    "Rank": {"column": "level_0",
+             "decimals": None,
+             "dtype": None,
+             "colorscale": "deep_r",
+             "title": "Deep Disadvantage-Ranked Counties",
+             "description": "This setting displays the ranking of the Index of Deep Disadvantage, with 1 being the most disadvantaged county and 3,141 being the least disadvantaged county.<br><br>This index is made of metrics in three categories: health, poverty, and social mobility. Health includes life expectancy and infant low birth weight rate. Poverty includes percent of residents in poverty and deep povery. Social mobility includes a social mobility score calculated by Chetty, Hendren, and Katz.<br><br>For more information about this metric, you can visit the project page linked at the bottom of this site."},
+    "Raw Disadvantage": {"column": "index",
+                         "decimals": 2,
+                         "dtype": None,
+                         "colorscale": "deep_r",
+                         "title": "Counties with Index of Deep Disadvantage",
+                         "description": "This setting displays the Index of Deep Disadvantage, with positive numbers indicating less disadvantaged counties and negative numbers indicating more disadvantaged counties.<br><br>This index is made of metrics in three categories: health, poverty, and social mobility. Health includes life expectancy and infant low birth weight rate. Poverty includes percent of residents in poverty and deep povery. Social mobility includes a social mobility score calculated by Chetty et al.<br><br>For more information about this metric, you can visit the project page linked at the bottom of this site."},
+    "Percent Below Poverty Line": {"column": "pct_belowpov",
+                                   "decimals": None,
+                                   "dtype": None,
+                                   "colorscale": "deep",
+                                   "title": "County Percentages of Residents in Poverty",
+                                   "description": "This setting displays the percent of the county population living in poverty, as reported by the 2019 5-year American Community Survey."},
+    "Percent Below Deep Poverty Line": {"column": "pct_deeppov",
+                                        "decimals": None,
+                                        "dtype": None,
+                                        "colorscale": "deep",
+                                        "title": "County Percentages of Residents in Deep Poverty",
+                                        "description": "This setting displays the percent of the county population living below 50% of the Federal Poverty Line, as reported by the 2019 5-year American Community Survey."},
+    "Life Expectancy": {"column": "life_exp",
+                        "decimals": None,
+                        "dtype": None,
+                        "colorscale": "deep_r",
+                        "title": "County Life Expectancies",
+                        "description": "This setting displays the life expectancy at birth, as reported by the County Health Rankings."},
+    "Low Birth Weight Rate": {"column": "lbw",
+                              "decimals": None,
+                              "dtype": None,
+                              "colorscale": "deep",
+                              "title": "County Infant Low Birth Weight Rates",
+                              "description": "This setting displays the infant low birth weight rate, which is the share of live births weighing less than 2,500 grams, as reported by the County Health Rankings"},
+    "Percent White": {"column": "pct.white.nonhisp",
+                      "decimals": None,
+                      "dtype": None,
+                      "colorscale": "ice_r",
+                      "title": "County Percentages of Residents who Identify as White",
+                      "description": "This setting displays the percentage of the county population that identifies as non-Hispanic white, as reported by the 2019 5-year American Community Survey."},
+    "Percent Black": {"column": "pct.black.nonhisp",
+                      "decimals": None,
+                      "dtype": None,
+                      "colorscale": "ice_r",
+                      "title": "County Percentages of Residents who Identify as Black",
+                      "description": "This setting displays the percentage of the county population that identifies as non-Hispanic Black, as reported by the 2019 5-year American Community Survey."},
+    "Percent Native": {"column": "pct.native",
+                       "decimals": None,
+                       "dtype": None,
+                       "colorscale": "ice_r",
+                       "title": "County Percentages of Residents who Identify as Native",
+                       "description": "This setting displays the percentage of the county population that identifies as Native, as reported by the 2019 5-year American Community Survey."},
+    "Percent Less Than High School Diploma": {"column": "pct.less.than.HS",
+                                              "decimals": None,
+                                              "dtype": None,
+                                              "colorscale": "deep",
+                                              "title": "County Percentages of Residents with Less Than High School Diploma",
+                                              "description": "This setting displays the percentage of the county 25 years and over with less than a high school diploma, as reported by the 2019 5-year American Community Survey."},
+    "Percent College Graduates": {"column": "pct.college.grad",
+                                  "decimals": None,
+                                  "dtype": None,
+                                  "colorscale": "deep_r",
+                                  "title": "County Percentages of Residents who are College Graduates",
+                                  "description": "This setting displays the percentage of the county 25 years and over with at least a bachelor's degree, as reported by the 2019 5-year American Community Survey."},
+    "Unemployment Rate": {"column": "unemployment.rate",
+                          "decimals": None,
+                          "dtype": None,
+                          "colorscale": "deep",
+                          "title": "County Umemployment Rates",
+                          "description": "This setting displays the county unemployment rate, as reported by the 2019 5-year American Community Survey."},
+    "Gini Coefficient": {"column": "gini",
+                         "decimals": None,
+                         "dtype": None,
+                         "colorscale": "deep",
+                         "title": "County Gini Coefficients",
+                         "description": "This setting displays the county Gini coefficient, as reported by the 2019 5-year American Community Survey.<br><br>The Gini coefficient is a measure of inequality/wealth income, with 0 representing perfect equality and 1 representing perfect inequality."},
+    "Socioeconomic Mobility": {"column": "mobility",
+                               "decimals": 2,
+                               "dtype": None,
+                               "colorscale": "deep_r",
+                               "title": "County Socioeconomic Mobilities",
+                               "description": "This setting displays the county social mobility, as measured in research by Chetty, Hendren, and Katz. It represents the mean household income rank for children whose parents were at the 25th percentile of the national income distribution."},
+    "Climate Disasters": {"column": "climate.disasters",
+                          "decimals": None,
+                          "dtype": "int",
+                          "colorscale": "deep",
+                          "title": "County Climate Disasters",
+                          "description": "This setting displays how often the county has been hit by climate disasters — floods, hurricanes or wildfires — deemed “major” by the federal government from 1989 through 2017, as reported by the Federal Emergency Management Agency (FEMA)."},
+}
+
+# radii (in miles) of the "Colleges Within" proximity metrics; each one adds a metric to the dropdown,
+# and the values for every subset and radius are computed when the prebuilt data is built (see proximity.py)
+PROXIMITY_RADII = [50]
+
+# proximity metrics: the distance from each county's centroid to the nearest school in the subset,
+# and the number of schools in the subset within each radius
+METRICS["Miles to Nearest College"] = {"column": "nearest_miles",
+                                       "decimals": None,
+                                       "dtype": None,
+                                       "colorscale": "deep",
+                                       "title": "Counties by Miles to the Nearest College",
+                                       "description": "This setting displays the distance in miles from the center of each county to the nearest school in the chosen subset, measured along the Earth's surface.",
+                                       "by_subset": True}
+for radius in PROXIMITY_RADII:
+    METRICS[f"Colleges Within {radius} Miles"] = {"column": f"within_{radius}_miles",
+                                                  "decimals": None,
+                                                  "dtype": None,
+                                                  "colorscale": "deep_r",
+                                                  "miles": radius,
+                                                  "title": f"Counties by Colleges Within {radius} Miles",
+                                                  "description": f"This setting displays the number of schools in the chosen subset within {radius} miles of the center of each county, measured along the Earth's surface.",
+                                                  "by_subset": True}
+
+# subsets of schools in the subset radio buttons in app.py, with the column and value that define each one
+SUBSETS = {"HBCUs": ("HD2023.Historically Black College or University", "Yes"),
+           "Tribal Colleges": ("HD2023.Tribal college", "Yes"),
+           "Community Colleges": ("community_college", 1)}
+
+# columns whose values can also be combined with the subsets above (i.e. "Control: Public", "Level: Four or more years")
+SUBSET_COLUMNS = {"Control": "HD2023.Control of institution",
+                  "Level": "HD2023.Level of institution"}
+
+# symbols used to join subsets in subset labels and titles
+UNION = " ∪ "
+INTERSECTION = " ∩ "
+
+# number format of the metric values in the tooltips (a d3-format string, as plotly uses them: up to 12 significant digits, without trailing zeros)
+TOOLTIP_FORMAT = ".12~g"
+
+# function used in the prepare_metrics function and in client_data.py
+def hovertemplates(metric: str
+                   ) -> dict:
+    """
+    Returns the plotly hovertemplates of the county and school tooltips for the metric.
+    The tooltips fill in the names from the text of each trace (see prepare_metrics), and the values from the county colors
+    ("z") and the school "customdata", so changing the metric only changes these two templates and the numbers.
+    """
+    return {"county_hovertemplate": "%{text}<br>" + metric + ": %{z:" + TOOLTIP_FORMAT + "}<extra></extra>",
+            "school_hovertemplate": "%{text}<br>County " + metric + ": %{customdata:" + TOOLTIP_FORMAT + "}<extra></extra>"}
 
 # function used in create_map function in create_map.py
 def create_title(subset: str,
@@ -7,7 +162,7 @@ def create_title(subset: str,
                 ) -> str:
     """
     Return the title of the figure based on the chosen metric and subset.
-    Subset refers to the set of schools (i.e. "All", "Community Colleges").
+    Subset refers to the set of schools (i.e. "All", "Community Colleges", "HBCUs ∩ Control: Public").
     Metric refers to the county disadvantage measure (i.e. "Rank", "Life Expectancy").
     """
     # if no particular subset, use "U.S. Colleges"; otherwise, include the name of the subset in the title
@@ -16,137 +171,185 @@ def create_title(subset: str,
     else:
         subset_phrase = subset
     
-    # get more formal name for metric to be included in the title
-    if metric == "Rank":
-        metric_phrase = "Deep Disadvantage-Ranked Counties"
-    elif metric == "Raw Disadvantage":
-        metric_phrase = "Counties with Index of Deep Disadvantage"
-    elif metric == "Percent Below Poverty Line":
-        metric_phrase = "County Percentages of Residents in Poverty"
-    elif metric == "Percent Below Deep Poverty Line":
-        metric_phrase = "County Percentages of Residents in Deep Poverty"
-    elif metric == "Life Expectancy":
-        metric_phrase = "County Life Expectancies"
-    elif metric == "Low Birth Weight Rate":
-        metric_phrase = "County Infant Low Birth Weight Rates"
-    elif metric == "Percent White":
-        metric_phrase = "County Percentages of Residents who Identify as White"
-    elif metric == "Percent Black":
-        metric_phrase = "County Percentages of Residents who Identify as Black"
-    elif metric == "Percent Native":
-        metric_phrase = "County Percentages of Residents who Identify as Native"
-    elif metric == "Percent Less Than High School Diploma":
-        metric_phrase = "County Percentages of Residents with Less Than High School Diploma"
-    elif metric == "Percent College Graduates":
-        metric_phrase = "County Percentages of Residents who are College Graduates"
-    elif metric == "Unemployment Rate":
-        metric_phrase = "County Umemployment Rates"
-    elif metric == "Gini Coefficient":
-        metric_phrase = "County Gini Coefficients"
-    elif metric == "Socioeconomic Mobility":
-        metric_phrase = "County Socioeconomic Mobilities"
-    elif metric == "Climate Disasters":
-        metric_phrase = "County Climate Disasters"
-    
-    # return the combined title
-    return (subset_phrase + " on " + metric_phrase)
+    # return the combined title, using the more formal name for the metric
+    return (subset_phrase + " on " + METRICS[metric]["title"])
 
-# function used in create_map function in create_map.py
-def subset_schools(subset: str,
-                   schools: gpd.geodataframe.GeoDataFrame
-                   ) -> gpd.geodataframe.GeoDataFrame:
-    """
-    Returns the schools geopandas dataframe, subset based on the user's choice.
-    Subset refers to the set of schools (i.e. "All", "Community Colleges").
-    Schools refers to the original schools geopandas dataframe.
-    """
-
-    # filters based on the column corresponding to the chosen subset
-    if subset == "HBCUs":
-        return(schools[schools["HD2023.Historically Black College or University"] == "Yes"])
-    elif subset == "Tribal Colleges":
-        return(schools[schools["HD2023.Tribal college"] == "Yes"])
-    elif subset == "Community Colleges":
-        return(schools[schools["community_college"] == 1])
+# function used in the metric_values function and in proximity.py
+def subset_column(column: str,
+                  subset: str
+                  ) -> str:
+    """
+    Returns the name of the column with a metric's values for one subset (i.e. "nearest_miles | HBCUs").
+    """
+    return column + " | " + subset
+
+# function used at the beginning of the app.py file
+def prepare_subsets(schools: pd.core.frame.DataFrame
+                    ) -> dict:
+    """
+    Returns a dictionary with a bitmap of the schools in each subset, computed once when the data is loaded.
+    Each bitmap is a numpy array with one bit per row of schools (packed with np.packbits), so 6,000 schools take 750 bytes.
+    Schools refers to the schools table from compact_frames in create_map.py.
+    """
+    subset_bitmaps = {"All": np.packbits(np.ones(len(schools), dtype=bool))}
+
+    # filters based on the column corresponding to each subset
+    for subset, (column, value) in SUBSETS.items():
+        subset_bitmaps[subset] = np.packbits((schools[column] == value).to_numpy())
+
+    # one subset for every value of the control and level columns
+    for label, column in SUBSET_COLUMNS.items():
+        for value in sorted(schools[column].dropna().unique()):
+            subset_bitmaps[label + ": " + value] = np.packbits((schools[column] == value).to_numpy())
+
+    return subset_bitmaps
+
+# function used in the display_map and description_subset functions in app.py
+def combine_subsets(subset_radio: str,
+                    subset_extra: list,
+                    subset_op: str
+                    ) -> str:
+    """
+    Returns the label of the subset made by combining the radio button subset with the extra subsets.
+    Subset_radio is the subset chosen with the radio buttons (i.e. "All", "HBCUs").
+    Subset_extra is the list of extra subsets chosen by the user (i.e. ["Community Colleges", "Control: Public"]).
+    Subset_op is either "Union" (schools in any of the subsets) or "Intersection" (schools in all of them).
+    """
+    names = [subset_radio] + [name for name in (subset_extra or []) if name != subset_radio]
+
+    # "All" joined with anything is still "All", and "All" intersected with anything is the other subsets
+    if "All" in names and len(names) > 1:
+        if subset_op == "Union":
+            return "All"
+        names.remove("All")
+
+    # the label is the subset names joined by the set symbol
+    if subset_op == "Union":
+        return UNION.join(names)
     else:
-        # if no particular subset, then original geopandas dataframe is returned
-        return schools
+        return INTERSECTION.join(names)
 
-# function used in the create_map function in create_map.py
-def county_settings(metric: str,
-                    ranks: pd.core.frame.DataFrame, 
-                    schools: gpd.geodataframe.GeoDataFrame
-                    ) -> list:
+# function used in map_values in create_map.py
+def subset_rows(subset: str,
+                subset_bitmaps: dict,
+                count: int
+                ) -> np.ndarray:
     """
-    Returns a list with the modified ranks dataframe, modified schools geopandas dataframe, and the colorscale.
-    Metric refers to the county disadvantage measure (i.e. "Rank", "Life Expectancy").
-    Ranks refers to the original ranks dataframe with counties and all of their disadvantage metrics.
-    Schools refers to the original schools geopandas dataframe.
-    """
-
-    # for each metric
-    if metric == "Rank":
-        ranks["metric_of_interest"] = ranks["level_0"].copy()           # copy the metric into the metric_of_interest column in ranks
-        schools["metric_of_interest"] = schools["level_0"].copy()       # copy the metric into the metric_of_interest column in schools
-        color = "deep_r"                                                # set the colorscale - deep_r means that a lower value indicates more disadvantage
-    elif metric == "Raw Disadvantage":
-        ranks["metric_of_interest"] = round(ranks["index"].copy(), 2)
-        schools["metric_of_interest"] = round(schools["index"].copy(), 2)
-        color = "deep_r"
-    elif metric == "Percent Below Poverty Line":
-        ranks["metric_of_interest"] = ranks["pct_belowpov"].copy()
-        schools["metric_of_interest"] = schools["pct_belowpov"].copy()
-        color = "deep"
-    elif metric == "Percent Below Deep Poverty Line":
-        ranks["metric_of_interest"] = ranks["pct_deeppov"].copy()
-        schools["metric_of_interest"] = schools["pct_deeppov"].copy()
-        color = "deep"                                                  # deep colorscale means that a higher value indicates more disadvantage
-    elif metric == "Life Expectancy":
-        ranks["metric_of_interest"] = ranks["life_exp"].copy()
-        schools["metric_of_interest"] = schools["life_exp"].copy()
-        color = "deep_r"
-    elif metric == "Low Birth Weight Rate":
-        ranks["metric_of_interest"] = ranks["lbw"].copy()
-        schools["metric_of_interest"] = schools["lbw"].copy()
-        color = "deep"
-    elif metric == "Percent White":
-        ranks["metric_of_interest"] = ranks["pct.white.nonhisp"].copy()
-        schools["metric_of_interest"] = schools["pct.white.nonhisp"].copy()
-        color = "ice_r"                      # ice_r colorscale means values don't correspond to disadvantage; higher number indicates higher racial concentration 
-    elif metric == "Percent Black":
-        ranks["metric_of_interest"] = ranks["pct.black.nonhisp"].copy()
-        schools["metric_of_interest"] = schools["pct.black.nonhisp"].copy()
-        color = "ice_r"
-    elif metric == "Percent Native":
-        ranks["metric_of_interest"] = ranks["pct.native"].copy()
-        schools["metric_of_interest"] = schools["pct.native"].copy()
-        color = "ice_r"
-    elif metric == "Percent Less Than High School Diploma":
-        ranks["metric_of_interest"] = ranks["pct.less.than.HS"].copy()
-        schools["metric_of_interest"] = schools["pct.less.than.HS"].copy()
-        color = "deep"
-    elif metric == "Percent College Graduates":
-        ranks["metric_of_interest"] = ranks["pct.college.grad"].copy()
-        schools["metric_of_interest"] = schools["pct.college.grad"].copy()
-        color = "deep_r"
-    elif metric == "Unemployment Rate":
-        ranks["metric_of_interest"] = ranks["unemployment.rate"].copy()
-        schools["metric_of_interest"] = schools["unemployment.rate"].copy()
-        color = "deep"
-    elif metric == "Gini Coefficient":
-        ranks["metric_of_interest"] = ranks["gini"].copy()
-        schools["metric_of_interest"] = schools["gini"].copy()
-        color = "deep"
-    elif metric == "Socioeconomic Mobility":
-        ranks["metric_of_interest"] = round(ranks["mobility"].copy(), 2)
-        schools["metric_of_interest"] = round(schools["mobility"].copy(), 2)
-        color = "deep_r"
-    elif metric == "Climate Disasters":
-        ranks["metric_of_interest"] = ranks["climate.disasters"].copy().astype(int)
-        schools["metric_of_interest"] = schools["climate.disasters"].copy().astype(int)
-        color = "deep"
-    
-    return [ranks, schools, color]              # return modified ranks and schools, as well as the chosen colorscale
+    Returns the row numbers of the schools in the subset, using the bitmaps from prepare_subsets.
+    Subset is a subset label from combine_subsets (i.e. "HBCUs", "HBCUs ∩ Community Colleges").
+    Count is the number of rows in the schools dataframe.
+    """
+
+    # combine the bitmaps with bitwise or/and, which only touches a few hundred bytes per subset
+    if INTERSECTION in subset:
+        bitmap = np.bitwise_and.reduce([subset_bitmaps[name] for name in subset.split(INTERSECTION)])
+    elif UNION in subset:
+        bitmap = np.bitwise_or.reduce([subset_bitmaps[name] for name in subset.split(UNION)])
+    else:
+        bitmap = subset_bitmaps[subset]
+    return np.flatnonzero(np.unpackbits(bitmap, count=count))
+
+# function used in the prepare_metrics function
+def metric_values(metric: str,
+                  frame: pd.core.frame.DataFrame,
+                  subset: str = None
+                  ) -> pd.Series:
+    """
+    Returns the values of the chosen metric, rounded and converted as set in METRICS.
+    Frame is the ranks dataframe (schools get their county's values through the "county" column).
+    Subset is the subset the values are for (i.e. "HBCUs"), only used for by_subset metrics.
+    """
+    settings = METRICS[metric]
+    if settings.get("by_subset"):
+        values = frame[subset_column(settings["column"], subset)]
+    else:
+        values = frame[settings["column"]]
+    if settings["decimals"] is not None:
+        values = values.round(settings["decimals"])
+    if settings["dtype"] is not None:
+        values = values.astype(settings["dtype"])
+    return values
+
+# function used at the beginning of the app.py file and in create_map.py
+def prepare_metrics(ranks: pd.core.frame.DataFrame,
+                    schools: pd.core.frame.DataFrame
+                    ) -> dict:
+    """
+    Returns a dictionary with everything the map needs for each metric, computed once when the data is loaded.
+    Ranks refers to the county table with all of the disadvantage metrics, and schools to the schools table (see compact_frames in create_map.py).
+    Nothing in ranks or schools is changed, and create_map only reads from the returned arrays,
+    so callbacks running at the same time in a threaded server don't share any mutable state
+    (the only thing added later is the proximity entry of a combined subset, kept in a thread-safe cache).
+    """
+    metric_table = {}
+    colorscales = ColorscaleValidator()
+    locations = ranks["fips"].to_numpy()
+    subset_bitmaps = prepare_subsets(schools)
+
+    # each school's county values are looked up through its row in ranks (the "county" column from compact_frames in create_map.py)
+    county = schools["county"].to_numpy()
+
+    # the names in the tooltips are the same for every metric, so every entry shares the same two arrays
+    # (the values are filled in by the hovertemplates, see the hovertemplates function)
+    county_labels = ranks["name"].to_numpy()
+    school_labels = (schools["name"] + "<br>County: " + county_labels[county]).to_numpy()
+
+    # everything the map needs for one set of county values
+    def metric_entry(metric, county_values, colorscale):
+        return {"locations": locations,
+                "z": county_values.to_numpy(),
+                "zmin": county_values.min(),
+                "zmax": county_values.max(),
+                "colorscale": colorscale,
+                # tooltip names and templates for counties and schools, and each school's county value for its tooltip
+                "county_labels": county_labels,
+                "school_labels": school_labels,
+                "school_values": county_values.to_numpy()[county],
+                **hovertemplates(metric)}
+
+    # the proximity metrics of a combined subset (i.e. "HBCUs ∩ Community Colleges"), measured to its own schools
+    # the first time it is chosen (see subset_proximity in proximity.py, which needs shapely, so it is only imported then)
+    @lru_cache(maxsize=32)
+    def combined_proximity(subset):
+        try:
+            from src.proximity import subset_proximity
+        except:
+            from proximity import subset_proximity
+        return subset_proximity(ranks, schools, subset_rows(subset, subset_bitmaps, len(schools)), subset)
+
+    def combined_entry(metric, colorscale):
+        @lru_cache(maxsize=32)
+        def entry(subset):
+            return metric_entry(metric, metric_values(metric, combined_proximity(subset), subset), colorscale)
+        return entry
+
+    for metric, settings in METRICS.items():
+        # written out as colors since plotly.js doesn't know the named scales
+        colorscale = colorscales.validate_coerce(settings["colorscale"])
+        if settings.get("by_subset"):
+            # proximity metrics have one entry for every subset, and one for a combined subset when it is chosen (see metric_settings)
+            metric_table[metric] = {"subsets": {subset: metric_entry(metric, metric_values(metric, ranks, subset), colorscale) for subset in subset_bitmaps},
+                                    "combined": combined_entry(metric, colorscale)}
+        else:
+            metric_table[metric] = metric_entry(metric, metric_values(metric, ranks), colorscale)
+    return metric_table
+
+# function used in map_values in create_map.py
+def metric_settings(metric_table: dict,
+                    metric: str,
+                    subset: str
+                    ) -> dict:
+    """
+    Returns the entry of prepare_metrics for the metric, and for by_subset metrics the entry for the subset.
+    Subset is a subset label from combine_subsets (i.e. "HBCUs", "HBCUs ∩ Community Colleges"); the entry of a combined subset
+    is computed from its own schools the first time it is asked for.
+    """
+    settings = metric_table[metric]
+    if "subsets" in settings:
+        if subset in settings["subsets"]:
+            return settings["subsets"][subset]
+        return settings["combined"](subset)
+    return settings
 
 # function used in the description_met function in app.py
 def metric_inner_html(met_dd: str
@@ -157,43 +360,38 @@ def metric_inner_html(met_dd: str
     """
 
     # returns a description of the selected metric
-    if met_dd == "Rank":
-        return("This setting displays the ranking of the Index of Deep Disadvantage, with 1 being the most disadvantaged county and 3,141 being the least disadvantaged county.<br><br>This index is made of metrics in three categories: health, poverty, and social mobility. Health includes life expectancy and infant low birth weight rate. Poverty includes percent of residents in poverty and deep povery. Social mobility includes a social mobility score calculated by Chetty, Hendren, and Katz.<br><br>For more information about this metric, you can visit the project page linked at the bottom of this site.")
-    elif met_dd == "Raw Disadvantage":
-        return("This setting displays the Index of Deep Disadvantage, with positive numbers indicating less disadvantaged counties and negative numbers indicating more disadvantaged counties.<br><br>This index is made of metrics in three categories: health, poverty, and social mobility. Health includes life expectancy and infant low birth weight rate. Poverty includes percent of residents in poverty and deep povery. Social mobility includes a social mobility score calculated by Chetty et al.<br><br>For more information about this metric, you can visit the project page linked at the bottom of this site.")
-    elif met_dd == "Percent Below Poverty Line":
-        return("This setting displays the percent of the county population living in poverty, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Percent Below Deep Poverty Line":
-        return("This setting displays the percent of the county population living below 50% of the Federal Poverty Line, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Life Expectancy":
-        return("This setting displays the life expectancy at birth, as reported by the County Health Rankings.")
-    elif met_dd == "Low Birth Weight Rate":
-        return("This setting displays the infant low birth weight rate, which is the share of live births weighing less than 2,500 grams, as reported by the County Health Rankings")
-    elif met_dd == "Percent White":
-        return("This setting displays the percentage of the county population that identifies as non-Hispanic white, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Percent Black":
-        return("This setting displays the percentage of the county population that identifies as non-Hispanic Black, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Percent Native":
-        return("This setting displays the percentage of the county population that identifies as Native, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Percent Less Than High School Diploma":
-        return("This setting displays the percentage of the county 25 years and over with less than a high school diploma, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Percent College Graduates":
-        return("This setting displays the percentage of the county 25 years and over with at least a bachelor's degree, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Unemployment Rate":
-        return("This setting displays the county unemployment rate, as reported by the 2019 5-year American Community Survey.")
-    elif met_dd == "Gini Coefficient":
-        return("This setting displays the county Gini coefficient, as reported by the 2019 5-year American Community Survey.<br><br>The Gini coefficient is a measure of inequality/wealth income, with 0 representing perfect equality and 1 representing perfect inequality.")
-    elif met_dd == "Socioeconomic Mobility":
-        return("This setting displays the county social mobility, as measured in research by Chetty, Hendren, and Katz. It represents the mean household income rank for children whose parents were at the 25th percentile of the national income distribution.")
-    elif met_dd == "Climate Disasters":
-        return("This setting displays how often the county has been hit by climate disasters — floods, hurricanes or wildfires — deemed “major” by the federal government from 1989 through 2017, as reported by the Federal Emergency Management Agency (FEMA).")
+    if met_dd in METRICS:
+        return METRICS[met_dd]["description"]
 
 #function used in the description_subset function in app.py  
-def subset_inner_html(subset_radio: str
+def subset_inner_html(subset: str
                       ) -> str:
     """
     Returns the description text for the user-chosen school subset.
-    Subset_radio is the subset chosen by the user in Dash.
+    Subset is a subset label from combine_subsets (i.e. "HBCUs", "HBCUs ∩ Community Colleges").
+    """
+
+    # returns a description of each selected subset, if there is one chosen
+    if INTERSECTION in subset:
+        names = subset.split(INTERSECTION)
+    else:
+        names = subset.split(UNION)
+    descriptions = [subset_description(name) for name in names]
+    descriptions = [description for description in descriptions if description]
+
+    # say how the subsets are combined when there is more than one
+    if len(names) > 1 and INTERSECTION in subset:
+        descriptions.append("The map shows the schools that are in all of these subsets: " + ", ".join(names) + ".")
+    elif len(names) > 1:
+        descriptions.append("The map shows the schools that are in any of these subsets: " + ", ".join(names) + ".")
+    return "<br><br>".join(descriptions)
+
+# function used in the subset_inner_html function
+def subset_description(subset_radio: str
+                       ) -> str:
+    """
+    Returns the description text for a single school subset.
+    Subset_radio is the subset name (i.e. "HBCUs", "Control: Public").
     """
 
     #returns a description of the selected metric, if there is one chosen
@@ -203,5 +401,9 @@ def subset_inner_html(subset_radio: str
         return("The term 'tribal college' describes a college that is a member of the American Indian Higher Education Consortium. Most are tribally controlled and located on reservations.")
     elif subset_radio == "Community Colleges":
         return("Community colleges are public universities that primarily confers associate's degrees and certificates.<br><br>The Integrated Postsecondary Education Data System classifies a school based on its highest degree offered, not the primary degree that it confers. Therefore, for the purposes of this visualization, I defined community colleges as public institutions where 90% of degrees confered in 2023 were associate's degrees or certificates.")
+    elif subset_radio.startswith("Control: "):
+        return("Control of institution, as reported by the Integrated Postsecondary Education Data System: " + subset_radio[len("Control: "):] + ".")
+    elif subset_radio.startswith("Level: "):
+        return("Level of institution (length of its longest program), as reported by the Integrated Postsecondary Education Data System: " + subset_radio[len("Level: "):] + ".")
     else:
-        return("")
\ No newline at end of file
+        return("")
@@ -0,0 +1,10 @@
+import gc
+
+# production entry point for a multi-worker WSGI server (i.e. gunicorn -c gunicorn.conf.py wsgi:server)
+# with preloading, importing app.py loads the prebuilt data (and warms the figure cache with FIGURE_CACHE_WARM=1)
+# once in the parent process, and every worker is forked from it and shares those pages instead of loading its own copy
+from app import app, server
+
+# move everything loaded so far out of the garbage collector's reach; otherwise the first collection in each worker
+# writes to every object's header, which copies the shared pages into that worker (copy-on-write)
+gc.freeze()